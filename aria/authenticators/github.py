@@ -2,7 +2,9 @@ from logging import getLogger
 from typing import Optional, Tuple
 from urllib.parse import urlencode
 
-from aiohttp import ClientSession, web
+from aiohttp import web
+
+from aria.http_client import HTTPClient
 
 from .models import Authenticator, AuthenticatorException
 
@@ -17,7 +19,7 @@ class GitHubAuthenticator(Authenticator):
         self.client_id = client_id
         self.client_secret = client_secret
 
-        self.session = ClientSession()
+        self.http = HTTPClient()
     
     async def get_register_url(self, callback: str, csrf: str, invite: str) -> str:
         return self.do_get_url(callback, csrf, invite)
@@ -64,7 +66,7 @@ class GitHubAuthenticator(Authenticator):
             "state": csrf
         }
         token = None
-        async with self.session.post(
+        async with self.http.session('api').post(
             GITHUB_OAUTH+"/access_token",
             params=params,
             headers={"Accept": "application/json"}
@@ -81,7 +83,7 @@ class GitHubAuthenticator(Authenticator):
             raise AuthenticatorException()
 
         uid = name = None
-        async with self.session.get(
+        async with self.http.session('api').get(
             GITHUB_API+"/user",
             headers={
                 "Authorization": f"token {token}",
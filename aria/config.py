@@ -9,14 +9,24 @@ class Config():
 
         self.player_socket = None
         self.stream_socket = None
+        self.db_backend = None
+        self.db_file = None
         self.db_endpoint = None
+        self.db_socket = None
+        self.db_cache_ttl = None
+        self.db_write_delay = None
         self.redis_endpoint = None
         self.token_db = None
         self.cache_dir = None
+        self.cache_quota = None
+        self.cache_policy = None
         self.player_location = None
         self.stream_location = None
         self.web_location = None
         self.domain = None
+        self.opus_passthrough = False
+        self.autoplay = None
+        self.rate_limit = None
 
         self.providers_config = None
         self.authenticators_config = None
@@ -31,14 +41,33 @@ class Config():
 
         self.player_socket = self.config.get('player_socket') or '/tmp/aria/player.sock'
         self.stream_socket = self.config.get('stream_socket') or '/tmp/aria/stream.sock'
+        # http: aria-database service at db_endpoint, sqlite: embedded database at db_file
+        self.db_backend = self.config.get('db_backend') or 'http'
+        self.db_file = self.config.get('db_file') or 'config/aria.sqlite3'
         self.db_endpoint = self.config.get('db_endpoint') or 'http://database:8080'
+        # optional unix socket of the database service; db_endpoint still names the host
+        self.db_socket = self.config.get('db_socket') or None
+        # seconds playlists and likes are cached for, 0 to disable
+        self.db_cache_ttl = self.config.get('db_cache_ttl', 30)
+        # seconds resolve cache entries and likes are buffered for, to write them in batches
+        self.db_write_delay = self.config.get('db_write_delay', 0.5)
         self.redis_endpoint = self.config.get('redis_endpoint') or 'redis://core-redis'
         self.token_db = self.config.get('token_db') or 'sqlite://config/token.sqlite3'
         self.cache_dir = self.config.get('cache_dir') or 'caches'
+        # MB, 0 for unlimited
+        self.cache_quota = self.config.get('cache_quota') or 0
+        self.cache_policy = self.config.get('cache_policy') or 'lru'
         self.player_location = self.config.get('player_location') or 'https://aria.sarisia.cc'
         self.stream_location = self.config.get('stream_location') or 'https://aria.sarisia.cc/stream/'
         self.web_location = self.config.get('web_locaiton') or 'https://gaiji.pro'
         self.domain = self.config.get('domain') or 'gaiji.pro'
+        # send opus sources without transcoding while every client declared the
+        # `gain` capability in hello, since they then apply `gain` of the state
+        self.opus_passthrough = self.config.get('opus_passthrough') or False
+        # random: uniform over Likes, fresh: avoid entries recently played in History
+        self.autoplay = self.config.get('autoplay') or 'random'
+        # token buckets and concurrency of player ops, see aria.ratelimit for defaults
+        self.rate_limit = self.config.get('rate_limit') or {}
 
         self.providers_config = self.config.get('providers_config') or {}
         self.authenticators_config = self.config.get('authenticators_config') or {}
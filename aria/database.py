@@ -1,93 +1,474 @@
-from functools import partialmethod
+import asyncio
+from collections import Counter, OrderedDict
+from functools import partial
 from logging import getLogger
-from typing import Any, Optional, Sequence
-
-from aiohttp import ClientSession
+from time import monotonic
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
 
 log = getLogger(__name__)
 
+# cached reads kept per key, e.g. pages of one playlist; least recently used go first
+READS_PER_KEY = 8
+
 class DatabaseError(Exception):
-    pass
+    def __init__(self, *args, status:int=None) -> None:
+        super().__init__(*args)
+        # HTTP status of the failed request, if any
+        self.status = status
+
+def entry_of(cache:dict, liked:bool) -> dict:
+    # playlist entry of a resolve cache entry, shaped like the ones storage returns
+    return {
+        "source": cache.get("provider") or '',
+        "title": cache.get("title") or '',
+        "uri": cache.get("uri"),
+        "thumbnail": cache.get("thumbnail") or '',
+        "thumbnail_small": cache.get("thumbnail") or '',
+        "is_liked": liked,
+        "meta": cache.get("meta") or ''
+    }
+
+class ReadCache():
+    """
+    Versioned read-through cache.
+
+    Every key has a version bumped on invalidation. A read stores its result
+    only if the version did not change while it was in flight, so a read racing
+    a write never caches the pre-write state. `ttl` bounds staleness from writers
+    other than us. Cached values are shared and must not be mutated.
+    At most `per_key` reads are kept for each key; expired ones are dropped.
+    """
+
+    def __init__(self, ttl:float, *, per_key:int=READS_PER_KEY) -> None:
+        self.ttl = ttl
+        self.per_key = per_key
+        # key -> {params: (expires, value)}, least recently used first
+        self.entries: Dict[str, 'OrderedDict[Hashable, Tuple[float, Any]]'] = {}
+        self.versions = Counter()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key:str, params:Hashable, loader:Callable[[], Awaitable[Any]]) -> Any:
+        now = monotonic()
+        reads = self.entries.get(key)
+        cached = reads.get(params) if reads else None
+        if cached and cached[0] > now:
+            self.hits += 1
+            reads.move_to_end(params)
+            return cached[1]
+        if cached:
+            del reads[params]
+
+        self.misses += 1
+        version = self.versions[key]
+        value = await loader()
+        if self.ttl and self.versions[key] == version:
+            self.store(key, params, (now + self.ttl, value))
+        return value
+
+    def store(self, key:str, params:Hashable, entry:Tuple[float, Any]) -> None:
+        now = monotonic()
+        reads = self.entries.get(key)
+        if reads is None:
+            reads = self.entries[key] = OrderedDict()
+        for expired in [p for p, (expires, _) in reads.items() if expires <= now]:
+            del reads[expired]
+
+        reads[params] = entry
+        reads.move_to_end(params)
+        while len(reads) > self.per_key:
+            reads.popitem(last=False)
+
+    def invalidate(self, *keys:str) -> None:
+        for key in keys:
+            self.versions[key] += 1
+            self.entries.pop(key, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'keys': len(self.entries),
+            'reads': sum(len(reads) for reads in self.entries.values()),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else None
+        }
+
+
+class RequestBatcher():
+    """
+    Collects single-key loads issued within `window` seconds into one call of
+    `load_many`, which takes a list of keys and returns {key: value}.
+    Concurrent loads of the same key share one slot.
+    """
+
+    def __init__(self, load_many:Callable[[List[str]], Awaitable[Dict[str, Any]]], *,
+                 window:float=0.003, max_size:int=100) -> None:
+        self.load_many = load_many
+        self.window = window
+        self.max_size = max_size
+        self.loop = asyncio.get_event_loop()
+
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.handle = None
+        self.batches = 0
+        self.keys = 0
+
+    async def load(self, key:str) -> Any:
+        future = self.pending.get(key)
+        if future is None:
+            future = self.pending[key] = self.loop.create_future()
+            if len(self.pending) >= self.max_size:
+                self.flush()
+            elif not self.handle:
+                self.handle = self.loop.call_later(self.window, self.flush)
+
+        # a cancelled caller must not cancel the slot shared with others
+        return await asyncio.shield(future)
+
+    def flush(self) -> None:
+        if self.handle:
+            self.handle.cancel()
+            self.handle = None
+
+        batch, self.pending = self.pending, {}
+        if batch:
+            self.loop.create_task(self.dispatch(batch))
+
+    async def dispatch(self, batch:Dict[str, asyncio.Future]) -> None:
+        self.batches += 1
+        self.keys += len(batch)
+        try:
+            results = await self.load_many(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(results.get(key))
+
+    def stats(self) -> dict:
+        return {
+            'batches': self.batches,
+            'keys': self.keys,
+            'keys_per_batch': self.keys / self.batches if self.batches else None
+        }
+
+
+class WriteBuffer():
+    """
+    Write-behind buffer coalescing writes by key; the last value put wins.
+
+    Pending values are written by `write_many`, which takes {key: value}, once
+    `delay` seconds passed since the first put or `max_size` keys are pending.
+    A failed batch is put back, unless newer values arrived, and retried with
+    exponential backoff; after `retries` failures in a row it is dropped and
+    passed to `on_drop`, if set.
+    """
+
+    def __init__(self, write_many:Callable[[Dict[str, Any]], Awaitable[None]], *,
+                 delay:float=0.5, max_size:int=200, retries:int=5, backoff:float=1, max_backoff:float=60) -> None:
+        self.write_many = write_many
+        self.on_drop: Optional[Callable[[Dict[str, Any]], None]] = None
+        self.delay = delay
+        self.max_size = max_size
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.loop = asyncio.get_event_loop()
+        self.lock = asyncio.Lock()
+
+        self.pending: Dict[str, Any] = {}
+        self.handle = None
+        self.failures = 0
+
+        self.puts = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.written = 0
+        self.retried = 0
+        self.dropped = 0
+
+    def __contains__(self, key:str) -> bool:
+        return key in self.pending
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def get(self, key:str, default:Any=None) -> Any:
+        return self.pending.get(key, default)
+
+    def put(self, key:str, value:Any) -> None:
+        self.puts += 1
+        if key in self.pending:
+            self.coalesced += 1
+        self.pending[key] = value
+
+        if len(self.pending) >= self.max_size:
+            self.loop.create_task(self.flush())
+        else:
+            self.schedule(self.delay)
+
+    def schedule(self, delay:float) -> None:
+        if not self.handle:
+            self.handle = self.loop.call_later(delay, self.on_timer)
+
+    def on_timer(self) -> None:
+        self.handle = None
+        self.loop.create_task(self.flush())
+
+    async def flush(self) -> None:
+        async with self.lock:
+            if self.handle:
+                self.handle.cancel()
+                self.handle = None
+
+            batch, self.pending = self.pending, {}
+            if not batch:
+                return
+
+            self.flushes += 1
+            try:
+                await self.write_many(batch)
+            except Exception:
+                self.on_failure(batch)
+                return
+
+            self.failures = 0
+            self.written += len(batch)
+
+    def on_failure(self, batch:Dict[str, Any]) -> None:
+        self.failures += 1
+        if self.failures > self.retries:
+            log.error(f"Dropping {len(batch)} writes after {self.retries} retries: ", exc_info=True)
+            self.dropped += len(batch)
+            self.failures = 0
+            if self.pending:
+                self.schedule(self.delay)
+            if self.on_drop:
+                self.on_drop(batch)
+            return
+
+        # keep values put while the batch was in flight
+        self.pending = {**batch, **self.pending}
+        self.retried += len(batch)
+        delay = min(self.backoff * 2 ** (self.failures - 1), self.max_backoff)
+        log.error(f"Failed to write {len(batch)} entries, retrying in {delay}s: ", exc_info=True)
+        self.schedule(delay)
+
+    def stats(self) -> dict:
+        return {
+            'pending': len(self.pending),
+            'puts': self.puts,
+            'coalesced': self.coalesced,
+            'flushes': self.flushes,
+            'written': self.written,
+            'retried': self.retried,
+            'dropped': self.dropped
+        }
+
 
 class Database():
+    """
+    Facade over the configured storage backend (see aria.storage),
+    adding read caching and request batching.
+    """
     ins = None
     init = False
 
-    def __new__(cls, endpoint:str=None) -> Any:
+    def __new__(cls, storage=None, **kwargs) -> Any:
         if not cls.ins:
             cls.ins = super().__new__(cls)
 
         return cls.ins
 
-    def __init__(self, endpoint:str=None) -> None:
+    def __init__(self, storage=None, *, cache_ttl:float=30, write_delay:float=0.5) -> None:
         if Database.init:
             return
         
         Database.init = True
-        self.sesison = ClientSession() # TOOD: do timeout
-        self.endpoint = endpoint
-        log.debug(f"endpoint set to {self.endpoint}")
+        self.storage = storage
+        self.cache = ReadCache(cache_ttl)
+        # single-key lookups made at the same time become one batch request
+        self.batchers = {
+            'cache': RequestBatcher(self.get_cache_many),
+            'likes': RequestBatcher(self.is_liked_many),
+            'gpm': RequestBatcher(self.resolve_gpm_many)
+        }
+        # resolve cache entries and likes are written behind, coalesced by uri
+        self.writes = {
+            'cache': WriteBuffer(self.write_cache, delay=write_delay),
+            'likes': WriteBuffer(self.write_likes, delay=write_delay)
+        }
+        log.debug(f"storage backend: {self.storage.name}")
 
-    async def perform(self, method:str, endpoint:str, *, params:dict=None, json:dict=None) -> Optional[dict]:
-        try:
-            async with self.sesison.request(method, f"{self.endpoint}{endpoint}", params=params, json=json) as resp:
-                payload = await resp.json(content_type=None)
-                log.debug(f"{method} {endpoint} (params: {params}, json: {json}) -> {resp.status}")
-
-                if resp.status == 200:
-                    return payload
-                else:
-                    raise DatabaseError()
-        except DatabaseError as e:
-            raise e
-        except Exception as e:
-            log.error(f"Further information: ", exc_info=True)
-            raise e
+    async def flush(self, *names:str) -> None:
+        for name in names or self.writes:
+            if self.writes[name]:
+                await self.writes[name].flush()
+
+    async def close(self) -> None:
+        await self.flush()
+        await self.storage.close()
 
-    get = partialmethod(perform, "GET")
-    post = partialmethod(perform, "POST")
-    delete = partialmethod(perform, "DELETE")
+    # Reads of playlists and likes go through self.cache.
+    # Every write below invalidates exactly the keys it changes.
+    # Reads showing titles or like states apply pending writes over what
+    # storage returned instead of flushing them.
+
+    def overlay(self, entries:Sequence[dict]) -> List[dict]:
+        cache, likes = self.writes['cache'], self.writes['likes']
+        if not cache and not likes:
+            return list(entries)
+
+        ret = []
+        for e in entries:
+            uri = e.get("uri")
+            if uri in cache:
+                e = {**e, **{k: v for k, v in entry_of(cache.get(uri), False).items() if v and k != "meta"}}
+            if uri in likes:
+                e = {**e, "is_liked": likes.get(uri)}
+            ret.append(e)
+        return ret
+
+    async def liked_entry(self, uri:str) -> dict:
+        # entry of a like not written yet, from the resolve cache or the GPM library
+        try:
+            return entry_of(await self.get_cache(uri), True)
+        except Exception:
+            pass
+        try:
+            meta = (await self.resolve_gpm(uri))["meta"]
+            return entry_of({"provider": "gpm", "uri": uri, "title": meta.get("title"),
+                             "thumbnail": meta.get("thumbnail")}, True)
+        except Exception:
+            return entry_of({"uri": uri}, True)
 
     async def get_playlists(self) -> Optional[dict]:
-        return await self.get("/playlist")
+        return await self.cache.get("playlists", None, self.storage.get_playlists)
 
-    async def get_playlist(self, name:str, *, limit:int=1000) -> Optional[dict]:
-        return await self.get(f"/playlist/{name}", params={"limit": limit})
+    async def get_playlist(self, name:str, *, limit:int=1000, cursor:str=None) -> Optional[dict]:
+        playlist = await self.cache.get(f"playlist:{name}", (limit, cursor),
+                                        partial(self.storage.get_playlist, name, limit=limit, cursor=cursor))
+        return {**playlist, "entries": self.overlay(playlist["entries"])} if playlist else playlist
 
     async def create_playlist(self, name:str) -> None:
-        await self.post("/playlist", params={"name": name})
+        try:
+            await self.storage.create_playlist(name)
+        finally:
+            self.cache.invalidate("playlists")
 
     async def delete_playlist(self, name:str) -> None:
-        await self.delete(f"/playlist", params={"name": name})
+        try:
+            await self.storage.delete_playlist(name)
+        finally:
+            self.cache.invalidate("playlists", f"playlist:{name}")
 
     async def add_to_playlist(self, name:str, uris:Sequence[str]) -> None:
-        await self.post(f"/playlist/{name}", json={"entries": uris})
+        try:
+            await self.storage.add_to_playlist(name, uris)
+        finally:
+            self.cache.invalidate("playlists", f"playlist:{name}")
 
     async def delete_from_playlist(self, name:str, uri:str) -> None:
-        await self.delete(f"/playlist/{name}", params={"uri": uri})
+        try:
+            await self.storage.delete_from_playlist(name, uri)
+        finally:
+            self.cache.invalidate("playlists", f"playlist:{name}")
 
-    async def get_likes(self, limit:int=1000) -> Optional[dict]:
-        return await self.get("/likes", params={"limit": limit})
+    async def get_likes(self, limit:int=1000, *, cursor:str=None) -> Optional[dict]:
+        likes = await self.cache.get("likes", (limit, cursor),
+                                     partial(self.storage.get_likes, limit=limit, cursor=cursor))
+        pending = dict(self.writes['likes'].pending)
+        if not likes or not pending:
+            return likes
+
+        try:
+            stored = await self.storage.is_liked_many(list(pending))
+        except Exception:
+            log.error("failed to read stored likes: ", exc_info=True)
+            stored = {}
+        stored = {uri for uri, liked in stored.items() if liked and liked.get("liked")}
+        added = [uri for uri, like in pending.items() if like and uri not in stored]
+        removed = [uri for uri, like in pending.items() if not like and uri in stored]
+
+        entries = self.overlay([e for e in likes["entries"] if pending.get(e["uri"], True)])
+        if not cursor and added:
+            # new likes are the most recent, so they lead the first page
+            shown = {e["uri"] for e in entries}
+            entries = [*await asyncio.gather(*[self.liked_entry(uri) for uri in reversed(added) if uri not in shown]),
+                       *entries]
+        ret = {**likes, "entries": entries}
+        if isinstance(likes.get("length"), int):
+            ret["length"] = likes["length"] + len(added) - len(removed)
+        return ret
 
     async def toggle_like(self, uri:str, like:bool) -> None:
-        await self.post("/likes", params={"uri": uri, "like": 1 if like else 0})
+        self.writes['likes'].put(uri, like)
+        self.cache.invalidate("likes")
+
+    async def write_likes(self, likes:Dict[str, bool]) -> None:
+        try:
+            await self.storage.toggle_likes(likes)
+        finally:
+            self.cache.invalidate("likes")
+
+    # Single-key lookups are served by the batch methods through self.batchers.
 
     async def is_liked(self, uri:str) -> Optional[dict]:
-        return await self.get("/likes/resolve", params={"uri": uri})
+        if uri in self.writes['likes']:
+            return {"liked": self.writes['likes'].get(uri)}
+        return await self.batchers['likes'].load(uri) or {"liked": False}
+
+    async def is_liked_many(self, uris:Sequence[str]) -> Dict[str, dict]:
+        pending = self.writes['likes']
+        ret = await self.storage.is_liked_many([uri for uri in uris if uri not in pending])
+        ret.update({uri: {"liked": pending.get(uri)} for uri in uris if uri in pending})
+        return ret
 
     async def get_cache(self, uri:str) -> Optional[dict]:
-        return await self.get("/cache", params={"uri": uri})
+        if uri in self.writes['cache']:
+            liked = await self.is_liked(uri)
+            return {**self.writes['cache'].get(uri), "liked": liked.get("liked")}
+
+        payload = await self.batchers['cache'].load(uri)
+        if payload is None:
+            raise DatabaseError()
+        return payload
+
+    async def get_cache_many(self, uris:Sequence[str]) -> Dict[str, dict]:
+        return await self.storage.get_cache_many(uris)
 
     async def store_cache(self, entries:Sequence[dict]) -> None:
-        await self.post("/cache", json={"entries": entries})
+        for e in entries:
+            self.writes['cache'].put(e["uri"], e)
+
+    async def write_cache(self, entries:Dict[str, dict]) -> None:
+        await self.storage.store_cache(list(entries.values()))
 
     async def update_gpm(self, entries:Sequence[dict], user:str) -> None:
-        await self.post("/gpm/update", params={"name": user}, json={"entries": entries})
+        # replaces the whole library of the user
+        await self.storage.update_gpm(entries, user)
+
+    async def upsert_gpm(self, entries:Sequence[dict], user:str) -> None:
+        await self.storage.upsert_gpm(entries, user)
+
+    async def remove_gpm(self, uris:Sequence[str], user:str) -> None:
+        await self.storage.remove_gpm(uris, user)
 
     async def search_gpm(self, query:str, *, limit=100) -> Optional[dict]:
-        return await self.get("/gpm/search", params={"limit": limit, "query": query})
+        return await self.storage.search_gpm(query, limit=limit)
 
     async def resolve_gpm(self, uri:str) -> Optional[dict]:
-        return await self.get("/gpm", params={"uri": uri})
+        payload = await self.batchers['gpm'].load(uri)
+        if payload is None:
+            raise DatabaseError()
+        return payload
+
+    async def resolve_gpm_many(self, uris:Sequence[str]) -> Dict[str, dict]:
+        return await self.storage.resolve_gpm_many(uris)
     
 # Database()
@@ -8,4 +8,7 @@ class ProviderNotReady(ProviderError):
     pass
 
 class EmptyPlaylist(AriaException):
-    pass
\ No newline at end of file
+    pass
+
+class DownloadError(AriaException):
+    pass
@@ -1,19 +1,131 @@
-import subprocess
+import asyncio
+from collections import deque
 from logging import getLogger
+import math
+import subprocess
+from typing import Callable, Optional, Tuple
 
 log = getLogger(__name__)
 
+# fixed attenuation applied on top of loudness normalization
+VOLUME = 0.05
+VOLUME_DB = 20 * math.log10(VOLUME)
+# stream thread sends one packet per tick
+PACKET_MS = 20
+# 20 ms opus silence, sent while switching away from passthrough
+SILENCE = b'\xf8\xff\xfe'
+
+
+def can_passthrough(stream_info:dict) -> bool:
+    try:
+        return (stream_info.get('codec_name') == 'opus'
+                and int(stream_info.get('sample_rate')) == 48000
+                and int(stream_info.get('channels')) == 2)
+    except (TypeError, ValueError):
+        return False
+
+def packet_duration(packet:bytes) -> float:
+    """
+    Duration of an opus packet in ms, from its TOC byte (RFC 6716 3.1)
+    """
+    toc = packet[0]
+    config = toc >> 3
+    if config < 12:
+        frame = (10, 20, 40, 60)[config % 4]
+    elif config < 16:
+        frame = (10, 20)[config % 2]
+    else:
+        frame = (2.5, 5, 10, 20)[config % 4]
+
+    code = toc & 3
+    if code == 0:
+        count = 1
+    elif code in (1, 2):
+        count = 2
+    else:
+        count = packet[1] & 0x3F if len(packet) > 1 else 0
+
+    return frame * count
+
+
+class OggOpusReader():
+    """
+    Minimal Ogg demuxer yielding the opus packets of a single logical stream
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.packets = deque()
+        self.partial = b''
+
+    def read_page(self) -> bool:
+        header = self.stream.read(27)
+        if len(header) < 27 or header[:4] != b'OggS':
+            return False
+
+        table = self.stream.read(header[26])
+        data = self.stream.read(sum(table))
+        pos = 0
+        for lacing in table:
+            self.partial += data[pos:pos+lacing]
+            pos += lacing
+            # lacing value below 255 terminates a packet
+            if lacing < 255:
+                self.packets.append(self.partial)
+                self.partial = b''
+
+        return True
+
+    def read_packet(self) -> bytes:
+        while not self.packets:
+            if not self.read_page():
+                return b''
+        return self.packets.popleft()
+
 
 class FFMpegPlayer():
-    def __init__(self, opus_encoder):
+    """
+    `allow_passthrough()` decides for each entry whether an opus source is sent
+    as it is. `on_fallback()` is called on the loop when a passthrough source
+    is switched to transcoding, since the gain of the state changes.
+    """
+
+    def __init__(self, opus_encoder, passthrough:Callable[[], bool]=None, on_fallback:Callable[[], None]=None):
         self.opus = opus_encoder
         self.ffmpeg = None
+        self.loop = asyncio.get_event_loop()
+
+        self.allow_passthrough = passthrough or (lambda: False)
+        self.on_fallback = on_fallback
+        # True while read() returns opus packets instead of PCM
+        self.passthrough = False
+        self.reader = None
+        self.checked = False
+        # set by the stream thread until the loop replaced the passthrough source
+        self.switching = False
+        self.entry = None
+
+    @property
+    def gain(self):
+        # gain in dB the client has to apply, since passthrough packets are not normalized
+        return (-self.entry.volume + VOLUME_DB) if self.passthrough else 0
 
     def create(self, entry):
         log.debug(f'Create FFMpeg for file: {entry.filename}')
         self.kill()
+        self.entry = entry
+        if self.allow_passthrough() and can_passthrough(entry.stream_info):
+            self.create_passthrough(entry)
+        else:
+            self.create_pcm(entry)
+
+    def create_pcm(self, entry):
+        self.passthrough = False
+        self.ffmpeg = self.start_pcm(entry)
+
+    def start_pcm(self, entry) -> Optional[subprocess.Popen]:
         try:
-            self.ffmpeg = subprocess.Popen(
+            ffmpeg = subprocess.Popen(
                 [
                     'ffmpeg',
                     '-i', entry.filename,
@@ -22,13 +134,39 @@ class FFMpegPlayer():
                     '-ar', '48000',
                     '-ac', '2',
                     '-vn',
-                    '-af', f'volume={-entry.volume}dB, volume=0.05',
+                    '-af', f'volume={-entry.volume}dB, volume={VOLUME}',
                     '-loglevel', 'quiet',
                     'pipe:1'
                 ],
                 stdout=subprocess.PIPE
             )
             log.debug('FFMpeg created!')
+            return ffmpeg
+        except:
+            log.error('Failed to start ffmpeg: ', exc_info=True)
+            return None
+
+    def create_passthrough(self, entry):
+        # remux only; packets are demuxed here and sent as they are
+        self.passthrough = True
+        self.checked = False
+        self.switching = False
+        try:
+            self.ffmpeg = subprocess.Popen(
+                [
+                    'ffmpeg',
+                    '-i', entry.filename,
+                    '-nostdin',
+                    '-map', '0:a:0',
+                    '-c:a', 'copy',
+                    '-f', 'ogg',
+                    '-loglevel', 'quiet',
+                    'pipe:1'
+                ],
+                stdout=subprocess.PIPE
+            )
+            self.reader = OggOpusReader(self.ffmpeg.stdout)
+            log.debug('FFMpeg created for opus passthrough!')
         except:
             log.error('Failed to start ffmpeg: ', exc_info=True)
 
@@ -36,9 +174,59 @@ class FFMpegPlayer():
         if self.ffmpeg:
             self.ffmpeg.kill()
             self.ffmpeg = None
+            self.reader = None
+        self.switching = False
+
+    def read(self) -> Tuple[bytes, bool]:
+        # CALLED FROM OTHER THREAD
+        # returns the data and whether it is an opus packet rather than PCM,
+        # decided from one look at the source since the loop may replace it
+        reader = self.reader
+        if reader:
+            return self.read_packet(reader), True
 
-    def read(self):
         ret = b''
-        if self.ffmpeg:
-            ret = self.ffmpeg.stdout.read(self.opus.FRAME_SIZE)
-        return ret if len(ret) == self.opus.FRAME_SIZE else b''
+        ffmpeg = self.ffmpeg
+        if ffmpeg:
+            ret = ffmpeg.stdout.read(self.opus.FRAME_SIZE)
+        return (ret if len(ret) == self.opus.FRAME_SIZE else b''), False
+
+    def read_packet(self, reader:OggOpusReader) -> bytes:
+        # CALLED FROM OTHER THREAD
+        if self.switching:
+            return SILENCE
+
+        packet = reader.read_packet()
+        while packet.startswith((b'OpusHead', b'OpusTags')):
+            packet = reader.read_packet()
+        if not packet and reader is not self.reader:
+            # the source was replaced while we read from it
+            return SILENCE
+
+        if packet and not self.checked:
+            self.checked = True
+            duration = packet_duration(packet)
+            if duration != PACKET_MS:
+                log.info(f'Opus packets are {duration} ms, not {PACKET_MS} ms. Fall back to transcoding.')
+                # processes are only replaced on the loop, where create() runs
+                self.switching = True
+                self.loop.call_soon_threadsafe(self.fall_back, reader)
+                return SILENCE
+
+        return packet
+
+    def fall_back(self, reader):
+        # create() may have moved on to another entry meanwhile
+        if self.reader is not reader:
+            return
+
+        old = self.ffmpeg
+        # the stream thread sees either the old reader with `switching` or the new process
+        self.ffmpeg = self.start_pcm(self.entry)
+        self.passthrough = False
+        self.reader = None
+        self.switching = False
+        if old:
+            old.kill()
+        if self.on_fallback:
+            self.on_fallback()
@@ -0,0 +1,130 @@
+from collections import Counter
+from logging import getLogger
+from typing import Any, Dict
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, TraceConfig, UnixConnector
+
+log = getLogger(__name__)
+
+# timeouts per call class
+TIMEOUTS = {
+    'database': ClientTimeout(total=10, connect=3),
+    'api': ClientTimeout(total=15, connect=5),
+    # whole files; only bound stalls
+    'download': ClientTimeout(total=None, connect=10, sock_read=30),
+}
+LIMIT = 100
+LIMIT_PER_HOST = 10
+DATABASE_LIMIT = 30
+KEEPALIVE_TIMEOUT = 60
+DNS_TTL = 300
+
+
+class HTTPClient():
+    """
+    HTTP sessions shared by the whole process.
+
+    The database gets its own connection pool, optionally over a Unix socket;
+    every other call class shares one pool with per-host limits.
+    Sessions are created on first use so they bind to the running loop.
+    """
+    ins = None
+    init = False
+
+    def __new__(cls, *args, **kwargs) -> Any:
+        if not cls.ins:
+            cls.ins = super().__new__(cls)
+
+        return cls.ins
+
+    def __init__(self, config=None) -> None:
+        if HTTPClient.init:
+            return
+
+        HTTPClient.init = True
+        self.db_socket = config.db_socket if config else None
+        self.connectors: Dict[str, Any] = {}
+        self.sessions: Dict[str, ClientSession] = {}
+
+        self.created = Counter()
+        self.reused = Counter()
+        self.queued = Counter()
+        self.waited = Counter()
+
+    def session(self, kind:str) -> ClientSession:
+        session = self.sessions.get(kind)
+        if session is None or session.closed:
+            session = self.sessions[kind] = ClientSession(
+                connector=self.connector(kind),
+                connector_owner=False,
+                timeout=TIMEOUTS[kind],
+                trace_configs=[self.trace(kind)]
+            )
+        return session
+
+    def connector(self, kind:str):
+        pool = 'database' if kind == 'database' else 'shared'
+        connector = self.connectors.get(pool)
+        if connector is None or connector.closed:
+            if pool == 'database' and self.db_socket:
+                log.info(f'Connecting to database over {self.db_socket}')
+                connector = UnixConnector(path=self.db_socket, limit=DATABASE_LIMIT,
+                                          keepalive_timeout=KEEPALIVE_TIMEOUT)
+            elif pool == 'database':
+                connector = TCPConnector(limit=DATABASE_LIMIT, keepalive_timeout=KEEPALIVE_TIMEOUT,
+                                         use_dns_cache=True, ttl_dns_cache=DNS_TTL)
+            else:
+                connector = TCPConnector(limit=LIMIT, limit_per_host=LIMIT_PER_HOST,
+                                         keepalive_timeout=KEEPALIVE_TIMEOUT,
+                                         use_dns_cache=True, ttl_dns_cache=DNS_TTL)
+            self.connectors[pool] = connector
+        return connector
+
+    def trace(self, kind:str) -> TraceConfig:
+        async def on_create(session, ctx, params):
+            self.created[kind] += 1
+
+        async def on_reuse(session, ctx, params):
+            self.reused[kind] += 1
+
+        async def on_queued_start(session, ctx, params):
+            self.queued[kind] += 1
+            self.waited[kind] += 1
+
+        async def on_queued_end(session, ctx, params):
+            self.queued[kind] -= 1
+
+        trace = TraceConfig()
+        trace.on_connection_create_end.append(on_create)
+        trace.on_connection_reuseconn.append(on_reuse)
+        trace.on_connection_queued_start.append(on_queued_start)
+        trace.on_connection_queued_end.append(on_queued_end)
+        return trace
+
+    def stats(self) -> dict:
+        pools = {}
+        for name, connector in self.connectors.items():
+            pools[name] = {
+                'limit': connector.limit,
+                'in_use': len(getattr(connector, '_acquired', ())),
+                'idle': sum(len(conns) for conns in getattr(connector, '_conns', {}).values())
+            }
+
+        calls = {}
+        for kind in TIMEOUTS:
+            connections = self.created[kind] + self.reused[kind]
+            calls[kind] = {
+                'created': self.created[kind],
+                'reused': self.reused[kind],
+                'reuse_rate': self.reused[kind] / connections if connections else None,
+                'queued': self.queued[kind],
+                'waited': self.waited[kind]
+            }
+
+        return {'pools': pools, 'calls': calls}
+
+    async def close(self) -> None:
+        for session in self.sessions.values():
+            await session.close()
+        for connector in self.connectors.values():
+            await connector.close()
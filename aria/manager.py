@@ -5,6 +5,7 @@ from typing import Sequence, Optional
 from aria.providers import PROVIDERS
 from aria.models import EntryOverview, PlayableEntry, Provider
 from aria.database import Database
+from aria.suggest import SuggestIndex
 
 log = getLogger(__name__)
 
@@ -13,10 +14,13 @@ class MediaSourceManager():
     def __init__(self, config):
         self.config = config
         self.db = Database()
+        self.loop = asyncio.get_event_loop()
 
         self.providers = {}
         self.resolvers = {}
+        self.suggest = SuggestIndex()
         self.init_providers()
+        self.loop.create_task(self.refresh_suggestions())
 
     def init_providers(self):
         for provider in PROVIDERS:
@@ -34,9 +38,22 @@ class MediaSourceManager():
             except:
                 log.error(f'Failed to initialize provider `{name}`:', exc_info=True)
 
+    async def refresh_suggestions(self) -> None:
+        terms = []
+        for provider in self.providers.values():
+            try:
+                terms += provider.suggestions()
+            except:
+                log.error(f'Failed to get suggestions from provider `{provider.name}`:', exc_info=True)
+
+        await self.suggest.load_library(terms)
+
     async def resolve(self, uri) -> Sequence[EntryOverview]:
         provider = self.get_provider(uri)
-        return (await provider.resolve(uri.strip())) if provider else []
+        ret = (await provider.resolve(uri.strip())) if provider else []
+        for entry in ret or []:
+            self.suggest.add_resolved(entry.title)
+        return ret
 
     async def resolve_playable(self, uri) -> Sequence[PlayableEntry]:
         uris = uri if isinstance(uri, list) else [uri]
@@ -73,8 +90,15 @@ class MediaSourceManager():
                 log.error(f'Provider `{provider}` not found.')
                 return []
 
-        results, pending = await asyncio.wait([prov.search(query) for prov in single_provider or self.providers.values()],
-                                              timeout=10, return_when=asyncio.ALL_COMPLETED)
+        tasks = [self.loop.create_task(prov.search(query)) for prov in single_provider or self.providers.values()]
+        try:
+            results, pending = await asyncio.wait(tasks, timeout=10, return_when=asyncio.ALL_COMPLETED)
+        except asyncio.CancelledError:
+            # asyncio.wait does not cancel its children; do it so superseded searches stop early
+            for task in tasks:
+                task.cancel()
+            raise
+
         log.debug(f'results: {results}, pending: {pending}')
         for res in results:
             try:
@@ -83,5 +107,6 @@ class MediaSourceManager():
                 items += search_res[2:]
             except:
                 log.error('Search failed in provider: ', exc_info=True)
-            
+
+        self.suggest.add_query(query)
         return tophits + items
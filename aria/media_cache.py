@@ -0,0 +1,222 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+from logging import getLogger
+import os
+from pathlib import Path
+from time import time
+from typing import Any, Callable, Dict, Optional, Set
+
+log = getLogger(__name__)
+
+MANIFEST_FILE = '.manifest.json'
+# debounce manifest writes
+SAVE_DELAY = 10
+# suffixes of files still being written
+PARTIAL_SUFFIXES = ('.part', '.tmp', '.ytdl')
+
+POLICIES = {
+    'lru': lambda rec: rec.last_access,
+    'lfu': lambda rec: (rec.hits, rec.last_access)
+}
+
+
+class CacheRecord():
+    def __init__(self, size:int, last_access:float, hits:int=0):
+        self.size = size
+        self.last_access = last_access
+        self.hits = hits
+
+
+class MediaCache():
+    """
+    Manifest of the downloaded media in `cache_dir`.
+
+    Keeps size, last access and hit count of every cached file in memory,
+    so cache lookups never touch the disk, and evicts files by LRU or LFU
+    once the cache grows over `quota` bytes. Files returned by `pinned`
+    (entries in the queue) are never evicted.
+    """
+    ins = None
+    init = False
+
+    def __new__(cls, *args, **kwargs) -> Any:
+        if not cls.ins:
+            cls.ins = super().__new__(cls)
+
+        return cls.ins
+
+    def __init__(self, cache_dir:str=None, *, quota:int=None, policy:str='lru') -> None:
+        if MediaCache.init:
+            return
+
+        MediaCache.init = True
+        self.cache_dir = Path(cache_dir or 'caches')
+        self.manifest_file = self.cache_dir/MANIFEST_FILE
+        self.quota = quota or None
+        if policy not in POLICIES:
+            log.error(f'Unknown cache policy {policy}. Use lru.')
+            policy = 'lru'
+        self.policy = policy
+        self.pinned: Callable[[], Set[str]] = set
+
+        self.loop = asyncio.get_event_loop()
+        self.pool = ThreadPoolExecutor(max_workers=1)
+        self.save_handle = None
+
+        self.records: Dict[str, CacheRecord] = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evicted = 0
+
+        self.load()
+        log.info(f'Media cache: {len(self.records)} files, {self.size} bytes (quota: {self.quota}, policy: {self.policy})')
+
+    @staticmethod
+    def key(filename) -> str:
+        return Path(filename).name
+
+    def lookup(self, filename) -> bool:
+        """
+        Check whether `filename` is cached, counting a hit or a miss.
+        """
+        rec = self.records.get(self.key(filename)) if filename else None
+        if not rec:
+            self.misses += 1
+            return False
+
+        rec.last_access = time()
+        rec.hits += 1
+        self.hits += 1
+        self.bytes_saved += rec.size
+        self.schedule_save()
+        return True
+
+    def contains(self, filename) -> bool:
+        return bool(filename) and self.key(filename) in self.records
+
+    def add(self, filename) -> None:
+        try:
+            size = os.stat(filename).st_size
+        except OSError:
+            log.error(f'Cannot add missing file to cache: {filename}')
+            return
+
+        key = self.key(filename)
+        old = self.records.get(key)
+        if old:
+            self.size -= old.size
+        self.records[key] = CacheRecord(size, time(), old.hits if old else 0)
+        self.size += size
+
+        self.evict()
+        self.schedule_save()
+
+    def discard(self, filename) -> None:
+        rec = self.records.pop(self.key(filename), None)
+        if rec:
+            self.size -= rec.size
+            self.schedule_save()
+
+    def evict(self) -> None:
+        if not self.quota or self.size <= self.quota:
+            return
+
+        pinned = {self.key(f) for f in self.pinned()}
+        candidates = sorted(
+            (k for k in self.records if k not in pinned),
+            key=lambda k: POLICIES[self.policy](self.records[k])
+        )
+        to_delete = []
+        for key in candidates:
+            if self.size <= self.quota:
+                break
+            self.size -= self.records.pop(key).size
+            self.evicted += 1
+            to_delete.append(self.cache_dir/key)
+
+        if self.size > self.quota:
+            log.error(f'Cache is over quota with pinned files only ({self.size} bytes)')
+
+        if to_delete:
+            log.info(f'Evicting {len(to_delete)} files from cache')
+            self.loop.run_in_executor(self.pool, unlink_files, to_delete)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'files': len(self.records),
+            'bytes': self.size,
+            'quota': self.quota,
+            'policy': self.policy,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else None,
+            'bytes_saved': self.bytes_saved,
+            'evicted': self.evicted
+        }
+
+    def load(self) -> None:
+        manifest = {}
+        try:
+            with self.manifest_file.open('r') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            pass
+        except:
+            log.error('Failed to load cache manifest: ', exc_info=True)
+
+        with os.scandir(self.cache_dir) as it:
+            for e in it:
+                if e.name.startswith('.') or e.name.endswith(PARTIAL_SUFFIXES) or not e.is_file():
+                    continue
+                st = e.stat()
+                size, last_access, hits = manifest.get(e.name) or (None, st.st_mtime, 0)
+                if size != st.st_size:
+                    # replaced while we were not looking
+                    last_access, hits = st.st_mtime, 0
+                self.records[e.name] = CacheRecord(st.st_size, last_access, hits)
+                self.size += st.st_size
+
+    def schedule_save(self) -> None:
+        if self.save_handle:
+            return
+        self.save_handle = self.loop.call_later(SAVE_DELAY, self.do_schedule_save)
+
+    def do_schedule_save(self) -> None:
+        self.save_handle = None
+        manifest = {k: (r.size, r.last_access, r.hits) for k, r in self.records.items()}
+        self.loop.run_in_executor(self.pool, self.save, manifest)
+
+    async def close(self) -> None:
+        # save now instead of after SAVE_DELAY; the pool runs it after any save in flight
+        if self.save_handle:
+            self.save_handle.cancel()
+            self.save_handle = None
+        manifest = {k: (r.size, r.last_access, r.hits) for k, r in self.records.items()}
+        await self.loop.run_in_executor(self.pool, self.save, manifest)
+        self.pool.shutdown()
+
+    def save(self, manifest:Optional[dict]=None) -> None:
+        if manifest is None:
+            manifest = {k: (r.size, r.last_access, r.hits) for k, r in self.records.items()}
+
+        tmp = self.manifest_file.with_suffix('.tmp')
+        try:
+            with tmp.open('w') as f:
+                json.dump(manifest, f)
+            tmp.replace(self.manifest_file)
+        except:
+            log.error('Failed to save cache manifest: ', exc_info=True)
+
+
+def unlink_files(files) -> None:
+    for f in files:
+        try:
+            f.unlink()
+        except FileNotFoundError:
+            pass
+        except:
+            log.error(f'Failed to delete {f}: ', exc_info=True)
@@ -1,4 +1,5 @@
-from typing import Optional, Sequence
+import asyncio
+from typing import Iterable, Optional, Sequence
 from enum import IntEnum
 
 class PlayerState(IntEnum):
@@ -7,9 +8,14 @@ class PlayerState(IntEnum):
     PAUSED  = 2
 
 class EntryOverview():
+    __slots__ = ('source', 'title', 'uri', 'thumbnail', 'thumbnail_small', 'entry', 'is_liked', '_dict')
+    # fields in as_dict(); setting one to a new value drops the cached dict
+    SERIALIZED = frozenset(('source', 'title', 'uri', 'thumbnail', 'thumbnail_small', 'entry', 'is_liked'))
+
     def __init__(self, source:str, title:str,
                     uri:str, thumbnail:str=None,
                     thumbnail_small:str=None, entry:dict=None):
+        self._dict = None
         self.source = source
         self.title = title
         self.uri = uri
@@ -18,27 +24,61 @@ class EntryOverview():
         self.entry = entry
         self.is_liked = False
 
+    def __setattr__(self, name, value):
+        if name in EntryOverview.SERIALIZED:
+            old = getattr(self, name, None)
+            if old is not value and old != value:
+                object.__setattr__(self, '_dict', None)
+        object.__setattr__(self, name, value)
+
     def as_dict(self):
-        return {
-            "source": self.source,
-            "title": self.title,
-            "uri": self.uri,
-            "thumbnail": self.thumbnail,
-            "thumbnail_small": self.thumbnail_small,
-            "is_liked": self.is_liked,
-            "entry": self.entry if self.source == 'gpm' else None # temporary
-        }
+        # shared between callers; copy before modifying
+        if self._dict is None:
+            self._dict = {
+                "source": self.source,
+                "title": self.title,
+                "uri": self.uri,
+                "thumbnail": self.thumbnail,
+                "thumbnail_small": self.thumbnail_small,
+                "is_liked": self.is_liked,
+                "entry": self.entry if self.source == 'gpm' else None # temporary
+            }
+        return self._dict
 
 
 class PlayableEntry():
+    __slots__ = ('title', 'duration', 'file', 'stream_info', '_start', '_end')
+
     def __init__(self):
         self.title = None
         self.duration = None
         self.file = None
+        # ffprobe result of the audio stream, used to decide on opus passthrough
+        self.stream_info = {}
+        self._start = None
+        self._end = None
+
+    # most queued entries never start downloading, so events are created on first use
+
+    @property
+    def start(self) -> asyncio.Event:
+        if self._start is None:
+            self._start = asyncio.Event()
+        return self._start
+
+    @property
+    def end(self) -> asyncio.Event:
+        if self._end is None:
+            self._end = asyncio.Event()
+        return self._end
     
     async def download(self):
         raise NotImplementedError()
 
+    def cached_file(self) -> Optional[str]:
+        # file in cache_dir this entry plays, pinned while queued
+        return self.file
+
 
 class Provider():
     name:str = '__base__'
@@ -56,3 +96,7 @@ class Provider():
 
     async def resolve_playable(self, uri:str) -> Sequence[PlayableEntry]:
         raise NotImplementedError()
+
+    def suggestions(self) -> Iterable[str]:
+        # terms fed to the autocomplete index
+        return ()
@@ -0,0 +1,132 @@
+from bisect import bisect_left
+from inspect import signature
+from logging import getLogger
+from time import perf_counter
+from typing import Any, Callable, Dict, NamedTuple, Optional, Sequence, Tuple, Type, Union
+
+log = getLogger(__name__)
+
+# upper bounds of latency histogram buckets in ms; the last bucket is unbounded
+BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# field -> accepted type(s); every field listed is required
+Schema = Dict[str, Union[Type, Tuple[Type, ...]]]
+
+
+class OpContext(NamedTuple):
+    key: Optional[str]
+    data: Optional[dict]
+    ws: Any
+    session: Optional[str]
+    postback: str = ""
+
+
+class OpStats():
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.invalid = 0
+        self.cancelled = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def observe(self, elapsed_ms:float) -> None:
+        self.count += 1
+        self.total += elapsed_ms
+        self.max = max(self.max, elapsed_ms)
+        self.buckets[bisect_left(BUCKETS_MS, elapsed_ms)] += 1
+
+    def as_dict(self) -> dict:
+        histogram = {f'<={b}': n for b, n in zip(BUCKETS_MS, self.buckets)}
+        histogram[f'>{BUCKETS_MS[-1]}'] = self.buckets[-1]
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'invalid': self.invalid,
+            'cancelled': self.cancelled,
+            'mean_ms': self.total / self.count if self.count else None,
+            'max_ms': self.max,
+            'histogram': histogram
+        }
+
+
+class Op():
+    """
+    A handler with its argument injectors resolved once from its signature
+    """
+
+    def __init__(self, name:str, handler:Callable, injectors:Sequence[Tuple[str, Callable[[OpContext], Any]]],
+                 schema:Optional[Schema]=None):
+        self.name = name
+        self.handler = handler
+        self.injectors = injectors
+        self.schema = schema
+        self.stats = OpStats()
+
+    def validate(self, data:Optional[dict]) -> Optional[str]:
+        if not self.schema:
+            return None
+        if not isinstance(data, dict):
+            return 'data is not an object'
+        for field, types in self.schema.items():
+            if not isinstance(data.get(field), types):
+                return f'{field} is missing or invalid'
+        return None
+
+    async def __call__(self, ctx:OpContext) -> Any:
+        error = self.validate(ctx.data)
+        if error:
+            self.stats.invalid += 1
+            log.error(f'Invalid data for op {self.name}: {error}')
+            return None
+
+        params = {name: inject(ctx) for name, inject in self.injectors}
+        started = perf_counter()
+        try:
+            return await self.handler(**params)
+        except BaseException as e:
+            # CancelledError is a BaseException on 3.8
+            if isinstance(e, Exception):
+                self.stats.errors += 1
+            else:
+                self.stats.cancelled += 1
+            raise
+        finally:
+            self.stats.observe((perf_counter() - started) * 1000)
+
+
+class OpRegistry():
+    """
+    Ops of `target`, from its methods named `<prefix><op>`, built once.
+    `injectors` maps parameter names to functions taking an OpContext.
+    """
+
+    def __init__(self, target:Any, injectors:Dict[str, Callable[[OpContext], Any]], *,
+                 prefix:str='op_', schemas:Optional[Dict[str, Schema]]=None):
+        self.ops: Dict[str, Op] = {}
+        schemas = schemas or {}
+
+        for attr in dir(target):
+            if not attr.startswith(prefix):
+                continue
+            handler = getattr(target, attr)
+            if not callable(handler):
+                continue
+
+            name = attr[len(prefix):]
+            params = signature(handler).parameters
+            unknown = [p for p in params if p not in injectors]
+            if unknown:
+                log.error(f'Cannot inject {unknown} into op {name}. Skip.')
+                continue
+
+            self.ops[name] = Op(name, handler, [(p, injectors[p]) for p in params], schemas.get(name))
+
+        log.info(f'Registered {len(self.ops)} ops')
+
+    def get(self, name:str) -> Optional[Op]:
+        return self.ops.get(name)
+
+    def stats(self) -> dict:
+        return {name: op.stats.as_dict() for name, op in self.ops.items() if op.stats.count or op.stats.invalid}
@@ -4,6 +4,7 @@ from logging import getLogger
 from random import shuffle
 from typing import Sequence, Union
 
+from aria.media_cache import MediaCache
 from aria.models import EntryOverview, PlayableEntry, PlayerState
 from aria.stream import StreamPlayer
 
@@ -52,11 +53,16 @@ class PlayerQueue():
         self.on_queue_change()
         return ret
 
-    async def add_entry(self, entries:Union[Sequence[PlayableEntry], PlayableEntry], head=False, shuffle=False):
+    async def add_entry(self, entries:Union[Sequence[PlayableEntry], PlayableEntry], head=False, shuffle=False,
+                        offset=0):
+        # with head, entries go `offset` entries from the front
         to_add = entries if isinstance(entries, list) else [entries]
         async with self.lock:
             if head:
+                offset = min(offset, len(self.queue))
+                self.queue.rotate(-offset)
                 self.queue.extendleft(to_add[::-1])
+                self.queue.rotate(offset)
             else:
                 self.queue.extend(to_add)
 
@@ -163,8 +169,9 @@ class PlayerQueue():
         
     async def list(self) -> Sequence[EntryOverview]:
         ret = [i.entry for i in self.queue]
+        liked = await self.player.view.playlist.is_liked_many([item.uri for item in ret])
         for item in ret:
-            item.is_liked = await self.player.view.playlist.is_liked(item.uri)
+            item.is_liked = liked[item.uri]
         return ret
 
 
@@ -180,6 +187,8 @@ class Player():
         self.queue = PlayerQueue(self)
         self.current = None
 
+        MediaCache().pinned = self.pinned_files
+
     async def play(self):
         async with self.lock:
             if self.state == PlayerState.STOPPED:
@@ -226,6 +235,10 @@ class Player():
     async def list(self):
         return await self.queue.list()
 
+    def pinned_files(self):
+        entries = [*self.queue.queue, self.current] if self.current else self.queue.queue
+        return {f for f in (e.cached_file() for e in entries) if f}
+
     def change_state(self, state_to:str):
         # MUST BE CALLED WITH LOCK ACQUIRED!!!
         self.state = PlayerState[state_to.upper()]
@@ -238,7 +251,8 @@ class Player():
                 **self.current.entry.as_dict(),
                 'is_liked': await self.view.playlist.is_liked(self.current.entry.uri),
                 'duration': self.current.duration,
-                'position': self.stream.current_position
+                'position': self.stream.current_position,
+                'gain': self.stream.current_gain
             } if not self.state == PlayerState.STOPPED else None
         }
 
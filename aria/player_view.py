@@ -1,37 +1,103 @@
 import asyncio
+from collections import Counter
 from concurrent.futures import ThreadPoolExecutor
 from functools import partial
-from inspect import signature
+import json
+import logging
 from logging import getLogger
+import math
 import uuid
 
 from aiohttp import WSMsgType, web
 
 from aria.auth import Auth
+from aria.database import Database
+from aria.http_client import HTTPClient
 from aria.manager import MediaSourceManager
+from aria.media_cache import MediaCache
+from aria.ops import OpContext, OpRegistry
 from aria.player import Player
-from aria.playlist import PlaylistManager
+from aria.playlist import PAGE_SIZE, PlaylistManager
+from aria.ratelimit import RateLimiter
+from aria.snapshot import StateSnapshot
 from aria.utils import (
-    get_pretty_object, get_token_from_cookie, get_token_from_header, json_dump)
+    CODECS, get_pretty_object, get_token_from_cookie, get_token_from_header, json_dump)
 
 log = getLogger(__name__)
 
+# ops whose older in-flight tasks are cancelled when the same session sends a newer one
+SUPERSEDABLE_OPS = ('search',)
+# entries per playlist_chunk when streaming, small for a fast first paint
+STREAM_PAGE_SIZE = 200
+# seconds a snapshot of the player state (and its position) is served before reloading
+STATE_MAX_AGE = 1.0
+# ops accepted in one batch /control request
+MAX_BATCH_OPS = 100
+
+# handler parameter -> value injected for it
+OP_INJECTORS = {
+    'ws': lambda ctx: ctx.ws,
+    'session': lambda ctx: ctx.session,
+    'key': lambda ctx: ctx.key or "",
+    'data': lambda ctx: ctx.data or {},
+    'postback': lambda ctx: ctx.postback,
+    'pre': lambda ctx: partial(enclose_packet, key=ctx.key)
+}
+# required data fields of ops, checked before the handler runs
+OP_SCHEMAS = {
+    'search': {'query': str},
+    'suggest': {'query': str},
+    'playlist': {'name': str},
+    'create_playlist': {'name': str},
+    'delete_playlist': {'name': str},
+    'add_to_playlist': {'name': str, 'uri': str},
+    'remove_from_playlist': {'name': str, 'uri': str},
+    'like': {'uri': str},
+    'update_db': {'user': str}
+}
+
 
 """
 APIs
 
+Packets are JSON text frames, or MessagePack binary frames when the client
+asks for the `aria.msgpack` subprotocol (or `?codec=msgpack`) and msgpack is
+installed. Text frames are always accepted.
+
+Bootstrap
+---------
+On open a session gets `hello` and then the current queue, state and
+playlists as event_* packets. With `?snapshot` (empty or the last snapshot
+token seen) it gets them as one `bootstrap` packet instead:
+{"type": "bootstrap", "data": {"snapshot": TOKEN, "full": bool, "events": [...]}}
+where events are only those changed since TOKEN unless "full". Broadcast
+event_* packets carry the "snapshot" token they bring the client to.
+
+A client may send {"op": "hello", "data": {"snapshot"?, "capabilities"?: [...]}}.
+With the "gain" capability it applies `gain` of the state itself; opus sources
+are passed through untranscoded only while every connected client has it.
+
 Events
 ------
 event_player_state_change
 event_queue_change
 event_playlists_change
 event_playlist_entry_change
+event_update_db_progress
+event_write_failed (kind, keys) buffered writes dropped after retries, e.g. likes
+
+Ops over the per-session or global rate limit (see `rate_limit` config) are
+not run and get {"postback": ..., "type": "rate_limited", "data": {"op", "retry_after"}}.
+
+POST /control takes one op, or a batch as {"token", "ops": [...], "parallel"?}
+(see post_control_batch).
 
 Operations
 ----------
 op_search (query, [provider])
+op_suggest (query, [limit])
 op_playlists
-op_playlist (name)
+op_playlist (name, [cursor, limit, stream])
 op_create_playlist (name)
 op_delete_playlist (name)
 op_add_to_playlist (name, uri)
@@ -67,6 +133,22 @@ class PlayerView():
         self.player = Player(self, self.manager)
 
         self.connections = {}
+        # session -> Codec of its frames
+        self.codecs = {}
+        # session -> capabilities declared in hello
+        self.capabilities = {}
+        # session -> {op: task} for SUPERSEDABLE_OPS
+        self.inflight = {}
+        self.superseded = Counter()
+
+        self.ops = OpRegistry(self, OP_INJECTORS, schemas=OP_SCHEMAS)
+        self.limiter = RateLimiter(self.config.rate_limit)
+        # packets sent on open, shared by all sessions
+        self.snapshot = StateSnapshot({
+            'queue': (self.enclose_queue, None),
+            'state': (self.enclose_state, STATE_MAX_AGE),
+            'playlists': (self.enclose_playlists, None)
+        }, on_change=self.on_snapshot_change, identity={'state': state_identity})
 
     async def get_ws(self, request: web.Request):
         # check token
@@ -79,30 +161,108 @@ class PlayerView():
         await self.kill_current_session(token)
 
         session = str(uuid.uuid4())
-        ws = web.WebSocketResponse(heartbeat=30)
+        ws = web.WebSocketResponse(heartbeat=30, protocols=[c.protocol for c in CODECS.values()])
         await ws.prepare(request)
         self.connections[session] = ws
+        self.codecs[session] = select_codec(request, ws.ws_protocol)
 
         # initial events
-        self.loop.create_task(self.on_open_message(ws, session))
+        self.loop.create_task(self.on_open_message(ws, session, request.query.get('snapshot')))
 
         log.debug(f"New player session: {session}")
         log.debug(f'Current player: {len(self.connections)} connections')
 
         async for msg in ws:
             if msg.type == WSMsgType.TEXT:
-                try:
-                    json_message = msg.json()
-                except:
-                    log.error(f'Invalid message: {msg.data}')
-                    continue
-                    
-                self.loop.create_task(self.handle_message(json_message, ws, session))
+                loads = json.loads
+            elif msg.type == WSMsgType.BINARY and 'msgpack' in CODECS:
+                loads = CODECS['msgpack'].loads
+            else:
+                continue
+
+            try:
+                json_message = loads(msg.data)
+            except:
+                log.error(f'Invalid message: {msg.data}')
+                continue
+
+            if not isinstance(json_message, dict):
+                log.error(f'Invalid message: {msg.data}')
+                continue
+
+            op = json_message.get('op')
+            # superseding keeps these to one in flight per session already
+            retry_after = self.limiter.check(session, op, bounded=op in SUPERSEDABLE_OPS)
+            if retry_after is not None:
+                self.loop.create_task(self.send_json(session, ws, rate_limited(json_message, retry_after)))
+                continue
+                
+            self.dispatch(json_message, ws, session)
         
         log.info(f"Player session closed: {session}")
+        self.cancel_inflight(session)
+        self.limiter.close(session)
+        self.codecs.pop(session, None)
+        self.capabilities.pop(session, None)
         await self.kill_current_session(session)
         return ws
 
+    def dispatch(self, payload:dict, ws, session:str) -> asyncio.Task:
+        task = self.loop.create_task(self.handle_limited(payload, ws, session))
+        op = payload.get('op')
+        if op not in SUPERSEDABLE_OPS:
+            return task
+
+        ops = self.inflight.setdefault(session, {})
+        current = ops.get(op)
+        if current and not current.done():
+            # cancelling also cancels executor work which has not started yet
+            current.cancel()
+            self.limiter.refund(op)
+            self.superseded[op] += 1
+            log.info(f'Superseded op {op} in session {session} ({self.superseded[op]} so far)')
+
+        ops[op] = task
+        task.add_done_callback(partial(self.on_inflight_done, session, op))
+        return task
+
+    async def handle_limited(self, payload:dict, ws, session:str):
+        async with self.limiter.semaphore(session):
+            return await self.handle_message(payload, ws, session)
+
+    def on_inflight_done(self, session:str, op:str, task:asyncio.Task) -> None:
+        ops = self.inflight.get(session)
+        if ops and ops.get(op) is task:
+            del ops[op]
+            if not ops:
+                del self.inflight[session]
+
+    def cancel_inflight(self, session:str) -> None:
+        for task in self.inflight.pop(session, {}).values():
+            task.cancel()
+
+    async def get_stats(self, request:web.Request):
+        token = get_token_from_cookie(request) or get_token_from_header(request)
+        if not token or not await self.auth.is_valid_token(token):
+            raise web.HTTPForbidden()
+
+        return web.json_response(self.collect_stats())
+
+    def collect_stats(self) -> dict:
+        return {
+            'connections': len(self.connections),
+            'codecs': dict(Counter(c.name for c in self.codecs.values())),
+            'superseded': dict(self.superseded),
+            'media_cache': MediaCache().stats(),
+            'http': HTTPClient().stats(),
+            'db_cache': Database().cache.stats(),
+            'db_batches': {name: b.stats() for name, b in Database().batchers.items()},
+            'db_writes': {name: w.stats() for name, w in Database().writes.items()},
+            'ops': self.ops.stats(),
+            'rate_limit': self.limiter.stats(),
+            'snapshot': self.snapshot.stats()
+        }
+
     async def kill_current_session(self, session: str) -> None:
         current = self.connections.pop(session, None)
         if current != None:
@@ -120,6 +280,14 @@ class PlayerView():
         if not token or not await self.auth.is_valid_token(token):
             log.error("Invalid token!")
             return web.Response(status=403)
+
+        if 'ops' in json_message:
+            return await self.post_control_batch(json_message)
+
+        retry_after = self.limiter.check_caller(token, json_message.get('op'))
+        if retry_after is not None:
+            return web.json_response(rate_limited(json_message, retry_after), status=429,
+                                     headers={'Retry-After': str(math.ceil(retry_after))})
         
         ret = await self.handle_message(json_message)
         if ret:
@@ -127,24 +295,96 @@ class PlayerView():
 
         return web.Response()
 
-    async def on_open_message(self, ws, key):
+    async def post_control_batch(self, json_message):
+        """
+        {
+            "token": TOKEN,
+            "ops": [
+                {"op": OP, "postback"?: str, "data"?: {...}},
+                ...
+            ],
+            "parallel"?: false
+        }
+
+        Returns
+        -------
+        {
+            "results": [reply of each op or null, in order]
+        }
+
+        Ops run one after another unless "parallel", in which case at most
+        `session_concurrency` of them run at once. A failing or rate limited
+        op does not stop the others; it gets an "error" or "rate_limited" reply.
+        """
+        token = json_message.get('token')
+        ops = json_message.get('ops')
+        if not isinstance(ops, list) or not all(isinstance(o, dict) for o in ops):
+            log.error("ops is not a list of objects!")
+            return web.Response(status=400)
+        if len(ops) > MAX_BATCH_OPS:
+            log.error(f"Too many ops in batch: {len(ops)}")
+            return web.Response(status=413)
+
+        if json_message.get('parallel'):
+            semaphore = asyncio.Semaphore(self.limiter.concurrency)
+            async def run(payload):
+                async with semaphore:
+                    return await self.handle_batched(token, payload)
+            results = await asyncio.gather(*[run(payload) for payload in ops])
+        else:
+            results = [await self.handle_batched(token, payload) for payload in ops]
+
+        # replies may hold entries, which plain json cannot encode
+        return web.json_response({'results': results}, dumps=json_dump)
+
+    async def handle_batched(self, token:str, payload:dict):
+        retry_after = self.limiter.check_caller(token, payload.get('op'))
+        if retry_after is not None:
+            return rate_limited(payload, retry_after)
+
+        try:
+            return await self.handle_message(payload)
+        except:
+            log.error(f"Failed to handle op {payload.get('op')} in batch: ", exc_info=True)
+            return error_packet(payload)
+
+    async def on_open_message(self, ws, key, known=None):
+        # known: snapshot token of the client, '' for none, None for separate packets
         await self.send_json(key, ws, enclose_packet('hello', { "stream": self.config.stream_location, 'session': key}, key=key))
-        await self.send_json(key, ws, enclose_packet('event_queue_change', {'queue': await self.player.list()}))
-        await self.send_json(key, ws, enclose_packet('event_player_state_change', await self.player.enclose_state()))
-        await self.send_json(key, ws, enclose_packet('event_playlists_change', {"playlists": await self.playlist.enclose_playlists()}))
+        if known is not None:
+            codec = self.codecs.get(key, CODECS['json'])
+            await self.send_frame(key, ws, await self.snapshot.bootstrap(codec, known))
+            return
+
+        await self.snapshot.ensure()
+        for packet in self.snapshot.packets():
+            await self.send_json(key, ws, packet)
 
     async def broadcast(self, packet):
-        log.debug(f'Broadcasting: {str(get_pretty_object(packet))}')
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f'Broadcasting: {str(get_pretty_object(packet))}')
+        # encode once per codec; sockets of the same codec get the same frame
+        frames = {}
         for key, ws in self.connections.items():
-            self.loop.create_task(self.send_json(key, ws, packet))
+            codec = self.codecs.get(key, CODECS['json'])
+            if codec.name not in frames:
+                frames[codec.name] = codec.dumps(packet)
+            self.loop.create_task(self.send_frame(key, ws, frames[codec.name]))
     
     async def send_json(self, key, ws, json):
+        codec = self.codecs.get(key, CODECS['json'])
+        await self.send_frame(key, ws, codec.dumps(json))
+
+    async def send_frame(self, key, ws, data):
         if ws.exception() != None or ws.closed:
             log.info('Deleting closed connection...')
             self.delete_connection(key)
         else:
             try:
-                await ws.send_json(json, dumps=json_dump)
+                if isinstance(data, bytes):
+                    await ws.send_bytes(data)
+                else:
+                    await ws.send_str(data)
             except:
                 log.error('Failed to send. Deleting connection...')
                 self.delete_connection(key)
@@ -157,6 +397,8 @@ class PlayerView():
             self.connections.pop(key)
         except:
             log.error(f'Connection not found for key {key}')
+        self.codecs.pop(key, None)
+        self.capabilities.pop(key, None)
 
         log.debug(f'Current player: {len(self.connections)} connections')
 
@@ -176,69 +418,60 @@ class PlayerView():
             log.error(f"postback is not a string. Ignore: {postback}")
             postback = ""
         
-        handler = getattr(self, f'op_{op}', None)
+        handler = self.ops.get(op)
         if not handler:
             log.error(f'No handler found for op {op}')
             return
 
-        reqs = signature(handler).parameters
-        params = {}
-
-        if 'ws' in reqs:
-            params['ws'] = ws
-        if 'session' in reqs:
-            params['session'] = session
-        if 'key' in reqs:
-            params['key'] = key or ""
-        if 'data' in reqs:
-            params['data'] = data or {}
-        if 'pre' in reqs:
-            params['pre'] = partial(enclose_packet, key=key)
-
-        log.debug(f'Handling op {op} with data {data}')
-        ret = await handler(**params)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f'Handling op {op} with data {data}')
+        ret = await handler(OpContext(key, data, ws, session, postback))
         if ret:
             ret = { 'postback': postback, **ret }
 
         if ws != None and ret: # bool(ws) sucks
-            await self.send_json(key, ws, ret)
+            await self.send_json(session, ws, ret)
 
-        log.debug(f'Returning {str(get_pretty_object(ret))}')
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(f'Returning {str(get_pretty_object(ret))}')
         log.info(f'task op {op} done.')
         return ret
     
     # Event callbacks
     # Better using EventEmitter?
-    
+    # Queue, state and playlists events are broadcast from snapshot changes.
+
+    async def enclose_queue(self):
+        # dicts, since as_dict() is replaced instead of mutated on change
+        return enclose_packet('event_queue_change', {'queue': [e.as_dict() for e in await self.player.list()]})
+
+    async def enclose_state(self):
+        return enclose_packet('event_player_state_change', await self.player.enclose_state())
+
+    async def enclose_playlists(self):
+        return enclose_packet('event_playlists_change', {'playlists': await self.playlist.enclose_playlists()})
+
+    def on_snapshot_change(self, name, packet):
+        self.loop.create_task(self.broadcast({**packet, 'snapshot': self.snapshot.token}))
+
     def on_player_state_change(self):
         log.debug('State changed. Broadcasting...')
-        self.loop.create_task(self.event_player_state_change())
-
-    async def event_player_state_change(self):
-        await self.broadcast(enclose_packet('event_player_state_change', await self.player.enclose_state()))
+        self.loop.create_task(self.snapshot.refresh('state'))
 
     def on_queue_change(self):
         log.debug('Queue changed. Broadcasting...')
-        self.loop.create_task(self.event_queue_change())
-
-    async def event_queue_change(self):
-        ret = {
-            'queue': await self.player.list()
-        }
-        await self.broadcast(enclose_packet('event_queue_change', ret))
+        self.loop.create_task(self.snapshot.refresh('queue'))
 
     def on_playlists_change(self):
         log.debug('Playlists changed. Broadcasting...')
-        self.loop.create_task(self.event_playlists_change())
-
-    async def event_playlists_change(self):
-        ret = {
-            'playlists': await self.playlist.enclose_playlists()
-        }
-        await self.broadcast(enclose_packet('event_playlists_change', ret))
+        self.loop.create_task(self.snapshot.refresh('playlists'))
 
     def on_playlist_entry_change(self, playlist_name):
         log.debug(f'Playlist {playlist_name} changed. Broadcasting...')
+        if playlist_name == 'Likes':
+            # is_liked of queued and current entries
+            self.loop.create_task(self.snapshot.refresh('queue'))
+            self.loop.create_task(self.snapshot.refresh('state'))
         self.loop.create_task(self.event_playlist_entry_change(playlist_name))
 
     async def event_playlist_entry_change(self, playlist_name):
@@ -247,6 +480,10 @@ class PlayerView():
         }
         await self.broadcast(enclose_packet('event_playlist_entry_change', ret))
 
+    def on_write_failed(self, kind, keys):
+        log.error(f'Failed to save {kind}. Broadcasting...')
+        self.loop.create_task(self.broadcast(enclose_packet('event_write_failed', {'kind': kind, 'keys': keys})))
+
     def on_queue_empty(self):
         log.debug('Queue is empty. Adding from Likes list...')
         self.loop.create_task(self.do_on_queue_empty())
@@ -261,8 +498,17 @@ class PlayerView():
     
     # Operation handlers
 
-    async def op_hello(self, ws, session):
-        await self.on_open_message(ws, session)
+    def passthrough_allowed(self) -> bool:
+        # passthrough leaves loudness normalization to the clients, so all of them must apply `gain`
+        return (bool(self.config.opus_passthrough) and bool(self.connections)
+                and all('gain' in self.capabilities.get(s, ()) for s in self.connections))
+
+    async def op_hello(self, ws, session, data):
+        capabilities = data.get('capabilities')
+        if isinstance(capabilities, list):
+            self.capabilities[session] = {c for c in capabilities if isinstance(c, str)}
+        known = data.get('snapshot')
+        await self.on_open_message(ws, session, known if isinstance(known, str) else None)
 
     async def op_search(self, data):
         """
@@ -313,6 +559,42 @@ class PlayerView():
         ret = try_resolve or await self.manager.search(query, provider)
         return enclose_packet('search', ret)
         
+    async def op_suggest(self, data):
+        """
+        {
+            "op": "suggest",
+            "key": KEYSTRING,
+            "data": {
+                "query": QUERYSTRING,
+                "limit"?: 10
+            }
+        }
+
+        Returns
+        -------
+        {
+            "type": "suggest",
+            "data": {
+                "query": QUERYSTRING,
+                "suggestions": [
+                    "Rightfully", "Region", ...
+                ]
+            }
+        }
+        """
+        query = data.get('query')
+        if not isinstance(query, str) or not query.strip():
+            log.error('Invalid query.')
+            return
+
+        limit = data.get('limit')
+        limit = min(limit, 50) if isinstance(limit, int) and limit > 0 else 10
+        ret = {
+            'query': query,
+            'suggestions': self.manager.suggest.suggest(query, limit)
+        }
+        return enclose_packet('suggest', ret)
+
     async def op_playlists(self):
         """
         {
@@ -337,13 +619,16 @@ class PlayerView():
         }
         return enclose_packet('playlists', ret)
 
-    async def op_playlist(self, data):
+    async def op_playlist(self, data, ws, session, postback):
         """
         {
             "op": "playlist",
             "key": KEY,
             "data": {
-                "name": playlistname
+                "name": playlistname,
+                "cursor": cursor (optional),
+                "limit": int (optional),
+                "stream": bool (optional)
             }
         }
 
@@ -355,31 +640,58 @@ class PlayerView():
                 "name": playlistname,
                 "entries": [
 
-                ]
+                ],
+                "next": cursor of the next page or null
             }
         }
+
+        With "stream", pages are sent as "playlist_chunk" packets as they
+        are read with the postback of the request, ending with one whose
+        "next" is null. Nothing is returned.
         """
         name = data.get('name')
         if not name:
             log.error('No name in request packet.')
             return
-        
-        if name == "Likes":
-            pl = await self.playlist.get_likes()
-        elif name == "History":
-            pl = {
-                "name": "History",
-                "entries": await self.playlist.history.get_entries()
-            }
-        else:
-            pl = await self.playlist.get_playlist(name)
-            
+
+        cursor = data.get('cursor')
+        limit = data.get('limit')
+        limit = min(max(int(limit), 1), PAGE_SIZE) if isinstance(limit, int) else None
+
+        if data.get('stream') and ws != None:
+            await self.stream_playlist(name, limit or STREAM_PAGE_SIZE, ws, session, postback)
+            return
+
+        pl = await self.playlist.get_page(name, limit=limit or PAGE_SIZE, cursor=cursor)
         if not pl:
             log.error(f'No playlist found for {name}')
             return
 
         return enclose_packet('playlist', pl)
 
+    async def stream_playlist(self, name:str, limit:int, ws, session:str, postback:str="") -> None:
+        cursor = None
+        offset = 0
+        while True:
+            pl = await self.playlist.get_page(name, limit=limit, cursor=cursor)
+            if not pl:
+                log.error(f'Failed to read {name} at offset {offset}')
+                pl = {'entries': [], 'next': None}
+
+            cursor = pl.get('next')
+            await self.send_json(session, ws, {
+                'postback': postback,
+                **enclose_packet('playlist_chunk', {
+                    'name': name,
+                    'offset': offset,
+                    'entries': pl['entries'],
+                    'next': cursor
+                })
+            })
+            offset += len(pl['entries'])
+            if not cursor:
+                return
+
     async def op_create_playlist(self, data):
         """
         {
@@ -569,10 +881,16 @@ class PlayerView():
             log.error('Uri or playlist is needed.')
 
         if playlist:
-            pl = await self.playlist.get_playlist(playlist)
-            if pl:
-                await self.player.queue.add_entry(await self.manager.resolve_playable([e["uri"] for e in pl["entries"]]), head=head or False)
-            else:
+            # each page is queued once resolved, behind the pages before it
+            added = 0
+            async for entries in self.playlist.iter_playlist(playlist):
+                if not entries:
+                    continue
+                resolved = await self.manager.resolve_playable([e["uri"] for e in entries])
+                if resolved:
+                    await self.player.queue.add_entry(resolved, head=head or False, offset=added)
+                    added += len(resolved)
+            if not added:
                 log.error('Playlist not found.')
         else:
             await self.player.add_entry(uri, head=head or False)
@@ -640,7 +958,7 @@ class PlayerView():
 
         await self.player.queue.assign(edited)
 
-    async def op_update_db(self, data):
+    async def op_update_db(self, data, ws, session):
         gpm = self.manager.providers.get("gpm")
         if not gpm:
             log.error("No gpm provider")
@@ -651,7 +969,13 @@ class PlayerView():
             log.error("No user provided")
             return
             
-        await gpm.update(user=user)
+        progress = None
+        if ws != None:
+            progress = lambda payload: self.loop.create_task(
+                self.send_json(session, ws, enclose_packet('event_update_db_progress', payload)))
+
+        await gpm.update(user=user, progress=progress)
+        await self.manager.refresh_suggestions()
 
     async def op_token(self):
         return enclose_packet('token', { 'token': await self.auth.get_token(persist=True) })
@@ -659,6 +983,35 @@ class PlayerView():
     async def op_invite(self):
         return enclose_packet('invite', { 'invite': await self.auth.get_invite() })
 
+def select_codec(request:web.Request, protocol:str=None):
+    # websocket subprotocol first, then ?codec=, JSON otherwise
+    for codec in CODECS.values():
+        if protocol and codec.protocol == protocol:
+            return codec
+    return CODECS.get(request.query.get('codec'), CODECS['json'])
+
+def reply_of(payload, type, data):
+    postback = payload.get('postback')
+    return {
+        'postback': postback[:100] if isinstance(postback, str) else "",
+        **enclose_packet(type, {
+            'op': payload.get('op') if isinstance(payload.get('op'), str) else None,
+            **data
+        })
+    }
+
+def rate_limited(payload, retry_after):
+    return reply_of(payload, 'rate_limited', {'retry_after': round(retry_after, 3)})
+
+def error_packet(payload):
+    return reply_of(payload, 'error', {})
+
+def state_identity(packet):
+    # the position moves while playing; clients advance it themselves
+    data = packet.get('data') or {}
+    entry = data.get('entry')
+    return {**data, 'entry': {k: v for k, v in entry.items() if k != 'position'}} if entry else data
+
 def enclose_packet(type, data=None, key=None):
     ret = {
         'type': type
@@ -2,16 +2,103 @@ import asyncio
 from collections import deque
 from logging import getLogger
 from pathlib import Path
-from random import choice
-from typing import Optional
-
-from aiohttp import ClientSession
+from random import choice, random
+from typing import Dict, List, Optional, Sequence
 
 from aria.database import Database
-from aria.models import EntryOverview, PlayableEntry
+from aria.models import EntryOverview
 
 log = getLogger(__name__)
-endpoint = "http://localhost:8080"
+
+
+def without(d:dict, *keys) -> dict:
+    # database results are shared through its cache; never modify them in place
+    return {k: v for k, v in d.items() if k not in keys}
+
+
+# entries per page of playlists
+PAGE_SIZE = 1000
+# draws before fresh autoplay gives up avoiding History
+FRESH_TRIES = 10
+
+
+class LikesIndex():
+    """
+    Liked uris in memory: a list for O(1) sampling and a dict of positions
+    for O(1) membership and removal. Loaded once, then kept current by
+    PlaylistManager.like and dislike; changes made while a load is running
+    are replayed on top of what it read.
+    """
+
+    def __init__(self):
+        self.uris: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self.loaded = False
+        # uri -> liked, recorded between begin_load and load
+        self.changes: Optional[Dict[str, bool]] = None
+
+    def __contains__(self, uri:str) -> bool:
+        return uri in self.positions
+
+    def __len__(self) -> int:
+        return len(self.uris)
+
+    def begin_load(self) -> None:
+        self.changes = {}
+
+    def load(self, uris:Sequence[str]) -> None:
+        self.uris = list(dict.fromkeys(uris))
+        self.positions = {uri: i for i, uri in enumerate(self.uris)}
+        changes, self.changes = self.changes or {}, None
+        for uri, liked in changes.items():
+            if liked:
+                self.add(uri)
+            else:
+                self.remove(uri)
+        self.loaded = True
+
+    def add(self, uri:str) -> None:
+        if self.changes is not None:
+            self.changes[uri] = True
+        if uri not in self.positions:
+            self.positions[uri] = len(self.uris)
+            self.uris.append(uri)
+
+    def remove(self, uri:str) -> None:
+        if self.changes is not None:
+            self.changes[uri] = False
+        pos = self.positions.pop(uri, None)
+        if pos is None:
+            return
+        # move the last one into the hole
+        last = self.uris.pop()
+        if pos < len(self.uris):
+            self.uris[pos] = last
+            self.positions[last] = pos
+
+    def sample(self) -> Optional[str]:
+        return choice(self.uris) if self.uris else None
+
+    def sample_fresh(self, recent:Sequence[str]) -> Optional[str]:
+        """
+        Sample weighted against `recent` (most recent first): the n-th most
+        recent uri is accepted with probability n / (len(recent) + 1).
+        """
+        if not self.uris:
+            return None
+
+        ages = {}
+        for i, uri in enumerate(recent):
+            ages.setdefault(uri, i + 1)
+
+        uri = None
+        for _ in range(FRESH_TRIES):
+            uri = choice(self.uris)
+            age = ages.get(uri)
+            if not age or random() * (len(recent) + 1) < age:
+                break
+        return uri
+
 
 class History():
     def __init__(self, view, name):
@@ -40,6 +127,9 @@ class History():
     async def get_playable_entries(self):
         return [i for i in self.list]
 
+    def get_uris(self):
+        return [i.entry.uri for i in self.list]
+
 
 class PlaylistManager():
     def __init__(self, view, config, provider_manager):
@@ -48,8 +138,36 @@ class PlaylistManager():
         self.loop = asyncio.get_event_loop()
         self.lock = asyncio.Lock()
         self.db = Database()
+        self.autoplay = config.autoplay
 
         self.history = History(self.view, 'History')
+        self.likes = LikesIndex()
+        self.likes_lock = asyncio.Lock()
+        self.db.writes['likes'].on_drop = self.on_likes_dropped
+
+    async def load_likes(self) -> bool:
+        if self.likes.loaded:
+            return True
+
+        async with self.likes_lock:
+            if not self.likes.loaded:
+                self.likes.begin_load()
+                try:
+                    uris = []
+                    cursor = None
+                    while True:
+                        likes = await self.db.get_likes(PAGE_SIZE, cursor=cursor)
+                        uris.extend(e["uri"] for e in likes["entries"])
+                        cursor = likes.get("next")
+                        if not cursor:
+                            break
+                    self.likes.load(uris)
+                    log.info(f"loaded {len(self.likes)} likes")
+                except:
+                    self.likes.changes = None
+                    log.error("failed to load likes: ", exc_info=True)
+
+        return self.likes.loaded
 
     async def get_playlists(self):
         pls = None
@@ -60,15 +178,11 @@ class PlaylistManager():
 
         return pls
 
-    async def get_likes(self, entries=True):
+    async def get_likes(self, entries=True, *, limit:int=PAGE_SIZE, cursor:str=None):
         likes = None
         try:
-            likes = await self.db.get_likes()
-            del likes["id"]
-            for e in likes["entries"]:
-                del e["meta"]
-            if not entries:
-                likes["entries"] = None
+            likes = without(await self.db.get_likes(limit, cursor=cursor), "id")
+            likes["entries"] = [without(e, "meta") for e in likes["entries"]] if entries else None
         except:
             log.error("failed to get likes: ", exc_info=True)
 
@@ -77,8 +191,6 @@ class PlaylistManager():
     async def enclose_playlists(self):
         lists = await self.get_playlists()
         likes = await self.get_likes(entries=False)
-        for l in lists["playlists"]:
-            del l["id"]
 
         ret = [
             likes,
@@ -87,28 +199,58 @@ class PlaylistManager():
                 'length': len(self.history.list),
                 'thumbnails': await self.history.get_thumbnails() 
             },
-            *lists["playlists"]
+            *[without(l, "id") for l in lists["playlists"]]
         ]
 
         return ret
 
-    async def get_playlist(self, name:str):
+    async def get_playlist(self, name:str, *, limit:int=PAGE_SIZE, cursor:str=None):
         playlist = None
         try:
-            playlist = await self.db.get_playlist(name)
-            del playlist["id"]
+            playlist = without(await self.db.get_playlist(name, limit=limit, cursor=cursor), "id")
             playlist["thumbnails"] = playlist["thumbnails"][:5]
             # do in aria-database
-            for e in playlist["entries"]:
-                del e["meta"]
+            playlist["entries"] = [without(e, "meta") for e in playlist["entries"]]
         except:
             log.error(f"failed to get playlist {name}: ", exc_info=True)
 
         return playlist
 
+    async def get_page(self, name:str, *, limit:int=PAGE_SIZE, cursor:str=None):
+        """
+        One page of any playlist including Likes and History, with `next`
+        set to the cursor of the following page or None on the last one.
+        """
+        if name == "Likes":
+            return await self.get_likes(limit=limit, cursor=cursor)
+        if name == self.history.name:
+            return {
+                "name": self.history.name,
+                "length": len(self.history.list),
+                "entries": await self.history.get_entries(),
+                "next": None
+            }
+        return await self.get_playlist(name, limit=limit, cursor=cursor)
+
+    async def iter_playlist(self, name:str, *, limit:int=PAGE_SIZE):
+        """
+        Yield the entries of a playlist page by page.
+        """
+        cursor = None
+        while True:
+            page = await self.get_page(name, limit=limit, cursor=cursor)
+            if not page:
+                return
+
+            yield page["entries"]
+            cursor = page.get("next")
+            if not cursor:
+                return
+
     async def like(self, uri):
         try:
             await self.db.toggle_like(uri, True)
+            self.likes.add(uri)
             log.info(f"liked: {uri}")
         except:
             log.error(f"failed to like {uri}: ", exc_info=True)
@@ -120,6 +262,7 @@ class PlaylistManager():
     async def dislike(self, uri):
         try:
             await self.db.toggle_like(uri, False)
+            self.likes.remove(uri)
             log.info(f"disliked: {uri}")
         except:
             log.error(f"failed to dislike {uri}: ", exc_info=True)
@@ -128,6 +271,14 @@ class PlaylistManager():
         self.view.on_playlists_change()
         self.view.on_playlist_entry_change("Likes")
 
+    def on_likes_dropped(self, likes:Dict[str, bool]) -> None:
+        # like and dislike already reported success; reload what the store really has
+        log.error(f"{len(likes)} likes were not saved: {list(likes)}")
+        self.likes.loaded = False
+        self.view.on_write_failed("likes", list(likes))
+        self.view.on_playlists_change()
+        self.view.on_playlist_entry_change("Likes")
+
     async def create(self, name:str):
         # sanitize name
         name = Path(name).name
@@ -182,6 +333,9 @@ class PlaylistManager():
         self.view.on_playlist_entry_change(name)
 
     async def is_liked(self, uri):
+        if await self.load_likes():
+            return uri in self.likes
+
         payload = None
         try:
             payload = await self.db.is_liked(uri)
@@ -190,8 +344,22 @@ class PlaylistManager():
 
         return payload.get("liked") if payload else False
 
-    async def get_random_entry(self) -> Optional[PlayableEntry]:
-        likes = await self.get_likes()
-        entries = likes.get("entries")
-        if len(entries):
-            return choice(entries)["uri"]
+    async def is_liked_many(self, uris):
+        if await self.load_likes():
+            return {uri: uri in self.likes for uri in uris}
+
+        payload = {}
+        try:
+            payload = await self.db.is_liked_many(uris)
+        except:
+            log.error("failed to get liked states", exc_info=True)
+
+        return {uri: bool(payload.get(uri, {}).get("liked")) for uri in uris}
+
+    async def get_random_entry(self) -> Optional[str]:
+        if not await self.load_likes():
+            return None
+
+        if self.autoplay == 'fresh':
+            return self.likes.sample_fresh(self.history.get_uris())
+        return self.likes.sample()
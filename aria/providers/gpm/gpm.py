@@ -4,25 +4,38 @@ from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from logging import getLogger
 from pathlib import Path
-from typing import Optional, Sequence, Union
+from typing import Callable, Iterable, Optional, Sequence, Union
 
-from aiohttp import ClientSession
+from aiohttp import ClientError
 from gmusicapi.clients import Mobileclient
 
+from aria.media_cache import MediaCache
 from aria.models import EntryOverview, PlayableEntry, Provider
-from aria.utils import get_duration, get_volume, save_file
+from aria.exceptions import DownloadError
+from aria.http_client import HTTPClient
+from aria.utils import download_to_file, get_duration, get_volume
 
+from .index import LibraryIndex
 from .store import StoreManager
 from .utils import GPMError, GPMSong, get_song_uri, id_to_uri, uri_to_id, uri_to_user
 
 log = getLogger(__name__)
 
+DOWNLOAD_RETRIES = 3
+# songs per request when syncing a library to the store
+SYNC_BATCH = 500
+
 
 class GPMEntry(PlayableEntry):
+    __slots__ = ('cache_dir', 'gpm', 'entry', 'cache', 'uri', 'song_id', 'user',
+                 'thumbnail', 'filename', 'volume')
+
     def __init__(self, cache_dir, gpm:'GPMProvider', entry:EntryOverview):
+        super().__init__()
         self.cache_dir = Path(cache_dir)
         self.gpm = gpm
         self.entry = entry
+        self.cache = MediaCache()
 
         self.title = self.entry.title
         self.uri = self.entry.uri
@@ -32,18 +45,18 @@ class GPMEntry(PlayableEntry):
         self.filename = str(self.cache_dir/f'{self.gpm.name}-{self.user}-{self.song_id}.mp3')
         self.duration = 0
         self.volume = 0
-        
-        self.start = asyncio.Event()
-        self.end = asyncio.Event()
+        # always mp3, never passed through
+        self.stream_info = {}
 
     async def download(self):
         self.start.set()
 
-        if Path(self.filename).is_file():
+        if self.cache.lookup(self.filename):
             log.info(f'Already downloaded: {self.filename}')
         else:
             try:
                 await self.gpm.download(self.user, self.song_id, self.filename)
+                self.cache.add(self.filename)
                 log.info(f'Downloaded: {self.filename}')
             except:
                 log.error('Failed to download: ', exc_info=True)
@@ -56,7 +69,10 @@ class GPMEntry(PlayableEntry):
         self.end.set()
 
     def is_ready(self):
-        return Path(self.filename).exists()
+        return self.cache.contains(self.filename)
+
+    def cached_file(self):
+        return self.filename
 
 
 class GPMProvider(Provider):
@@ -64,17 +80,22 @@ class GPMProvider(Provider):
     resolve_prefixes = ['gpm']
     can_search = True
 
-    def __init__(self, *, credfile=None):
+    def __init__(self, *, credfile=None, max_downloads=4, download_rate=0):
         self.credfile = credfile or 'config/google.auth' # TODO
         self.cred_dir = Path("config/gpm/")
 
         self.loop = asyncio.get_event_loop()
         self.pool = ThreadPoolExecutor(max_workers=4)
+        self.downloads = asyncio.Semaphore(max_downloads)
+        # KB/s per download, 0 for unlimited
+        self.download_rate = download_rate * 1024
         self.store = StoreManager()
         self.gpm = {}
         self.subscribed = None
-        self.session = ClientSession()
+        self.http = HTTPClient()
+        self.library = LibraryIndex(self.cred_dir/"library.json")
         self.init_client()
+        self.library.load()
 
     def init_client(self):
         for cred in self.cred_dir.glob("*.auth"):
@@ -151,11 +172,19 @@ class GPMProvider(Provider):
     async def search_local(self, keyword:str) -> Sequence[EntryOverview]:
         ret = []
         try:
-            ret = await self.store.search(keyword)
+            indexed = self.library.indexed
+            ret = self.library.search(keyword)
+            # libraries are indexed on their first update; the store has the others
+            if not indexed or any(user not in indexed for user in self.gpm):
+                stored = await self.store.search(keyword) or []
+                ret += [song for song in stored if song.user not in indexed]
         except:
             log.error('Failed to search: ', exc_info=True)
 
-        return [self.enclose_entry(entry) for entry in ret]
+        return [self.enclose_entry(entry) for entry in ret or []]
+
+    def suggestions(self) -> Iterable[str]:
+        return self.library.terms()
 
     async def search_subscription(self, query:str) -> Sequence[EntryOverview]:
         if not self.subscribed:
@@ -174,7 +203,7 @@ class GPMProvider(Provider):
 
         return [self.enclose_entry(entry, store=True) for entry in ret]
 
-    async def update(self, user=None):
+    async def update(self, user=None, progress:Callable[[dict], None]=None):
         to_update = self.gpm
         if user:
             if user in self.gpm:
@@ -183,38 +212,84 @@ class GPMProvider(Provider):
                 log.error(f"User not found: {user}")
                 return
 
-        user_songs = {}
+        await asyncio.gather(*[self.sync_user(name, cli, progress) for name, cli in to_update.items()])
+        await self.loop.run_in_executor(self.pool, self.library.save)
+
+    async def sync_user(self, name:str, cli:Mobileclient, progress:Callable[[dict], None]=None) -> None:
+        """
+        Sync the library of `name` to the store, sending only songs that changed
+        since the last sync. The first sync, and every sync to a store without
+        upsert and remove, replaces the whole library instead.
+        The library index holds what the store last accepted.
+        """
+        def notify(stage, done=0, total=0):
+            if progress:
+                progress({"user": name, "stage": stage, "done": done, "total": total})
 
-        for name, cli in to_update.items():
-            res = await self.loop.run_in_executor(self.pool, cli.get_all_songs)
-            log.info(f'{name}: Retrieved {len(res)} songs')
-            if res:
-                user_songs[name] = res
-
-        entries = []
-        for _, songs in user_songs.items():
-            for song in songs:
-                album = song.get('albumArtRef')
-                album_url = ''
-                if album:
-                    album_url = album[0].get('url').replace('http://', 'https://', 1)
-                # entry = GPMSong(user, song.get('id', ''), song.get('title', ''),
-                #                 song.get('artist', ''), song.get('album', ''),
-                #                 album_url)
-                entries.append({
-                    "uri": f"gpm:track:{user}:{song.get('id')}",
-                    "gpmUser": user,
-                    "id": song.get("id"),
-                    "title": song.get("title"),
-                    "artist": song.get("artist", ""),
-                    "album": song.get("album", ""),
-                    "thumbnail": album_url
-                })
         try:
-            await self.store.update(entries, user)
+            res = await self.loop.run_in_executor(self.pool, cli.get_all_songs)
         except:
-            log.error('Failed to update gpm database')
-        
+            log.error(f'{name}: Failed to retrieve songs: ', exc_info=True)
+            notify("failed")
+            return
+
+        log.info(f'{name}: Retrieved {len(res)} songs')
+        library = [self.create_library_song(name, song) for song in res]
+        current = {get_song_uri(song) for song in library}
+        known = self.library.users.get(name) or set()
+        changed = [song for song in library if self.library.docs.get(get_song_uri(song)) != song]
+        removed = list(known - current)
+        log.info(f'{name}: {len(changed)} changed, {len(removed)} removed')
+
+        if known and not changed and not removed:
+            uploaded = 0
+        elif known and self.store.incremental:
+            uploaded = await self.upload_changes(name, changed, removed, notify)
+            if uploaded is None and not self.store.incremental:
+                uploaded = await self.upload_all(name, library, notify)
+        else:
+            # nothing synced yet; the whole library replaces whatever the store has
+            uploaded = await self.upload_all(name, library, notify)
+
+        if uploaded is None:
+            return
+
+        self.library.update_user(name, library)
+        notify("done", uploaded, uploaded)
+
+    async def upload_changes(self, name:str, changed:Sequence[GPMSong], removed:Sequence[str],
+                             notify:Callable[..., None]) -> Optional[int]:
+        # songs sent, None on failure
+        total = len(changed) + len(removed)
+        notify("fetched", 0, total)
+
+        done = 0
+        for i in range(0, len(changed), SYNC_BATCH):
+            batch = changed[i:i+SYNC_BATCH]
+            if not await self.store.upsert([self.library_entry(song) for song in batch], name):
+                notify("failed", done, total)
+                return None
+            done += len(batch)
+            notify("uploading", done, total)
+
+        for i in range(0, len(removed), SYNC_BATCH):
+            batch = removed[i:i+SYNC_BATCH]
+            if not await self.store.remove(batch, name):
+                notify("failed", done, total)
+                return None
+            done += len(batch)
+            notify("uploading", done, total)
+
+        return done
+
+    async def upload_all(self, name:str, library:Sequence[GPMSong], notify:Callable[..., None]) -> Optional[int]:
+        notify("fetched", 0, len(library))
+        if not await self.store.update([self.library_entry(song) for song in library], name):
+            notify("failed", 0, len(library))
+            return None
+        notify("uploading", len(library), len(library))
+        return len(library)
+
     async def get_mp3(self, user, song_id:str) -> Optional[str]:
         cli = self.subscribed if user == 'store' else self.gpm.get(user)
         if not cli:
@@ -230,16 +305,24 @@ class GPMProvider(Provider):
         return mp3
 
     async def download(self, user, song_id:str, filename:str):
-        mp3 = await self.get_mp3(user, song_id)
-        ret = None
-        async with self.session.get(mp3) as res:
-            if res.status == 200:
-                ret = await res.read()
-
-        if not ret:
-            raise GPMError()
+        # stream into a partial file, then move it into place atomically
+        part = Path(f'{filename}.part')
+        async with self.downloads:
+            for attempt in range(1, DOWNLOAD_RETRIES + 1):
+                # stream urls expire, so get a fresh one for each attempt
+                mp3 = await self.get_mp3(user, song_id)
+                if not mp3:
+                    raise GPMError()
+
+                try:
+                    await download_to_file(self.http.session('download'), mp3, str(part), rate=self.download_rate)
+                    break
+                except (ClientError, asyncio.TimeoutError, DownloadError):
+                    log.error(f'Download of {song_id} failed ({attempt}/{DOWNLOAD_RETRIES}): ', exc_info=True)
+            else:
+                raise GPMError()
 
-        await self.loop.run_in_executor(self.pool, partial(save_file, filename, ret))
+        part.replace(filename)
 
     def enclose_entry(self, entry:GPMSong, store=False) -> EntryOverview:
         title = f'{entry.title} - {entry.artist}'
@@ -253,6 +336,28 @@ class GPMProvider(Provider):
         # eo.is_liked = entry.is_liked
         return eo
 
+    def library_entry(self, song:GPMSong) -> dict:
+        return {
+            "uri": get_song_uri(song),
+            "gpmUser": song.user,
+            "id": song.song_id,
+            "title": song.title,
+            "artist": song.artist,
+            "album": song.album,
+            "thumbnail": song.albumArtUrl
+        }
+
+    def create_library_song(self, user:str, song:dict) -> GPMSong:
+        album = song.get('albumArtRef')
+        album_url = ''
+        if album:
+            album_url = album[0].get('url').replace('http://', 'https://', 1)
+        return GPMSong(
+            user, song.get('id'),
+            song.get('title', ''), song.get('artist', ''), song.get('album', ''),
+            album_url, False
+        )
+
     def create_store_song(self, track:dict) -> GPMSong:
         album_art = track['albumArtRef'][0]['url'] if track['albumArtRef'] else ''
         return GPMSong(
@@ -0,0 +1,201 @@
+import json
+import re
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+from heapq import nlargest
+from logging import getLogger
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .utils import GPMSong, get_song_uri
+
+log = getLogger(__name__)
+
+word_match = re.compile(r'\w+')
+
+# score added for each query token found in the field
+FIELD_WEIGHTS = (
+    ('title', 3),
+    ('artist', 2),
+    ('album', 1)
+)
+
+
+def normalize(text:str) -> str:
+    return unicodedata.normalize('NFKC', text or '').casefold()
+
+def tokenize(text:str) -> Set[str]:
+    # latin words are indexed as they are, CJK runs as character bigrams
+    # since they have no spaces to split on, and as single characters
+    # so that one-character queries match too
+    tokens = set()
+    for word in word_match.findall(normalize(text)):
+        if word.isascii() or len(word) == 1:
+            tokens.add(word)
+        else:
+            tokens.update(word[i:i+2] for i in range(len(word) - 1))
+            tokens.update(word)
+    return tokens
+
+def query_tokens(text:str) -> Tuple[Set[str], Optional[str]]:
+    # the last latin word of a query may be unfinished, so it matches as a prefix
+    words = word_match.findall(normalize(text))
+    if not words or not words[-1].isascii():
+        return tokenize(text), None
+    return tokenize(' '.join(words[:-1])), words[-1]
+
+
+class LibraryIndex():
+    """
+    In-memory inverted index over the GPM libraries of all users.
+    Postings map a token to {uri: score}, so a query only touches
+    the documents that contain its rarest token.
+    """
+
+    def __init__(self, index_file:str=None):
+        self.index_file = Path(index_file) if index_file else None
+
+        self.docs: Dict[str, GPMSong] = {}
+        self.users: Dict[str, Set[str]] = defaultdict(set)
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        # users whose whole library is indexed
+        self.indexed: Set[str] = set()
+        # sorted tokens for prefix lookups, rebuilt when tokens come or go
+        self.vocabulary: Optional[List[str]] = None
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def add(self, song:GPMSong) -> None:
+        uri = get_song_uri(song)
+        if uri in self.docs:
+            self.remove(uri)
+
+        self.docs[uri] = song
+        self.users[song.user].add(uri)
+        for token, score in self.score_tokens(song).items():
+            if token not in self.postings:
+                self.vocabulary = None
+            self.postings[token][uri] = score
+
+    def remove(self, uri:str) -> None:
+        song = self.docs.pop(uri, None)
+        if not song:
+            return
+
+        self.users[song.user].discard(uri)
+        for token in self.score_tokens(song):
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            posting.pop(uri, None)
+            if not posting:
+                del self.postings[token]
+                self.vocabulary = None
+
+    def update_user(self, user:str, songs:Iterable[GPMSong]) -> None:
+        """
+        Replace the library of `user`, touching only added, changed and removed songs.
+        """
+        current = set()
+        for song in songs:
+            uri = get_song_uri(song)
+            current.add(uri)
+            if self.docs.get(uri) != song:
+                self.add(song)
+
+        for uri in self.users[user] - current:
+            self.remove(uri)
+
+        self.indexed.add(user)
+        log.info(f'Indexed {len(self.users[user])} songs for {user} ({len(self.docs)} total)')
+
+    def prefixed(self, prefix:str) -> Dict[str, int]:
+        # {uri: score} of documents with a token starting with `prefix`
+        if self.vocabulary is None:
+            self.vocabulary = sorted(self.postings)
+
+        ret = {}
+        for i in range(bisect_left(self.vocabulary, prefix), len(self.vocabulary)):
+            token = self.vocabulary[i]
+            if not token.startswith(prefix):
+                break
+            for uri, score in self.postings[token].items():
+                if ret.get(uri, 0) < score:
+                    ret[uri] = score
+        return ret
+
+    def search(self, query:str, *, limit:int=100) -> List[GPMSong]:
+        tokens, prefix = query_tokens(query)
+        if not tokens and not prefix:
+            return []
+
+        postings = []
+        for token in tokens:
+            posting = self.postings.get(token)
+            if not posting:
+                return []
+            postings.append(posting)
+        if prefix:
+            posting = self.prefixed(prefix)
+            if not posting:
+                return []
+            postings.append(posting)
+
+        # every token must match; walk the smallest posting list
+        postings.sort(key=len)
+        first, rest = postings[0], postings[1:]
+        scores = {}
+        for uri, score in first.items():
+            for posting in rest:
+                other = posting.get(uri)
+                if other is None:
+                    break
+                score += other
+            else:
+                scores[uri] = score
+
+        return [self.docs[uri] for uri in nlargest(limit, scores, key=scores.__getitem__)]
+
+    def terms(self) -> Iterator[str]:
+        for song in self.docs.values():
+            yield song.title
+            yield song.artist
+            if song.album:
+                yield song.album
+
+    def score_tokens(self, song:GPMSong) -> Dict[str, int]:
+        ret = {}
+        for field, weight in FIELD_WEIGHTS:
+            for token in tokenize(getattr(song, field)):
+                ret[token] = ret.get(token, 0) + weight
+        return ret
+
+    def load(self) -> None:
+        if not self.index_file or not self.index_file.is_file():
+            return
+
+        try:
+            with self.index_file.open('r') as f:
+                payload = json.load(f)
+            for user, songs in payload.items():
+                self.update_user(user, (GPMSong(*song) for song in songs))
+        except:
+            log.error(f'Failed to load library index {self.index_file}: ', exc_info=True)
+
+    def save(self) -> None:
+        if not self.index_file:
+            return
+
+        payload = {
+            user: [self.docs[uri] for uri in uris]
+            for user, uris in self.users.items() if user in self.indexed
+        }
+        tmp = self.index_file.with_suffix('.tmp')
+        try:
+            with tmp.open('w') as f:
+                json.dump(payload, f)
+            tmp.replace(self.index_file)
+        except:
+            log.error(f'Failed to save library index {self.index_file}: ', exc_info=True)
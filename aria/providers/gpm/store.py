@@ -3,7 +3,7 @@ from typing import Optional, Sequence
 
 from aiohttp import ClientSession
 
-from aria.database import Database
+from aria.database import Database, DatabaseError
 from aria.models import EntryOverview
 
 from .utils import GPMSong
@@ -17,13 +17,46 @@ class StoreManager():
         # self.db = db_file or 'config/gpm.sqlite3'
         # self.session = ClientSession()
         self.db = Database()
+        # False once the store turned out to lack upsert and remove
+        self.incremental = True
 
-    async def update(self, songs:Sequence[dict], user:str) -> None:
+    async def update(self, songs:Sequence[dict], user:str) -> bool:
         try:
             await self.db.update_gpm(songs, user)
             log.info(f"updated GPM for user: {user}")
+            return True
         except:
             log.error(f"failed to update GPM for user {user}: ", exc_info=True)
+            return False
+
+    async def upsert(self, songs:Sequence[dict], user:str) -> bool:
+        try:
+            await self.db.upsert_gpm(songs, user)
+            return True
+        except DatabaseError as e:
+            self.on_incremental_error(e, user)
+            return False
+        except:
+            log.error(f"failed to upsert GPM for user {user}: ", exc_info=True)
+            return False
+
+    async def remove(self, uris:Sequence[str], user:str) -> bool:
+        try:
+            await self.db.remove_gpm(uris, user)
+            return True
+        except DatabaseError as e:
+            self.on_incremental_error(e, user)
+            return False
+        except:
+            log.error(f"failed to remove GPM for user {user}: ", exc_info=True)
+            return False
+
+    def on_incremental_error(self, e:DatabaseError, user:str) -> None:
+        if e.status in (404, 405):
+            log.info("The store has no incremental GPM endpoints. Syncing whole libraries.")
+            self.incremental = False
+        else:
+            log.error(f"failed to sync GPM changes for user {user}: ", exc_info=True)
 
     async def search(self, keyword:str):
         payload = None
@@ -63,7 +96,7 @@ class StoreManager():
                 {
                     "provider": e.source,
                     "title": e.title,
-                    "url": e.uri,
+                    "uri": e.uri,
                     "thumbnail": e.thumbnail,
                     "meta": ""
                 }
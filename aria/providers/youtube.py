@@ -2,8 +2,7 @@ import asyncio
 from logging import getLogger
 from typing import Optional, Sequence
 
-from aiohttp import ClientSession
-
+from aria.http_client import HTTPClient
 from aria.models import EntryOverview, Provider
 from aria.exceptions import ProviderNotReady
 
@@ -23,7 +22,7 @@ class YoutubeProvider(Provider):
 
     def __init__(self, *, api_key:str=None):
         self.loop = asyncio.get_event_loop()
-        self.session = ClientSession()
+        self.http = HTTPClient()
         self.api_key = api_key
 
         if not self.api_key:
@@ -61,7 +60,7 @@ class YoutubeProvider(Provider):
     async def youtube_api(self, params={}) -> Optional[dict]:
         ret = None
         try:
-            async with self.session.get(self.endpoint, params={**self.default_params, **params}) as res:
+            async with self.http.session('api').get(self.endpoint, params={**self.default_params, **params}) as res:
                 ret = await res.json()
                 log.debug(ret)
         except:
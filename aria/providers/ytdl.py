@@ -1,17 +1,20 @@
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from functools import partial
 import json
 from logging import getLogger
+import multiprocessing
+import os
 from pathlib import Path
-import shutil
-from typing import Sequence
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple
 
 from youtube_dl import YoutubeDL
 
 from aria.database import Database
+from aria.media_cache import MediaCache
 from aria.models import EntryOverview, PlayableEntry, Provider
-from aria.utils import get_duration, get_volume
+from aria.utils import get_audio_stream, get_duration, get_volume
 
 log = getLogger(__name__)
 
@@ -23,13 +26,176 @@ ytdl_params = {
     'quiet': True,
     'logtostderr': False
 }
+# playlists only list their entries; per-entry info is fetched on demand
+ytdl_flat_params = {
+    **ytdl_params,
+    'extract_flat': 'in_playlist'
+}
+
+# YoutubeDL instances of an extraction worker process, keyed by (flat, outdir)
+worker_ytdl: Dict[Tuple[bool, Optional[str]], YoutubeDL] = {}
+
+
+def ytdl_options(flat:bool=False, outdir:str=None) -> dict:
+    params = ytdl_flat_params if flat else ytdl_params
+    if outdir:
+        # youtube_dl writes `<name>.part` next to the output and renames it when done
+        params = {**params, 'outtmpl': str(Path(outdir)/params['outtmpl'])}
+    return params
+
+
+def is_flat(info:dict) -> bool:
+    return bool(info) and info.get('_type') == 'url'
+
+def flat_entry_url(entry:dict) -> str:
+    url = entry.get('url') or ''
+    if entry.get('ie_key') == 'Youtube' and not url.startswith('http'):
+        return f"https://www.youtube.com/watch?v={entry.get('id') or url}"
+    return url
+
+def flat_entry_thumbnail(entry:dict) -> str:
+    if entry.get('ie_key') == 'Youtube' and entry.get('id'):
+        return f"https://i.ytimg.com/vi/{entry['id']}/hqdefault.jpg"
+    return ''
+
+# YTDLMeta fields taken from flat playlist entries only
+FLAT_ONLY = ('url', 'ie_key')
+
+
+class YTDLMeta(NamedTuple):
+    """
+    What we keep of an extract_info result: enough to show the entry, to
+    name its file and to know the chosen audio format. Flat playlist
+    entries have `flat` set and only id, title and urls filled in.
+    """
+    id: Optional[str] = None
+    title: str = ''
+    webpage_url: str = ''
+    thumbnail: str = ''
+    duration: Optional[float] = None
+    is_live: bool = False
+    extractor: Optional[str] = None
+    extractor_key: Optional[str] = None
+    # chosen format, also inputs of the output template
+    ext: Optional[str] = None
+    format_id: Optional[str] = None
+    acodec: Optional[str] = None
+    abr: Optional[float] = None
+    asr: Optional[int] = None
+    flat: bool = False
+    # flat entries only
+    url: Optional[str] = None
+    ie_key: Optional[str] = None
+
+    @classmethod
+    def from_info(cls, info:dict) -> 'YTDLMeta':
+        """
+        Build from a full or flat extract_info result, or from a cached dict
+        written either by `_asdict()` or by older versions storing the whole info.
+        """
+        if info.get('flat') or is_flat(info):
+            return cls(
+                id=info.get('id'),
+                title=info.get('title') or '',
+                webpage_url=info.get('webpage_url') or flat_entry_url(info),
+                thumbnail=info.get('thumbnail') or flat_entry_thumbnail(info),
+                flat=True,
+                url=info.get('url'),
+                ie_key=info.get('ie_key')
+            )
+
+        # the url of a full info is the expiring media url of the chosen format
+        return cls(**{f: info[f] for f in cls._fields
+                      if f not in FLAT_ONLY and info.get(f) is not None})
+
+    def info(self) -> dict:
+        # dict for youtube_dl, e.g. prepare_filename
+        ret = {k: v for k, v in self._asdict().items() if v is not None}
+        if self.flat:
+            ret['_type'] = 'url'
+        return ret
+
+
+def compact_info(info:dict) -> dict:
+    # only YTDLMeta fields cross the process boundary
+    ret = YTDLMeta.from_info(info)._asdict()
+    if 'entries' in info:
+        ret['entries'] = [compact_info(e) for e in info['entries'] if e]
+    return ret
+
+def get_worker_ytdl(flat:bool, outdir:Optional[str]) -> YoutubeDL:
+    # CALLED IN WORKER PROCESS
+    key = (flat, outdir)
+    if key not in worker_ytdl:
+        worker_ytdl[key] = YoutubeDL(ytdl_options(flat, outdir))
+    return worker_ytdl[key]
+
+def init_worker():
+    # CALLED IN WORKER PROCESS
+    get_worker_ytdl(False, None)
+    get_worker_ytdl(True, None)
+
+def extract_in_worker(uri:str, download:bool, flat:bool, outdir:Optional[str]) -> dict:
+    # CALLED IN WORKER PROCESS
+    ytdl = get_worker_ytdl(flat, outdir)
+    res = ytdl.extract_info(uri, download=download)
+    ret = compact_info(res)
+    if download:
+        ret['_filename'] = ytdl.prepare_filename(res)
+    return ret
+
+
+class ExtractorPool():
+    """
+    Process pool running extract_info off the GIL of the main process.
+    The whole pool is replaced after `max_jobs` jobs to contain memory growth
+    of long-lived YoutubeDL instances; jobs already submitted finish on the old one.
+    """
+
+    def __init__(self, workers:int, max_jobs:int):
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.jobs = 0
+        # do not fork the event loop and stream thread
+        self.context = multiprocessing.get_context('spawn')
+        self.executor = self.create_executor()
+
+    def create_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=self.context,
+                                   initializer=init_worker)
+
+    def get(self) -> ProcessPoolExecutor:
+        if self.jobs >= self.max_jobs:
+            log.info(f'Recycling extractor pool after {self.jobs} jobs')
+            self.recycle()
+        self.jobs += 1
+        return self.executor
+
+    def recycle(self) -> None:
+        old = self.executor
+        self.executor = self.create_executor()
+        self.jobs = 0
+        old.shutdown(wait=False)
+
+
+def download_key(song:EntryOverview) -> str:
+    # urls of the same video (youtu.be, watch?v=, ...) share extractor and id
+    meta = song.entry
+    if isinstance(meta, YTDLMeta) and meta.id and not meta.flat:
+        return f'{meta.extractor_key or meta.extractor}:{meta.id}'
+    return song.uri
 
 
 class YoutubeDLEntry(PlayableEntry):
+    __slots__ = ('cache_dir', 'ytdl', 'entry', 'cache', 'uri', 'thumbnail',
+                 'expected_filename', 'filename', 'volume')
+
     def __init__(self, cache_dir, ytdl:'YTDLProvider', song:EntryOverview, filename=None):
+        super().__init__()
         self.cache_dir = Path(cache_dir)
         self.ytdl = ytdl
         self.entry = song
+        self.cache = MediaCache()
 
         self.title = self.entry.title
         self.uri = self.entry.uri
@@ -38,48 +204,90 @@ class YoutubeDLEntry(PlayableEntry):
         self.filename = None
         self.duration = 0
         self.volume = 0
-    
-        self.start = asyncio.Event()
-        self.end = asyncio.Event()
 
     async def download(self):
         self.start.set()
+        if not isinstance(self.entry.entry, YTDLMeta) or self.entry.entry.flat:
+            # entry comes from a flat playlist; fetch its info now
+            if not await self.ytdl.complete(self.entry):
+                self.end.set()
+                return
+
+            self.title = self.entry.title
+            self.thumbnail = self.entry.thumbnail
+            try:
+                self.expected_filename = self.cache_dir/(await self.ytdl.prepare_filename(self.entry.entry))
+            except:
+                log.error('Failed to generate filename:', exc_info=True)
+
         log.debug(f'looking for caches: {str(self.expected_filename)}')
-        if self.expected_filename and self.expected_filename.exists():
+        if self.expected_filename and self.cache.lookup(self.expected_filename):
                 self.filename = str(self.expected_filename)
                 log.info(f'Use cached: {self.expected_filename}')
         else:
-            try:
-                filename = await self.ytdl.download(self.uri)
-                dest = Path(self.cache_dir)/filename
-                shutil.copy(filename, str(dest))
-                # Path(filename).rename(dest)
-                self.filename = str(dest)
+            # added to the cache by the download itself
+            self.filename = await self.ytdl.download(self.entry, str(self.cache_dir))
+            if self.filename:
                 log.info(f'Downloaded: {self.filename}')
-            except:
-                log.error('Moving file failed: ', exc_info=True)
 
         self.duration = await get_duration(self.filename)
         self.volume = await get_volume(self.filename)
+        self.stream_info = await get_audio_stream(self.filename)
         
         self.end.set()
 
     def is_ready(self):
-        if self.filename:
-            return Path(self.filename).exists()
-        else:
-            return False
+        return self.cache.contains(self.filename)
+
+    def cached_file(self):
+        return self.filename or self.expected_filename
             
 
 class YTDLProvider(Provider):
     name = 'ytdl'
     resolve_prefixes = ['http', 'https']
 
-    def __init__(self):
+    def __init__(self, *, process_pool=False, workers=None, max_jobs_per_worker=50,
+                 flat_playlist=False, lazy_concurrency=4):
         self.loop = asyncio.get_event_loop()
         self.pool = ThreadPoolExecutor(max_workers=4)
-        self.ytdl = YoutubeDL(ytdl_params)
+        self.instances: Dict[Tuple[bool, Optional[str]], YoutubeDL] = {}
+        self.ytdl = self.get_ytdl()
         self.db = Database()
+        self.cache = MediaCache()
+        # video -> download task, shared by entries of the same video
+        self.downloading: Dict[str, asyncio.Task] = {}
+
+        self.flat_playlist = flat_playlist
+        # bounds info fetches of flat entries
+        self.lazy = asyncio.Semaphore(lazy_concurrency)
+
+        self.procs = None
+        if process_pool:
+            workers = workers or os.cpu_count() or 1
+            self.procs = ExtractorPool(workers, workers * max_jobs_per_worker)
+            log.info(f'Extracting in {workers} worker processes')
+
+    def get_ytdl(self, flat:bool=False, outdir:str=None) -> YoutubeDL:
+        key = (flat, outdir)
+        if key not in self.instances:
+            self.instances[key] = YoutubeDL(ytdl_options(flat, outdir))
+        return self.instances[key]
+
+    async def extract_info(self, uri:str, download:bool=False, flat:bool=False, outdir:str=None) -> dict:
+        if not self.procs:
+            ytdl = self.get_ytdl(flat, outdir)
+            res = await self.loop.run_in_executor(self.pool, partial(ytdl.extract_info, uri, download=download))
+            if download:
+                res['_filename'] = await self.loop.run_in_executor(self.pool, partial(ytdl.prepare_filename, res))
+            return res
+
+        try:
+            return await self.loop.run_in_executor(self.procs.get(), partial(extract_in_worker, uri, download, flat, outdir))
+        except BrokenProcessPool:
+            log.error('Extractor pool is broken. Recycling...')
+            self.procs.recycle()
+            raise
 
     async def resolve(self, uri, force_ytdl=False) -> Sequence[EntryOverview]:
         ret = []
@@ -93,7 +301,7 @@ class YTDLProvider(Provider):
                     payload.get("title"),
                     payload.get("uri"),
                     payload.get("thumbnail"), payload.get("thumbnail"),
-                    json.loads(payload.get("meta"))
+                    YTDLMeta.from_info(json.loads(payload.get("meta")))
                 )
                 entry.is_liked = payload.get("liked")
                 ret.append(entry)
@@ -102,62 +310,106 @@ class YTDLProvider(Provider):
                 log.error(f"no cache found: {uri}")
 
         try:
-            res = await self.loop.run_in_executor(self.pool, partial(self.ytdl.extract_info, uri, download=False))
+            res = await self.extract_info(uri, flat=self.flat_playlist)
             log.debug(res.get('extractor'))
         except:
             log.error('Failed to extract uri: ', exc_info=True)
             return []
         
-        if 'entries' in res:
-            for entry in res['entries']:
-                if 'is_live' in entry and entry['is_live'] == True:
-                    continue
-                
-                ret.append(EntryOverview(res['extractor'].split(':')[0],
-                                         entry.get('title') or '',
-                                         entry.get('webpage_url') or '',
-                                         entry.get('thumbnail') or '',
-                                         entry.get('thumbnail') or '',
-                                         entry=entry))
-        else:
-            if 'is_live' in res and res['is_live'] == True:
-                pass
-            else:
-                ret.append(EntryOverview(res['extractor'].split(':')[0],
-                                        res.get('title') or '',
-                                        res.get('webpage_url') or '',
-                                        res.get('thumbnail') or '',
-                                        res.get('thumbnail') or '',
-                                        entry=res))
-
-        self.loop.create_task(self.db.store_cache(
-            [{
-                "provider": e.source,
-                "title": e.title,
-                "uri": e.uri,
-                "thumbnail": e.thumbnail,
-                "meta": json.dumps(e.entry)
-            } for e in ret]
-        ))
+        source = res['extractor'].split(':')[0]
+        infos = res['entries'] if 'entries' in res else [res]
+        for info in infos:
+            meta = YTDLMeta.from_info(info)
+            if meta.is_live:
+                continue
+
+            ret.append(EntryOverview(source, meta.title, meta.webpage_url,
+                                     meta.thumbnail, meta.thumbnail, entry=meta))
+
+        self.loop.create_task(self.store_cache(ret))
         return ret
 
+    async def store_cache(self, entries:Sequence[EntryOverview]) -> None:
+        try:
+            await self.db.store_cache(
+                [{
+                    "provider": e.source,
+                    "title": e.title,
+                    "uri": e.uri,
+                    "thumbnail": e.thumbnail,
+                    "meta": json.dumps(e.entry._asdict())
+                } for e in entries]
+            )
+        except:
+            log.error(f"failed to store cache for {len(entries)} entries: ", exc_info=True)
+
+    async def complete(self, song:EntryOverview) -> bool:
+        """
+        Replace info of a flat playlist entry with the full one and write it back to the cache.
+        """
+        try:
+            async with self.lazy:
+                res = await self.extract_info(song.uri)
+        except:
+            log.error(f'Failed to extract flat entry {song.uri}: ', exc_info=True)
+            return False
+
+        meta = YTDLMeta.from_info(res)
+        song.title = meta.title or song.title
+        song.thumbnail = meta.thumbnail or song.thumbnail
+        song.thumbnail_small = song.thumbnail
+        song.entry = meta
+        self.loop.create_task(self.store_cache([song]))
+        return True
+
+    async def prepare_filename(self, meta:YTDLMeta) -> str:
+        return await self.loop.run_in_executor(self.pool, partial(self.ytdl.prepare_filename, meta.info()))
+
     async def resolve_playable(self, uri, cache_dir) -> Sequence[YoutubeDLEntry]:
         resolved = await self.resolve(uri) if isinstance(uri, str) else [uri]
         ret = []
         for song in resolved:
+            if not isinstance(song.entry, YTDLMeta) or song.entry.flat:
+                # filename is known once info is fetched on download
+                ret.append(YoutubeDLEntry(cache_dir, self, song))
+                continue
+
             try:
-                filename = await self.loop.run_in_executor(self.pool, partial(self.ytdl.prepare_filename, song.entry))
+                filename = await self.prepare_filename(song.entry)
                 log.debug(f'Expected filename: {filename}')
                 ret.append(YoutubeDLEntry(cache_dir, self, song, filename))
             except:
                 log.error('Failed to generate filename:', exc_info=True)
         return ret
 
-    async def download(self, uri):
+    async def download(self, song:EntryOverview, cache_dir:str) -> Optional[str]:
+        """
+        Download `song` straight into `cache_dir`. Concurrent calls for the same video,
+        under any of its urls, share one download.
+        """
+        key = download_key(song)
+        task = self.downloading.get(key)
+        if not task:
+            task = self.loop.create_task(self.do_download(song.uri, cache_dir))
+            self.downloading[key] = task
+            task.add_done_callback(partial(self.on_downloaded, key))
+        else:
+            log.info(f'Joining ongoing download of {key}: {song.uri}')
+
+        # a waiter timing out must not cancel the download for the others
+        return await asyncio.shield(task)
+
+    def on_downloaded(self, key:str, task:asyncio.Task) -> None:
+        # runs even if every waiter was cancelled
+        self.downloading.pop(key, None)
+        if not task.cancelled() and task.result():
+            self.cache.add(task.result())
+
+    async def do_download(self, uri:str, cache_dir:str) -> Optional[str]:
         filename = None
         try:
-            res = await self.loop.run_in_executor(self.pool, partial(self.ytdl.extract_info, uri, download=True))
-            filename = await self.loop.run_in_executor(self.pool, partial(self.ytdl.prepare_filename, res))
+            res = await self.extract_info(uri, download=True, outdir=cache_dir)
+            filename = res['_filename']
         except:
             log.error('Download failed. YoutubeDL sucks: ', exc_info=True)
         
@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+from collections import Counter
+from logging import getLogger
+from time import monotonic
+from typing import Dict, List, Optional
+
+log = getLogger(__name__)
+
+# ops per second and burst size, per session and for the whole process
+SESSION_RATE = 10
+SESSION_BURST = 30
+GLOBAL_RATE = 200
+GLOBAL_BURST = 400
+# ops of a session running at the same time; later ones wait
+SESSION_CONCURRENCY = 4
+# HTTP callers tracked before idle buckets are dropped
+CALLERS_PRUNE_AT = 1000
+# tokens taken by an op; other ops take 1
+COSTS = {
+    'search': 5,
+    'suggest': 1,
+    'queue': 3,
+    'play': 3,
+    'playlist': 2,
+    'update_db': 20
+}
+
+
+class TokenBucket():
+    def __init__(self, rate:float, burst:float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+
+    def refill(self) -> None:
+        now = monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self) -> bool:
+        self.refill()
+        return self.tokens >= self.burst
+
+    def wait(self, cost:float) -> float:
+        # seconds until `cost` tokens are available, 0 if they are
+        self.refill()
+        missing = min(cost, self.burst) - self.tokens
+        return missing / self.rate if missing > 0 else 0
+
+    def take(self, cost:float) -> None:
+        self.tokens -= min(cost, self.burst)
+
+    def give(self, cost:float) -> None:
+        self.tokens = min(self.burst, self.tokens + min(cost, self.burst))
+
+
+class RateLimiter():
+    """
+    Token buckets per session and for all sessions, and a semaphore per session.
+    HTTP callers get a bucket per token, with the session rate.
+    `config` is the rate_limit section of the config; missing keys use the defaults above.
+    """
+
+    def __init__(self, config:Optional[dict]=None) -> None:
+        config = config or {}
+        self.session_rate = config.get('session_rate') or SESSION_RATE
+        self.session_burst = config.get('session_burst') or SESSION_BURST
+        self.concurrency = config.get('session_concurrency') or SESSION_CONCURRENCY
+        self.costs = {**COSTS, **(config.get('costs') or {})}
+        self.bucket = TokenBucket(config.get('global_rate') or GLOBAL_RATE,
+                                  config.get('global_burst') or GLOBAL_BURST)
+
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.semaphores: Dict[str, asyncio.Semaphore] = {}
+        # token digest -> bucket of an HTTP caller
+        self.callers: Dict[str, TokenBucket] = {}
+        self.prune_at = CALLERS_PRUNE_AT
+
+        # op -> count, and session -> op -> count for open sessions
+        self.throttled = Counter()
+        self.throttled_sessions: Dict[str, Counter] = {}
+
+    def cost(self, op:Optional[str]) -> float:
+        return self.costs.get(op, 1) if isinstance(op, str) else 1
+
+    def check(self, session:Optional[str], op:Optional[str], *, bounded:bool=False) -> Optional[float]:
+        """
+        Takes the tokens of `op` and returns None, or returns seconds to retry after
+        and takes nothing. Without a session, or for ops `bounded` to one in flight
+        per session, only the global bucket applies.
+        """
+        buckets = [self.bucket]
+        if session and not bounded:
+            bucket = self.buckets.get(session)
+            if bucket is None:
+                bucket = self.buckets[session] = TokenBucket(self.session_rate, self.session_burst)
+            buckets.append(bucket)
+        return self.take(buckets, op, session)
+
+    def check_caller(self, token:str, op:Optional[str]) -> Optional[float]:
+        """
+        `check` for an HTTP caller authenticated with `token`
+        """
+        key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        bucket = self.callers.get(key)
+        if bucket is None:
+            if len(self.callers) >= self.prune_at:
+                self.prune_callers()
+            bucket = self.callers[key] = TokenBucket(self.session_rate, self.session_burst)
+        return self.take([self.bucket, bucket], op, None)
+
+    def prune_callers(self) -> None:
+        # a full bucket is the same as a new one, so dropping it loses nothing
+        self.callers = {key: b for key, b in self.callers.items() if not b.is_full()}
+        self.prune_at = max(CALLERS_PRUNE_AT, 2 * len(self.callers))
+
+    def refund(self, op:Optional[str]) -> None:
+        # global tokens of an op cancelled before it ran to completion
+        self.bucket.give(self.cost(op))
+
+    def take(self, buckets:List[TokenBucket], op:Optional[str], session:Optional[str]) -> Optional[float]:
+        cost = self.cost(op)
+        retry_after = max(b.wait(cost) for b in buckets)
+        if retry_after:
+            name = op if isinstance(op, str) else '?'
+            self.throttled[name] += 1
+            if session:
+                self.throttled_sessions.setdefault(session, Counter())[name] += 1
+            log.debug(f'Rate limited op {name} of session {session}')
+            return retry_after
+
+        for b in buckets:
+            b.take(cost)
+        return None
+
+    def semaphore(self, session:str) -> asyncio.Semaphore:
+        semaphore = self.semaphores.get(session)
+        if semaphore is None:
+            semaphore = self.semaphores[session] = asyncio.Semaphore(self.concurrency)
+        return semaphore
+
+    def close(self, session:str) -> None:
+        self.buckets.pop(session, None)
+        self.semaphores.pop(session, None)
+        self.throttled_sessions.pop(session, None)
+
+    def stats(self) -> dict:
+        return {
+            'throttled': dict(self.throttled),
+            'callers': len(self.callers),
+            'sessions': {s: dict(c) for s, c in self.throttled_sessions.items()}
+        }
@@ -0,0 +1,139 @@
+import asyncio
+from collections import Counter
+from logging import getLogger
+from time import monotonic
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import uuid
+
+log = getLogger(__name__)
+
+
+class StateSnapshot():
+    """
+    Versioned snapshot of the packets a new session needs, shared by all sessions.
+
+    `sections` maps a name to (loader, max_age); a loader returns the packet of
+    its section. Every change of a section's packet bumps the global version and
+    stamps the section with it, so the changes since a version are the sections
+    stamped later. Versions are only comparable within one `epoch` (process).
+    `on_change(name, packet)` is called on every bump, so that connected clients
+    see every version. `identity` maps a section to a function returning the part
+    of its packet that counts as a change; other fields, like a playback position,
+    are served fresh but neither bump the version nor get broadcast.
+    """
+
+    def __init__(self, sections:Dict[str, Tuple[Callable[[], Awaitable[dict]], Optional[float]]],
+                 on_change:Callable[[str, dict], None]=None,
+                 identity:Dict[str, Callable[[dict], Any]]=None) -> None:
+        self.loaders = sections
+        self.on_change = on_change
+        self.identity = identity or {}
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self.lock = asyncio.Lock()
+
+        # name -> (version, captured, packet)
+        self.sections: Dict[str, Tuple[int, float, dict]] = {}
+        # a refresh commits only if no later refresh of the section committed first
+        self.tickets = Counter()
+        self.committed = Counter()
+        # (codec name, since) -> frame, for the current version only
+        self.frames: Dict[Tuple[str, int], Any] = {}
+
+        self.bootstraps = Counter()
+        self.rebuilds = 0
+        self.frame_hits = 0
+
+    @property
+    def token(self) -> str:
+        return f'{self.epoch}:{self.version}'
+
+    def parse_token(self, token:Optional[str]) -> int:
+        # version the client has, 0 if unknown
+        try:
+            epoch, version = token.split(':')
+            version = int(version)
+        except (AttributeError, ValueError):
+            return 0
+        return version if epoch == self.epoch and 0 < version <= self.version else 0
+
+    async def refresh(self, name:str) -> dict:
+        self.tickets[name] += 1
+        ticket = self.tickets[name]
+        packet = await self.loaders[name][0]()
+        if ticket > self.committed[name]:
+            self.committed[name] = ticket
+            self.commit(name, packet)
+        return packet
+
+    def commit(self, name:str, packet:dict) -> None:
+        current = self.sections.get(name)
+        if current and current[2] == packet:
+            self.sections[name] = (current[0], monotonic(), packet)
+            return
+
+        identity = self.identity.get(name)
+        if current and identity and identity(current[2]) == identity(packet):
+            self.sections[name] = (current[0], monotonic(), packet)
+            # only frames holding this section are outdated
+            self.frames = {key: frame for key, frame in self.frames.items() if key[1] >= current[0]}
+            return
+
+        self.version += 1
+        self.sections[name] = (self.version, monotonic(), packet)
+        self.frames.clear()
+        if self.on_change:
+            self.on_change(name, packet)
+
+    def is_stale(self, name:str, now:float) -> bool:
+        if name not in self.sections:
+            return True
+        max_age = self.loaders[name][1]
+        return max_age is not None and now - self.sections[name][1] > max_age
+
+    async def ensure(self) -> None:
+        # concurrent sessions wait for one rebuild instead of each loading
+        async with self.lock:
+            now = monotonic()
+            stale = [name for name in self.loaders if self.is_stale(name, now)]
+            if stale:
+                self.rebuilds += 1
+                await asyncio.gather(*[self.refresh(name) for name in stale])
+
+    def packets(self, since:int=0) -> list:
+        return [self.sections[name][2] for name in self.loaders
+                if name in self.sections and self.sections[name][0] > since]
+
+    async def bootstrap(self, codec, token:Optional[str]=None) -> Any:
+        """
+        One frame with the packets changed since `token`, or all of them
+        """
+        await self.ensure()
+        since = self.parse_token(token)
+        self.bootstraps['delta' if since else 'full'] += 1
+
+        key = (codec.name, since)
+        frame = self.frames.get(key)
+        if frame is not None:
+            self.frame_hits += 1
+            return frame
+
+        frame = self.frames[key] = codec.dumps({
+            'type': 'bootstrap',
+            'data': {
+                'snapshot': self.token,
+                'full': not since,
+                'events': self.packets(since)
+            }
+        })
+        return frame
+
+    def stats(self) -> dict:
+        return {
+            'epoch': self.epoch,
+            'version': self.version,
+            'sections': {name: s[0] for name, s in self.sections.items()},
+            'rebuilds': self.rebuilds,
+            'bootstraps': dict(self.bootstraps),
+            'frame_hits': self.frame_hits
+        }
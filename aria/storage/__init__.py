@@ -0,0 +1,17 @@
+from typing import Dict, Type
+
+from aria.storage.models import Storage
+
+from .http import HTTPStorage
+from .sqlite import SQLiteStorage
+
+STORAGES: Dict[str, Type[Storage]] = {
+    HTTPStorage.name: HTTPStorage,
+    SQLiteStorage.name: SQLiteStorage
+}
+
+
+def create_storage(config) -> Storage:
+    if config.db_backend == SQLiteStorage.name:
+        return SQLiteStorage(config.db_file)
+    return HTTPStorage(config.db_endpoint)
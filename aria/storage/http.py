@@ -0,0 +1,159 @@
+import asyncio
+from functools import partialmethod
+from logging import getLogger
+from typing import Dict, Optional, Sequence
+
+from aria.database import DatabaseError
+from aria.http_client import HTTPClient
+
+from .models import Storage
+
+log = getLogger(__name__)
+
+
+def page_params(limit:int, cursor:Optional[str]) -> dict:
+    params = {"limit": limit}
+    if cursor:
+        params["cursor"] = cursor
+    return params
+
+
+class HTTPStorage(Storage):
+    """
+    Storage served by the aria-database service at `endpoint`
+    """
+    name = 'http'
+
+    def __init__(self, endpoint:str) -> None:
+        self.http = HTTPClient()
+        self.endpoint = endpoint
+        # batch endpoint -> whether the service has it, unknown until first used
+        self.batch_supported: Dict[str, bool] = {}
+        self.probes: Dict[str, asyncio.Lock] = {}
+        log.debug(f"endpoint set to {self.endpoint}")
+
+    async def perform(self, method:str, endpoint:str, *, params:dict=None, json:dict=None) -> Optional[dict]:
+        try:
+            async with self.http.session('database').request(method, f"{self.endpoint}{endpoint}", params=params, json=json) as resp:
+                log.debug(f"{method} {endpoint} (params: {params}, json: {json}) -> {resp.status}")
+                # error bodies are not always JSON
+                if resp.status != 200:
+                    raise DatabaseError(f"{method} {endpoint} -> {resp.status}", status=resp.status)
+                return await resp.json(content_type=None)
+        except DatabaseError as e:
+            raise e
+        except Exception as e:
+            log.error(f"Further information: ", exc_info=True)
+            raise e
+
+    get = partialmethod(perform, "GET")
+    post = partialmethod(perform, "POST")
+    delete = partialmethod(perform, "DELETE")
+
+    async def get_playlists(self) -> Optional[dict]:
+        return await self.get("/playlist")
+
+    async def get_playlist(self, name:str, *, limit:int=1000, cursor:str=None) -> Optional[dict]:
+        return await self.get(f"/playlist/{name}", params=page_params(limit, cursor))
+
+    async def create_playlist(self, name:str) -> None:
+        await self.post("/playlist", params={"name": name})
+
+    async def delete_playlist(self, name:str) -> None:
+        await self.delete(f"/playlist", params={"name": name})
+
+    async def add_to_playlist(self, name:str, uris:Sequence[str]) -> None:
+        await self.post(f"/playlist/{name}", json={"entries": uris})
+
+    async def delete_from_playlist(self, name:str, uri:str) -> None:
+        await self.delete(f"/playlist/{name}", params={"uri": uri})
+
+    async def get_likes(self, *, limit:int=1000, cursor:str=None) -> Optional[dict]:
+        return await self.get("/likes", params=page_params(limit, cursor))
+
+    async def toggle_like(self, uri:str, like:bool) -> None:
+        await self.post("/likes", params={"uri": uri, "like": 1 if like else 0})
+
+    async def toggle_likes(self, likes:Dict[str, bool]) -> None:
+        # {"likes": {uri: bool}}; writes are serialized by the write buffer, so no probe lock
+        endpoint = "/likes/batch"
+        if self.batch_supported.get(endpoint) is not False:
+            try:
+                await self.post(endpoint, json={"likes": likes})
+                self.batch_supported[endpoint] = True
+                return
+            except DatabaseError as e:
+                if e.status not in (404, 405):
+                    raise
+                log.info(f"{endpoint} is not supported by the database service. Using /likes")
+                self.batch_supported[endpoint] = False
+
+        await super().toggle_likes(likes)
+
+    # Batch endpoints take {"uris": [...]} and return {"results": {uri: payload}},
+    # where payload is what the single-key endpoint returns; missing uris are omitted.
+    # Services without them get the single-key endpoint once per uri.
+
+    async def is_liked_many(self, uris:Sequence[str]) -> Dict[str, dict]:
+        return await self.get_many("/likes/resolve/batch", "/likes/resolve", uris)
+
+    async def get_cache_many(self, uris:Sequence[str]) -> Dict[str, dict]:
+        return await self.get_many("/cache/batch", "/cache", uris)
+
+    async def store_cache(self, entries:Sequence[dict]) -> None:
+        await self.post("/cache", json={"entries": entries})
+
+    async def update_gpm(self, entries:Sequence[dict], user:str) -> None:
+        await self.post("/gpm/update", params={"name": user}, json={"entries": entries})
+
+    async def upsert_gpm(self, entries:Sequence[dict], user:str) -> None:
+        await self.post("/gpm/upsert", params={"name": user}, json={"entries": entries})
+
+    async def remove_gpm(self, uris:Sequence[str], user:str) -> None:
+        await self.post("/gpm/remove", params={"name": user}, json={"uris": uris})
+
+    async def search_gpm(self, query:str, *, limit:int=100) -> Optional[dict]:
+        return await self.get("/gpm/search", params={"limit": limit, "query": query})
+
+    async def resolve_gpm_many(self, uris:Sequence[str]) -> Dict[str, dict]:
+        return await self.get_many("/gpm/batch", "/gpm", uris)
+
+    async def get_many(self, endpoint:str, single:str, uris:Sequence[str]) -> Dict[str, dict]:
+        if not uris:
+            return {}
+
+        if endpoint not in self.batch_supported:
+            # one request finds out, concurrent ones wait for it
+            async with self.probes.setdefault(endpoint, asyncio.Lock()):
+                if endpoint not in self.batch_supported:
+                    return await self.get_batch(endpoint, single, uris)
+
+        if self.batch_supported[endpoint]:
+            return await self.get_batch(endpoint, single, uris)
+        return await self.get_each(single, uris)
+
+    async def get_batch(self, endpoint:str, single:str, uris:Sequence[str]) -> Dict[str, dict]:
+        try:
+            payload = await self.post(endpoint, json={"uris": list(uris)})
+        except DatabaseError as e:
+            if e.status not in (404, 405):
+                raise
+            log.info(f"{endpoint} is not supported by the database service. Using {single}")
+            self.batch_supported[endpoint] = False
+            return await self.get_each(single, uris)
+
+        self.batch_supported[endpoint] = True
+        return payload.get("results") or {}
+
+    async def get_each(self, endpoint:str, uris:Sequence[str]) -> Dict[str, dict]:
+        payloads = await asyncio.gather(*[self.get(endpoint, params={"uri": uri}) for uri in uris],
+                                        return_exceptions=True)
+        ret = {}
+        for uri, payload in zip(uris, payloads):
+            # a missing key is a 404 of the single-key endpoint; other errors are failures
+            if isinstance(payload, DatabaseError) and payload.status == 404:
+                continue
+            if isinstance(payload, BaseException):
+                raise payload
+            ret[uri] = payload
+        return ret
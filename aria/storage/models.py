@@ -0,0 +1,77 @@
+import asyncio
+from typing import Dict, Optional, Sequence
+
+
+class Storage():
+    """
+    Persistence of playlists, likes, resolve cache and GPM metadata.
+
+    Playlists: {"id", "name", "length", "thumbnails"}, with "entries" and
+    "next" when a single playlist is requested. Entries: {"source", "title",
+    "uri", "thumbnail", "thumbnail_small", "is_liked", "meta"}.
+    Playlists are read in pages of `limit` entries; "next" is an opaque
+    cursor of the following page, None on the last one.
+    Batch lookups return {uri: payload} and omit unknown uris.
+    Failures raise DatabaseError.
+    """
+    name: str
+
+    async def close(self) -> None:
+        pass
+
+    async def get_playlists(self) -> Optional[dict]:
+        raise NotImplementedError()
+
+    async def get_playlist(self, name:str, *, limit:int=1000, cursor:str=None) -> Optional[dict]:
+        raise NotImplementedError()
+
+    async def create_playlist(self, name:str) -> None:
+        raise NotImplementedError()
+
+    async def delete_playlist(self, name:str) -> None:
+        raise NotImplementedError()
+
+    async def add_to_playlist(self, name:str, uris:Sequence[str]) -> None:
+        raise NotImplementedError()
+
+    async def delete_from_playlist(self, name:str, uri:str) -> None:
+        raise NotImplementedError()
+
+    async def get_likes(self, *, limit:int=1000, cursor:str=None) -> Optional[dict]:
+        raise NotImplementedError()
+
+    async def toggle_like(self, uri:str, like:bool) -> None:
+        raise NotImplementedError()
+
+    async def toggle_likes(self, likes:Dict[str, bool]) -> None:
+        # {uri: like}; one toggle_like each unless the backend can do better
+        await asyncio.gather(*[self.toggle_like(uri, like) for uri, like in likes.items()])
+
+    async def is_liked_many(self, uris:Sequence[str]) -> Dict[str, dict]:
+        # {uri: {"liked"}}
+        raise NotImplementedError()
+
+    async def get_cache_many(self, uris:Sequence[str]) -> Dict[str, dict]:
+        # {uri: {"provider", "title", "uri", "thumbnail", "meta", "liked"}}
+        raise NotImplementedError()
+
+    async def store_cache(self, entries:Sequence[dict]) -> None:
+        raise NotImplementedError()
+
+    async def update_gpm(self, entries:Sequence[dict], user:str) -> None:
+        # replaces the whole library of the user
+        raise NotImplementedError()
+
+    async def upsert_gpm(self, entries:Sequence[dict], user:str) -> None:
+        raise NotImplementedError()
+
+    async def remove_gpm(self, uris:Sequence[str], user:str) -> None:
+        raise NotImplementedError()
+
+    async def search_gpm(self, query:str, *, limit:int=100) -> Optional[dict]:
+        # {"results": [{"gpmUser", "id", "title", "artist", "album", "thumbnail"}]}
+        raise NotImplementedError()
+
+    async def resolve_gpm_many(self, uris:Sequence[str]) -> Dict[str, dict]:
+        # {uri: {"meta": {"gpmUser", "id", ...}, "liked"}}
+        raise NotImplementedError()
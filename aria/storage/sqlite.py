@@ -0,0 +1,394 @@
+import asyncio
+from contextlib import asynccontextmanager
+import json
+from logging import getLogger
+import sqlite3
+from time import time
+from typing import Dict, Optional, Sequence
+
+import aiosqlite
+
+from aria.database import DatabaseError
+
+from .models import Storage
+
+log = getLogger(__name__)
+
+# thumbnails shown for a playlist
+THUMBNAILS = 4
+# statements are constant strings so sqlite3 keeps them prepared;
+# lists of uris are bound as one json array and expanded with json_each
+STATEMENT_CACHE = 64
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    uri TEXT PRIMARY KEY,
+    provider TEXT NOT NULL DEFAULT '',
+    title TEXT NOT NULL DEFAULT '',
+    thumbnail TEXT NOT NULL DEFAULT '',
+    meta TEXT NOT NULL DEFAULT '',
+    updated_at REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS playlists (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS playlist_entries (
+    id INTEGER PRIMARY KEY,
+    playlist_id INTEGER NOT NULL REFERENCES playlists(id) ON DELETE CASCADE,
+    uri TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS playlist_entries_order ON playlist_entries(playlist_id, id);
+CREATE INDEX IF NOT EXISTS playlist_entries_uri ON playlist_entries(playlist_id, uri);
+
+CREATE TABLE IF NOT EXISTS likes (
+    uri TEXT PRIMARY KEY,
+    liked_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS likes_order ON likes(liked_at, uri);
+
+CREATE TABLE IF NOT EXISTS gpm_tracks (
+    uri TEXT PRIMARY KEY,
+    user TEXT NOT NULL,
+    id TEXT NOT NULL,
+    title TEXT NOT NULL DEFAULT '',
+    artist TEXT NOT NULL DEFAULT '',
+    album TEXT NOT NULL DEFAULT '',
+    thumbnail TEXT NOT NULL DEFAULT ''
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS gpm_tracks_user ON gpm_tracks(user);
+"""
+
+# columns of a playlist entry; `x` is the table holding the uri
+ENTRY_COLUMNS = """
+    x.uri AS uri,
+    COALESCE(t.provider, CASE WHEN g.uri IS NOT NULL THEN 'gpm' END, '') AS source,
+    COALESCE(t.title, g.title, '') AS title,
+    COALESCE(NULLIF(t.thumbnail, ''), g.thumbnail, '') AS thumbnail,
+    COALESCE(t.meta, '') AS meta,
+    l.uri IS NOT NULL AS liked
+"""
+ENTRY_JOINS = """
+    LEFT JOIN tracks t ON t.uri = x.uri
+    LEFT JOIN gpm_tracks g ON g.uri = x.uri
+    LEFT JOIN likes l ON l.uri = x.uri
+"""
+
+SELECT_PLAYLISTS = """
+SELECT p.id, p.name, COUNT(e.id) AS length
+FROM playlists p LEFT JOIN playlist_entries e ON e.playlist_id = p.id
+GROUP BY p.id ORDER BY p.id
+"""
+SELECT_PLAYLIST = "SELECT id, name FROM playlists WHERE name = ?"
+COUNT_PLAYLIST = "SELECT COUNT(*) FROM playlist_entries WHERE playlist_id = ?"
+# pages are read by keyset: entries after the last one of the previous page
+SELECT_PLAYLIST_ENTRIES = f"""
+SELECT {ENTRY_COLUMNS}, x.id AS position FROM playlist_entries x {ENTRY_JOINS}
+WHERE x.playlist_id = ? AND x.id > ? ORDER BY x.id LIMIT ?
+"""
+SELECT_PLAYLIST_THUMBNAILS = """
+SELECT COALESCE(NULLIF(t.thumbnail, ''), g.thumbnail) AS thumbnail
+FROM playlist_entries x
+    LEFT JOIN tracks t ON t.uri = x.uri
+    LEFT JOIN gpm_tracks g ON g.uri = x.uri
+WHERE x.playlist_id = ? AND COALESCE(NULLIF(t.thumbnail, ''), g.thumbnail, '') != ''
+ORDER BY x.id LIMIT ?
+"""
+INSERT_PLAYLIST = "INSERT INTO playlists (name) VALUES (?)"
+DELETE_PLAYLIST = "DELETE FROM playlists WHERE name = ?"
+INSERT_PLAYLIST_ENTRY = "INSERT INTO playlist_entries (playlist_id, uri) VALUES (?, ?)"
+DELETE_PLAYLIST_ENTRY = "DELETE FROM playlist_entries WHERE playlist_id = ? AND uri = ?"
+
+COUNT_LIKES = "SELECT COUNT(*) FROM likes"
+SELECT_LIKES = f"""
+SELECT {ENTRY_COLUMNS}, x.liked_at FROM likes x {ENTRY_JOINS}
+WHERE (x.liked_at, x.uri) < (?, ?) ORDER BY x.liked_at DESC, x.uri DESC LIMIT ?
+"""
+SELECT_LIKES_THUMBNAILS = """
+SELECT COALESCE(NULLIF(t.thumbnail, ''), g.thumbnail) AS thumbnail
+FROM likes x
+    LEFT JOIN tracks t ON t.uri = x.uri
+    LEFT JOIN gpm_tracks g ON g.uri = x.uri
+WHERE COALESCE(NULLIF(t.thumbnail, ''), g.thumbnail, '') != ''
+ORDER BY x.liked_at DESC, x.uri DESC LIMIT ?
+"""
+INSERT_LIKE = "INSERT OR IGNORE INTO likes (uri, liked_at) VALUES (?, ?)"
+DELETE_LIKE = "DELETE FROM likes WHERE uri = ?"
+SELECT_LIKED = "SELECT uri FROM likes WHERE uri IN (SELECT value FROM json_each(?))"
+
+SELECT_CACHE = """
+SELECT t.uri, t.provider, t.title, t.thumbnail, t.meta, l.uri IS NOT NULL AS liked
+FROM tracks t LEFT JOIN likes l ON l.uri = t.uri
+WHERE t.uri IN (SELECT value FROM json_each(?))
+"""
+UPSERT_CACHE = """
+INSERT OR REPLACE INTO tracks (uri, provider, title, thumbnail, meta, updated_at)
+VALUES (:uri, :provider, :title, :thumbnail, :meta, :updated_at)
+"""
+
+DELETE_GPM_USER = "DELETE FROM gpm_tracks WHERE user = ?"
+UPSERT_GPM = """
+INSERT OR REPLACE INTO gpm_tracks (uri, user, id, title, artist, album, thumbnail)
+VALUES (:uri, :user, :id, :title, :artist, :album, :thumbnail)
+"""
+DELETE_GPM = "DELETE FROM gpm_tracks WHERE user = ? AND uri IN (SELECT value FROM json_each(?))"
+SEARCH_GPM = """
+SELECT user, id, title, artist, album, thumbnail FROM gpm_tracks
+WHERE (title || ' ' || artist || ' ' || album) LIKE ? ESCAPE '\\'
+LIMIT ?
+"""
+SELECT_GPM = """
+SELECT g.uri, g.user, g.id, g.title, g.artist, g.album, g.thumbnail, l.uri IS NOT NULL AS liked
+FROM gpm_tracks g LEFT JOIN likes l ON l.uri = g.uri
+WHERE g.uri IN (SELECT value FROM json_each(?))
+"""
+
+
+def entry_row(row:sqlite3.Row) -> dict:
+    return {
+        "source": row["source"],
+        "title": row["title"],
+        "uri": row["uri"],
+        "thumbnail": row["thumbnail"],
+        "thumbnail_small": row["thumbnail"],
+        "is_liked": bool(row["liked"]),
+        "meta": row["meta"]
+    }
+
+def gpm_row(row:sqlite3.Row) -> dict:
+    return {
+        "gpmUser": row["user"],
+        "id": row["id"],
+        "title": row["title"],
+        "artist": row["artist"],
+        "album": row["album"],
+        "thumbnail": row["thumbnail"]
+    }
+
+def gpm_params(entry:dict, user:str) -> dict:
+    return {
+        "uri": entry.get("uri"),
+        "user": user,
+        "id": entry.get("id") or '',
+        "title": entry.get("title") or '',
+        "artist": entry.get("artist") or '',
+        "album": entry.get("album") or '',
+        "thumbnail": entry.get("thumbnail") or ''
+    }
+
+def parse_cursor(cursor:Optional[str], default):
+    if not cursor:
+        return default
+    try:
+        return json.loads(cursor)
+    except ValueError:
+        raise DatabaseError(f"Invalid cursor: {cursor}")
+
+def escape_like(s:str) -> str:
+    return s.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class SQLiteStorage(Storage):
+    """
+    Storage in an embedded SQLite database at `db_file`.
+
+    One connection in WAL mode; writes are serialized by `write_lock` so
+    a transaction never picks up statements of another coroutine.
+    """
+    name = 'sqlite'
+
+    def __init__(self, db_file:str) -> None:
+        self.db_file = db_file
+        self.conn: Optional[aiosqlite.Connection] = None
+        self.open_lock = asyncio.Lock()
+        self.write_lock = asyncio.Lock()
+
+    async def connect(self) -> aiosqlite.Connection:
+        if self.conn:
+            return self.conn
+
+        async with self.open_lock:
+            if not self.conn:
+                # autocommit; transactions are opened explicitly in transaction()
+                conn = await aiosqlite.connect(self.db_file, isolation_level=None,
+                                               cached_statements=STATEMENT_CACHE)
+                conn.row_factory = sqlite3.Row
+                await conn.execute("PRAGMA journal_mode=WAL")
+                await conn.execute("PRAGMA synchronous=NORMAL")
+                await conn.execute("PRAGMA foreign_keys=ON")
+                await conn.executescript(SCHEMA)
+                log.info(f"Opened SQLite database {self.db_file}")
+                self.conn = conn
+
+        return self.conn
+
+    async def close(self) -> None:
+        if self.conn:
+            await self.conn.close()
+            self.conn = None
+
+    async def fetchall(self, sql:str, params=()) -> Sequence[sqlite3.Row]:
+        conn = await self.connect()
+        return await conn.execute_fetchall(sql, params)
+
+    async def fetchone(self, sql:str, params=()) -> Optional[sqlite3.Row]:
+        rows = await self.fetchall(sql, params)
+        return rows[0] if rows else None
+
+    @asynccontextmanager
+    async def transaction(self):
+        conn = await self.connect()
+        async with self.write_lock:
+            await conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                await conn.execute("ROLLBACK")
+                raise
+            await conn.execute("COMMIT")
+
+    async def get_playlist_id(self, conn:aiosqlite.Connection, name:str) -> int:
+        rows = await conn.execute_fetchall(SELECT_PLAYLIST, (name,))
+        if not rows:
+            raise DatabaseError(f"No such playlist: {name}")
+        return rows[0]["id"]
+
+    async def get_thumbnails(self, playlist_id:int) -> Sequence[str]:
+        rows = await self.fetchall(SELECT_PLAYLIST_THUMBNAILS, (playlist_id, THUMBNAILS))
+        return [r["thumbnail"] for r in rows]
+
+    async def get_playlists(self) -> Optional[dict]:
+        rows = await self.fetchall(SELECT_PLAYLISTS)
+        return {
+            "playlists": [{
+                "id": r["id"],
+                "name": r["name"],
+                "length": r["length"],
+                "thumbnails": await self.get_thumbnails(r["id"])
+            } for r in rows]
+        }
+
+    async def get_playlist(self, name:str, *, limit:int=1000, cursor:str=None) -> Optional[dict]:
+        playlist = await self.fetchone(SELECT_PLAYLIST, (name,))
+        if not playlist:
+            raise DatabaseError(f"No such playlist: {name}")
+
+        after = parse_cursor(cursor, 0)
+        limit = max(limit, 1)
+        length = await self.fetchone(COUNT_PLAYLIST, (playlist["id"],))
+        # one more row tells whether a next page exists
+        rows = await self.fetchall(SELECT_PLAYLIST_ENTRIES, (playlist["id"], after, limit + 1))
+        return {
+            "id": playlist["id"],
+            "name": playlist["name"],
+            "length": length[0],
+            "thumbnails": await self.get_thumbnails(playlist["id"]),
+            "entries": [entry_row(r) for r in rows[:limit]],
+            "next": json.dumps(rows[limit - 1]["position"]) if len(rows) > limit else None
+        }
+
+    async def create_playlist(self, name:str) -> None:
+        try:
+            async with self.transaction() as conn:
+                await conn.execute(INSERT_PLAYLIST, (name,))
+        except sqlite3.IntegrityError:
+            raise DatabaseError(f"Playlist already exists: {name}")
+
+    async def delete_playlist(self, name:str) -> None:
+        async with self.transaction() as conn:
+            await conn.execute(DELETE_PLAYLIST, (name,))
+
+    async def add_to_playlist(self, name:str, uris:Sequence[str]) -> None:
+        async with self.transaction() as conn:
+            playlist_id = await self.get_playlist_id(conn, name)
+            await conn.executemany(INSERT_PLAYLIST_ENTRY, [(playlist_id, uri) for uri in uris])
+
+    async def delete_from_playlist(self, name:str, uri:str) -> None:
+        async with self.transaction() as conn:
+            playlist_id = await self.get_playlist_id(conn, name)
+            await conn.execute(DELETE_PLAYLIST_ENTRY, (playlist_id, uri))
+
+    async def get_likes(self, *, limit:int=1000, cursor:str=None) -> Optional[dict]:
+        before = parse_cursor(cursor, (float('inf'), ''))
+        limit = max(limit, 1)
+        length = await self.fetchone(COUNT_LIKES)
+        rows = await self.fetchall(SELECT_LIKES, (*before, limit + 1))
+        thumbnails = await self.fetchall(SELECT_LIKES_THUMBNAILS, (THUMBNAILS,))
+        last = rows[limit - 1] if len(rows) > limit else None
+        return {
+            "name": "Likes",
+            "length": length[0],
+            "thumbnails": [r["thumbnail"] for r in thumbnails],
+            "entries": [entry_row(r) for r in rows[:limit]],
+            "next": json.dumps((last["liked_at"], last["uri"])) if last else None
+        }
+
+    async def toggle_like(self, uri:str, like:bool) -> None:
+        async with self.transaction() as conn:
+            if like:
+                await conn.execute(INSERT_LIKE, (uri, time()))
+            else:
+                await conn.execute(DELETE_LIKE, (uri,))
+
+    async def toggle_likes(self, likes:Dict[str, bool]) -> None:
+        now = time()
+        async with self.transaction() as conn:
+            await conn.executemany(INSERT_LIKE, [(uri, now) for uri, like in likes.items() if like])
+            await conn.executemany(DELETE_LIKE, [(uri,) for uri, like in likes.items() if not like])
+
+    async def is_liked_many(self, uris:Sequence[str]) -> Dict[str, dict]:
+        if not uris:
+            return {}
+        rows = await self.fetchall(SELECT_LIKED, (json.dumps(list(uris)),))
+        return {r["uri"]: {"liked": True} for r in rows}
+
+    async def get_cache_many(self, uris:Sequence[str]) -> Dict[str, dict]:
+        if not uris:
+            return {}
+        rows = await self.fetchall(SELECT_CACHE, (json.dumps(list(uris)),))
+        return {r["uri"]: {
+            "provider": r["provider"],
+            "title": r["title"],
+            "uri": r["uri"],
+            "thumbnail": r["thumbnail"],
+            "meta": r["meta"],
+            "liked": bool(r["liked"])
+        } for r in rows}
+
+    async def store_cache(self, entries:Sequence[dict]) -> None:
+        now = time()
+        params = [{
+            "uri": e.get("uri"),
+            "provider": e.get("provider") or '',
+            "title": e.get("title") or '',
+            "thumbnail": e.get("thumbnail") or '',
+            "meta": e.get("meta") or '',
+            "updated_at": now
+        } for e in entries if e.get("uri")]
+        async with self.transaction() as conn:
+            await conn.executemany(UPSERT_CACHE, params)
+
+    async def update_gpm(self, entries:Sequence[dict], user:str) -> None:
+        async with self.transaction() as conn:
+            await conn.execute(DELETE_GPM_USER, (user,))
+            await conn.executemany(UPSERT_GPM, [gpm_params(e, user) for e in entries])
+
+    async def upsert_gpm(self, entries:Sequence[dict], user:str) -> None:
+        async with self.transaction() as conn:
+            await conn.executemany(UPSERT_GPM, [gpm_params(e, user) for e in entries])
+
+    async def remove_gpm(self, uris:Sequence[str], user:str) -> None:
+        async with self.transaction() as conn:
+            await conn.execute(DELETE_GPM, (user, json.dumps(list(uris))))
+
+    async def search_gpm(self, query:str, *, limit:int=100) -> Optional[dict]:
+        rows = await self.fetchall(SEARCH_GPM, (f"%{escape_like(query)}%", limit))
+        return {"results": [gpm_row(r) for r in rows]}
+
+    async def resolve_gpm_many(self, uris:Sequence[str]) -> Dict[str, dict]:
+        if not uris:
+            return {}
+        rows = await self.fetchall(SELECT_GPM, (json.dumps(list(uris)),))
+        return {r["uri"]: {"meta": gpm_row(r), "liked": bool(r["liked"])} for r in rows}
@@ -17,7 +17,8 @@ class StreamPlayer():
 
         self.opus = None
         self.create_opus()
-        self.ffmpeg = FFMpegPlayer(self.opus)
+        self.ffmpeg = FFMpegPlayer(self.opus, passthrough=self.player.view.passthrough_allowed,
+                                   on_fallback=self.player.view.on_player_state_change)
         self.is_paused = False
         self.position = 0.00
 
@@ -25,6 +26,10 @@ class StreamPlayer():
     def current_position(self):
         return self.position
 
+    @property
+    def current_gain(self):
+        return self.ffmpeg.gain
+
     # These control command must be runned **synchronously** 
     def play(self, entry:'PlayableEntry'):
         self.is_paused = True
@@ -41,10 +46,14 @@ class StreamPlayer():
         if self.is_paused:
             return b''
 
-        audio = self.ffmpeg.read()
+        audio, is_opus = self.ffmpeg.read()
         self.position += 0.02
         # log.debug(f'Audio bytes: {len(audio)}')
-        return self.opus.encode(audio, self.opus.SAMPLES_PER_FRAME) if audio else self.play_finished()
+        if not audio:
+            return self.play_finished()
+
+        # passthrough returns opus packets as they are
+        return audio if is_opus else self.opus.encode(audio, self.opus.SAMPLES_PER_FRAME)
 
     def pause(self):
         self.is_paused = True
@@ -0,0 +1,209 @@
+import asyncio
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict
+from heapq import nlargest
+from logging import getLogger
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+import unicodedata
+
+log = getLogger(__name__)
+
+# top-k served from memoized prefixes; requests for more are computed on the fly
+MEMO_SIZE = 20
+# top-k kept per memoized prefix, so that longer prefixes can be answered from it
+MEMO_KEEP = 100
+# prefixes up to this length are memoized eagerly on rebuild, since they match the most keys
+PREWARM_LENGTH = 2
+# longer prefixes with matches memoized at a time, least recently used first out
+MEMO_ENTRIES = 5000
+QUERY_WEIGHT = 5
+RESOLVE_WEIGHT = 2
+MAX_EXTRA = 2000
+
+
+def normalize(text:str) -> str:
+    return ' '.join(unicodedata.normalize('NFKC', text or '').casefold().split())
+
+# (top keys of a prefix, whether they are all keys with the prefix)
+Top = Tuple[List[str], bool]
+
+
+def top_of(keys:List[str], weight:Callable[[str], int], prefix:str, limit:int) -> Top:
+    lo = bisect_left(keys, prefix)
+    hi = bisect_left(keys, prefix + '\U0010ffff', lo)
+    return nlargest(limit, keys[lo:hi], key=weight), hi - lo <= limit
+
+def narrow(top:Top, prefix:str) -> Optional[Top]:
+    """
+    Top of `prefix` from the top of one of its prefixes, or None if that may
+    miss some. Keys with `prefix` that are not in the shorter top weigh no more
+    than those that are, so the filtered list is exact as long as it is long
+    enough to serve or the shorter top had every key.
+    """
+    keys, complete = top
+    narrowed = [k for k in keys if k.startswith(prefix)]
+    if complete or len(narrowed) >= MEMO_SIZE:
+        return narrowed, complete
+    return None
+
+
+class Build(NamedTuple):
+    library: Dict[str, int]
+    display: Dict[str, str]
+    keys: List[str]
+    prewarmed: Dict[str, Top]
+
+
+def build(terms:Iterable[str], extra:Dict[str, int]) -> Build:
+    """
+    Index of `terms` plus the keys of `extra`; touches no shared state, so it
+    can run off the event loop.
+    """
+    library = Counter()
+    display = {}
+    for term in terms:
+        key = normalize(term)
+        if key:
+            library[key] += 1
+            display.setdefault(key, term.strip())
+
+    library = dict(library)
+    keys = sorted(library.keys() | extra.keys())
+    weight = lambda key: library.get(key, 0) + extra.get(key, 0)
+    prewarmed = {}
+    for prefix in {key[:i] for key in keys for i in range(1, PREWARM_LENGTH + 1)}:
+        prewarmed[prefix] = top_of(keys, weight, prefix, MEMO_KEEP)
+    return Build(library, display, keys, prewarmed)
+
+
+class SuggestIndex():
+    """
+    Prefix autocomplete over sorted arrays.
+
+    Keys are normalized phrases kept in one sorted list, so a prefix maps
+    to a contiguous range found with two bisects. The top-k of short prefixes,
+    and of recently asked longer ones with matches, is memoized; a new prefix
+    is answered from the memo of a shorter one when that is exact, so typing
+    rarely scans a range. Only the prefixes of a changed key are invalidated.
+    """
+
+    def __init__(self):
+        self.keys: List[str] = []
+        self.display: Dict[str, str] = {}
+        # weights from provider metadata, replaced on every rebuild
+        self.library: Dict[str, int] = {}
+        # weights from recent queries and resolves, bounded LRU
+        self.extra: 'OrderedDict[str, int]' = OrderedDict()
+        # prefixes up to PREWARM_LENGTH, and an LRU of longer ones
+        self.prewarmed: Dict[str, Top] = {}
+        self.memo: 'OrderedDict[str, Top]' = OrderedDict()
+        # keys added or evicted while a rebuild runs, None when none does
+        self.building: Optional[Set[str]] = None
+        # one rebuild at a time, so each catches up with the changes made during it
+        self.build_lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def weight(self, key:str) -> int:
+        return self.library.get(key, 0) + self.extra.get(key, 0)
+
+    async def load_library(self, terms:List[str]) -> None:
+        # build in a thread, then swap in and catch up with what changed meanwhile
+        async with self.build_lock:
+            self.building = set()
+            try:
+                built = await asyncio.get_event_loop().run_in_executor(None, build, terms, dict(self.extra))
+            finally:
+                changed, self.building = self.building, None
+            self.swap(built, changed)
+
+    def swap(self, built:Build, changed:Set[str]) -> None:
+        self.library = built.library
+        self.display = {**built.display, **{k: self.display[k] for k in self.extra if k in self.display}}
+        self.keys = built.keys
+        self.prewarmed = built.prewarmed
+        self.memo = OrderedDict()
+        for key in changed:
+            pos = bisect_left(self.keys, key)
+            present = pos < len(self.keys) and self.keys[pos] == key
+            if key in self.library or key in self.extra:
+                if not present:
+                    self.keys.insert(pos, key)
+            elif present:
+                del self.keys[pos]
+            self.invalidate(key)
+        log.info(f'Suggest index rebuilt with {len(self.keys)} keys')
+
+    def add(self, term:str, weight:int) -> None:
+        key = normalize(term)
+        if not key:
+            return
+
+        if key not in self.library and key not in self.extra:
+            insort(self.keys, key)
+        self.display[key] = term.strip()
+        self.extra[key] = self.extra.pop(key, 0) + weight
+        self.invalidate(key)
+
+        while len(self.extra) > MAX_EXTRA:
+            old, _ = self.extra.popitem(last=False)
+            if old not in self.library:
+                del self.keys[bisect_left(self.keys, old)]
+                del self.display[old]
+            self.invalidate(old)
+
+    def add_query(self, query:str) -> None:
+        self.add(query, QUERY_WEIGHT)
+
+    def add_resolved(self, title:str) -> None:
+        self.add(title, RESOLVE_WEIGHT)
+
+    def suggest(self, prefix:str, limit:int=10) -> List[str]:
+        key = normalize(prefix)
+        if not key:
+            return []
+
+        if limit <= MEMO_SIZE:
+            top = self.memoized(key)
+        else:
+            top = self.top(key, limit)
+
+        return [self.display[k] for k in top[:limit]]
+
+    def memoized(self, key:str) -> List[str]:
+        short = len(key) <= PREWARM_LENGTH
+        top = self.prewarmed.get(key) if short else self.memo.get(key)
+        if top is not None:
+            if not short:
+                self.memo.move_to_end(key)
+            return top[0]
+
+        top = self.narrowed(key) or top_of(self.keys, self.weight, key, MEMO_KEEP)
+        # prefixes without matches are cheap to answer and not worth keeping
+        if top[0]:
+            if short:
+                self.prewarmed[key] = top
+            else:
+                self.memo[key] = top
+                if len(self.memo) > MEMO_ENTRIES:
+                    self.memo.popitem(last=False)
+        return top[0]
+
+    def narrowed(self, key:str) -> Optional[Top]:
+        # from the longest memoized prefix of `key`
+        for i in range(len(key) - 1, 0, -1):
+            top = self.prewarmed.get(key[:i]) if i <= PREWARM_LENGTH else self.memo.get(key[:i])
+            if top is not None:
+                return narrow(top, key)
+        return None
+
+    def top(self, prefix:str, limit:int) -> List[str]:
+        return top_of(self.keys, self.weight, prefix, limit)[0]
+
+    def invalidate(self, key:str) -> None:
+        if self.building is not None:
+            self.building.add(key)
+        for i in range(1, len(key) + 1):
+            self.prewarmed.pop(key[:i], None)
+            self.memo.pop(key[:i], None)
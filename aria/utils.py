@@ -7,11 +7,23 @@ from functools import partial
 from logging import getLogger
 from pathlib import Path
 from string import ascii_letters, digits
-from typing import Optional
+from typing import Any, Callable, Dict, NamedTuple, Optional
 from aiohttp import web
 
+from aria.exceptions import DownloadError
 from aria.models import EntryOverview
 
+# faster JSON backend when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+# binary player protocol, offered only when installed
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 CHARACTERS = ascii_letters + digits
 KEY_LENGTH = 40
 
@@ -46,13 +58,81 @@ def save_file(filename: str, data: bytes):
     with Path(filename).open('wb') as f:
         f.write(data)
 
+async def download_to_file(session, url:str, filename:str, *, chunk_size:int=64*1024, rate:int=None) -> None:
+    """
+    Stream `url` into `filename` chunk by chunk.
+    If `filename` already has data, resume from its end with an HTTP Range request.
+    `rate` caps the transfer in bytes per second.
+    """
+    loop = asyncio.get_event_loop()
+    path = Path(filename)
+    offset = path.stat().st_size if path.exists() else 0
+    headers = {'Range': f'bytes={offset}-'} if offset else None
+
+    async with session.get(url, headers=headers) as res:
+        if res.status == 416:
+            # partial file does not match the remote one; start over next time
+            path.unlink()
+            raise DownloadError(f'Range not satisfiable for {filename}')
+        if res.status == 200:
+            offset = 0
+        elif res.status != 206:
+            raise DownloadError(f'Unexpected status {res.status} for {filename}')
+
+        expected = offset + res.content_length if res.content_length is not None else None
+        if offset:
+            log.info(f'Resuming {filename} from {offset} bytes')
+
+        received = 0
+        started = loop.time()
+        with path.open('ab' if offset else 'wb') as f:
+            async for chunk in res.content.iter_chunked(chunk_size):
+                await loop.run_in_executor(None, f.write, chunk)
+                received += len(chunk)
+                if rate:
+                    ahead = received / rate - (loop.time() - started)
+                    if ahead > 0:
+                        await asyncio.sleep(ahead)
+
+    if expected is not None and offset + received != expected:
+        raise DownloadError(f'Connection closed at {offset + received}/{expected} bytes for {filename}')
+
 class AriaJSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, EntryOverview):
             return obj.as_dict()
         return super().default(obj)
 
-json_dump = partial(json.dumps, cls=AriaJSONEncoder)
+def json_default(obj):
+    if isinstance(obj, EntryOverview):
+        return obj.as_dict()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+def orjson_dump(obj) -> str:
+    return orjson.dumps(obj, default=json_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+json_dump = orjson_dump if orjson else partial(json.dumps, cls=AriaJSONEncoder)
+
+def msgpack_dump(obj) -> bytes:
+    return msgpack.packb(obj, default=json_default, use_bin_type=True)
+
+def msgpack_load(data:bytes) -> Any:
+    return msgpack.unpackb(data, raw=False)
+
+
+class Codec(NamedTuple):
+    name: str
+    # websocket subprotocol selecting this codec
+    protocol: str
+    dumps: Callable[[Any], Any]
+    loads: Callable[[Any], Any]
+    binary: bool
+
+CODECS: Dict[str, Codec] = {
+    'json': Codec('json', 'aria.json', json_dump, json.loads, False)
+}
+if msgpack:
+    CODECS['msgpack'] = Codec('msgpack', 'aria.msgpack', msgpack_dump, msgpack_load, True)
 
 async def get_duration(filename):
     ret = None
@@ -76,6 +156,31 @@ async def get_duration(filename):
 
     return ret or 0
 
+async def get_audio_stream(filename) -> dict:
+    """
+    codec_name, sample_rate and channels of the first audio stream, without decoding it
+    """
+    ret = {}
+    try:
+        ffprobe = await asyncio.create_subprocess_exec(
+            'ffprobe',
+            *[
+                '-v', 'error',
+                '-select_streams', 'a:0',
+                '-show_entries', 'stream=codec_name,sample_rate,channels',
+                '-of', 'json',
+                filename
+            ],
+            stdout=subprocess.PIPE
+        )
+        stdout, _ = await ffprobe.communicate()
+        ret = json.loads(stdout.decode('utf-8'))['streams'][0]
+        log.info(f'Got audio stream: {ret}')
+    except:
+        log.error('Failed to get audio stream: ', exc_info=True)
+
+    return ret
+
 async def get_volume(filename:str):
     ret = None
     try:
@@ -0,0 +1,46 @@
+"""
+Concurrent single-key like lookups against the database stand-in,
+batched through RequestBatcher or one request each.
+
+    python -m bench.bench_batching
+"""
+import asyncio
+from time import perf_counter
+
+from aria.database import RequestBatcher
+from aria.storage.http import HTTPStorage
+
+from tests.standins import DatabaseStandIn, serve
+
+LOOKUPS = 500
+LATENCY = 0.002
+
+
+async def measure(batch:bool, batched:bool) -> None:
+    db = DatabaseStandIn(batch=batch, latency=LATENCY)
+    db.likes.update(str(i) for i in range(0, LOOKUPS, 2))
+    async with serve(db.app()) as url:
+        storage = HTTPStorage(url)
+        if batched:
+            load = RequestBatcher(storage.is_liked_many).load
+        else:
+            async def load(uri):
+                return (await storage.is_liked_many([uri])).get(uri)
+
+        started = perf_counter()
+        await asyncio.gather(*[load(str(i)) for i in range(LOOKUPS)])
+        elapsed = (perf_counter() - started) * 1000
+
+    print(f"batch endpoints={batch!s:5} batcher={batched!s:5} "
+          f"{elapsed:8.1f} ms, {sum(db.requests.values())} requests")
+
+
+async def main():
+    print(f"{LOOKUPS} concurrent lookups, {LATENCY * 1000} ms service latency")
+    for batch in (True, False):
+        for batched in (True, False):
+            await measure(batch, batched)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,42 @@
+"""
+Encoding a queue broadcast for every socket, or once for all of them,
+with the stdlib json encoder and with orjson.
+
+    python -m bench.bench_broadcast
+"""
+import json
+from functools import partial
+from timeit import repeat
+
+from aria.utils import AriaJSONEncoder, orjson, orjson_dump
+
+from bench.fixtures import entries
+
+SOCKETS = 50
+QUEUES = (100, 1000, 5000)
+RUNS = 5
+
+
+def best_ms(fn) -> float:
+    return min(repeat(fn, number=1, repeat=RUNS)) * 1000
+
+
+def main():
+    encoders = {'json': partial(json.dumps, cls=AriaJSONEncoder)}
+    if orjson:
+        encoders['orjson'] = orjson_dump
+    else:
+        print("orjson is not installed; stdlib json only")
+
+    print(f"queue broadcast to {SOCKETS} sockets, best of {RUNS}")
+    for length in QUEUES:
+        packet = {'type': 'queue', 'data': {'queue': entries(length)}}
+        for name, dumps in encoders.items():
+            per_socket = best_ms(lambda: [dumps(packet) for _ in range(SOCKETS)])
+            once = best_ms(lambda: dumps(packet))
+            print(f"{length:5} entries {name:6} per socket {per_socket:9.2f} ms  "
+                  f"once {once:7.2f} ms  {len(dumps(packet)) / 1024:8.1f} KiB")
+
+
+if __name__ == '__main__':
+    main()
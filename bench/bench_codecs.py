@@ -0,0 +1,37 @@
+"""
+Frame size and encode/decode time of the player socket codecs
+for queue packets of growing length.
+
+    python -m bench.bench_codecs
+"""
+from timeit import repeat
+
+from aria.utils import CODECS
+
+from bench.fixtures import entries
+
+QUEUES = (10, 1000, 10000)
+RUNS = 5
+
+
+def best_ms(fn) -> float:
+    return min(repeat(fn, number=1, repeat=RUNS)) * 1000
+
+
+def main():
+    if 'msgpack' not in CODECS:
+        print("msgpack is not installed; json only")
+
+    print(f"queue packet, best of {RUNS}")
+    for length in QUEUES:
+        packet = {'type': 'queue', 'data': {'queue': entries(length)}}
+        for codec in CODECS.values():
+            frame = codec.dumps(packet)
+            encode = best_ms(lambda: codec.dumps(packet))
+            decode = best_ms(lambda: codec.loads(frame))
+            print(f"{length:5} entries {codec.name:7} {len(frame) / 1024:8.1f} KiB  "
+                  f"encode {encode:7.2f} ms  decode {decode:7.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
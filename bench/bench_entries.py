@@ -0,0 +1,103 @@
+"""
+Memory and serialization of a 10k-entry queue with the slotted models and
+cached as_dict, against the previous shape of the models: instance dicts,
+events created eagerly and as_dict built on every call.
+
+    python -m bench.bench_entries
+"""
+import asyncio
+import tracemalloc
+from timeit import repeat
+
+from aria.models import EntryOverview, PlayableEntry
+from aria.utils import json_dump
+
+from bench.fixtures import entries
+
+QUEUE = 10000
+RUNS = 5
+
+
+class PlainOverview():
+    def __init__(self, source, title, uri, thumbnail=None, thumbnail_small=None, entry=None):
+        self.source = source
+        self.title = title
+        self.uri = uri
+        self.thumbnail = thumbnail or ''
+        self.thumbnail_small = thumbnail_small or self.thumbnail
+        self.entry = entry
+        self.is_liked = False
+
+    def as_dict(self):
+        return {
+            "source": self.source,
+            "title": self.title,
+            "uri": self.uri,
+            "thumbnail": self.thumbnail,
+            "thumbnail_small": self.thumbnail_small,
+            "is_liked": self.is_liked,
+            "entry": self.entry if self.source == 'gpm' else None
+        }
+
+
+class PlainPlayable():
+    def __init__(self, entry):
+        self.title = entry.title
+        self.duration = None
+        self.file = None
+        self.stream_info = {}
+        self.start = asyncio.Event()
+        self.end = asyncio.Event()
+        self.entry = entry
+
+
+class SlottedPlayable(PlayableEntry):
+    __slots__ = ('entry',)
+
+    def __init__(self, entry):
+        super().__init__()
+        self.title = entry.title
+        self.entry = entry
+
+
+def plain(count):
+    return [PlainPlayable(PlainOverview(e.source, e.title, e.uri, e.thumbnail, e.thumbnail_small, e.entry))
+            for e in entries(count)]
+
+
+def slotted(count):
+    return [SlottedPlayable(e) for e in entries(count)]
+
+
+def allocated_mib(build) -> float:
+    tracemalloc.start()
+    queue = build(QUEUE)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del queue
+    return size / 1024 / 1024
+
+
+def best_ms(fn) -> float:
+    return min(repeat(fn, number=1, repeat=RUNS)) * 1000
+
+
+def queue_event(queue):
+    # what PlayerQueue.list and the queue broadcast do on every queue change
+    for item in queue:
+        item.entry.is_liked = False
+    return json_dump({'type': 'queue', 'data': {'queue': [item.entry.as_dict() for item in queue]}})
+
+
+async def main():
+    print(f"{QUEUE} queued entries, best of {RUNS}")
+    for name, build in (('plain', plain), ('slotted', slotted)):
+        memory = allocated_mib(build)
+        queue = build(QUEUE)
+        as_dict = best_ms(lambda: [item.entry.as_dict() for item in queue])
+        event = best_ms(lambda: queue_event(queue))
+        print(f"{name:8} {memory:6.1f} MiB  as_dict {as_dict:6.2f} ms  queue event {event:6.2f} ms")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,23 @@
+"""
+Entries shaped like a GPM library, for the benchmarks.
+"""
+from typing import List
+
+from aria.models import EntryOverview
+
+
+def entries(count:int) -> List[EntryOverview]:
+    ret = []
+    for i in range(count):
+        art = f"https://lh3.googleusercontent.com/{'x' * 80}{i}"
+        ret.append(EntryOverview('gpm', f'Song {i} - Artist {i % 97}', f'gpm:track:user:{i:08x}-song',
+                                 art, art + "=s158-c-e100-rwu-v1", {
+                                     "user": "user",
+                                     "song_id": f"{i:08x}-song",
+                                     "title": f"Song {i}",
+                                     "artist": f"Artist {i % 97}",
+                                     "album": f"Album {i % 311}",
+                                     "albumArtUrl": art,
+                                     "durationMillis": str(180000 + i)
+                                 }))
+    return ret
@@ -1,5 +1,6 @@
 import asyncio
 import logging
+import signal
 
 import aiohttp_cors
 from aiohttp import web
@@ -7,8 +8,11 @@ from aiohttp import web
 from aria.auth import AuthenticateManager
 from aria.config import Config
 from aria.database import Database
+from aria.http_client import HTTPClient
+from aria.media_cache import MediaCache
 from aria.ping import ping
 from aria.player_view import PlayerView
+from aria.storage import create_storage
 from aria.stream_view import StreamView
 
 handler = logging.StreamHandler()
@@ -30,10 +34,19 @@ if __name__ == '__main__':
     log.info("Config loaded:")
     log.info(f"  Player socket: {config.player_socket}")
     log.info(f"  Stream socket: {config.stream_socket}")
-    log.info(f"  Database endpoint: {config.db_endpoint}")
+    log.info(f"  Database backend: {config.db_backend}")
+    if config.db_backend == 'sqlite':
+        log.info(f"  Database file: {config.db_file}")
+    else:
+        log.info(f"  Database endpoint: {config.db_endpoint}")
+        if config.db_socket:
+            log.info(f"  Database socket: {config.db_socket}")
     log.info(f"  Cache directory: {config.cache_dir}")
+    log.info(f"  Cache quota: {config.cache_quota} MB ({config.cache_policy})")
 
-    Database(config.db_endpoint)
+    HTTPClient(config)
+    Database(create_storage(config), cache_ttl=config.db_cache_ttl, write_delay=config.db_write_delay)
+    MediaCache(config.cache_dir, quota=config.cache_quota*1024*1024, policy=config.cache_policy)
     auth = AuthenticateManager(config)
 
     player = PlayerView(config, auth)
@@ -51,6 +64,7 @@ if __name__ == '__main__':
     cors.add(control.add_route('POST', player.post_control))
 
     player_app.router.add_route('GET', '/ping', ping)
+    player_app.router.add_route('GET', '/stats', player.get_stats)
     player_app.router.add_routes([
         web.get("/auth", auth.get_is_valid_invite),
         web.get("/auth/{provider}/register", auth.get_register_url),
@@ -76,5 +90,15 @@ if __name__ == '__main__':
     for site in sites:
         loop.run_until_complete(site.start())
     
+    # docker stop sends SIGTERM; stop the loop so pending writes are flushed below
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, loop.stop)
+
     log.info('Starting server...')
-    loop.run_forever()
+    try:
+        loop.run_forever()
+    finally:
+        log.info('Flushing pending writes...')
+        loop.run_until_complete(Database().close())
+        loop.run_until_complete(MediaCache().close())
+        loop.run_until_complete(HTTPClient().close())
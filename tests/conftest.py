@@ -0,0 +1,18 @@
+import pytest
+
+from aria.database import Database
+from aria.media_cache import MediaCache
+
+SINGLETONS = (Database, MediaCache)
+
+
+@pytest.fixture(autouse=True)
+def fresh_singletons():
+    # singletons keep state across tests otherwise
+    for cls in SINGLETONS:
+        cls.ins = None
+        cls.init = False
+    yield
+    for cls in SINGLETONS:
+        cls.ins = None
+        cls.init = False
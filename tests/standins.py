@@ -0,0 +1,199 @@
+"""
+Local stand-ins for the services aria talks to, for tests and benchmarks.
+"""
+import asyncio
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Dict, Set
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from aria.http_client import HTTPClient
+
+
+def single_of(lookup):
+    # handler of a single-key endpoint, 404 for unknown uris
+    async def handler(self, request):
+        payload = lookup(self, request.query.get('uri'))
+        if payload is None:
+            raise web.HTTPNotFound()
+        return web.json_response(payload)
+    return handler
+
+
+@asynccontextmanager
+async def serve(app:web.Application):
+    """
+    Runs `app` on a local port and yields its base url
+    """
+    server = TestServer(app)
+    await server.start_server()
+    try:
+        yield str(server.make_url('')).rstrip('/')
+    finally:
+        await server.close()
+        # sessions of the shared client are bound to this loop
+        await HTTPClient().close()
+
+
+class DatabaseStandIn():
+    """
+    In-memory aria-database service.
+
+    With `batch=False` it only has the endpoints of the current service;
+    otherwise it also serves the batch and incremental endpoints.
+    `latency` seconds are added to every request; paths in `failing` answer 500.
+    """
+
+    def __init__(self, *, batch:bool=True, latency:float=0) -> None:
+        self.batch = batch
+        self.latency = latency
+        self.failing: Set[str] = set()
+        self.requests = Counter()
+
+        self.likes: Set[str] = set()
+        self.cache: Dict[str, dict] = {}
+        # user -> {uri: entry}
+        self.gpm: Dict[str, Dict[str, dict]] = {}
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.middleware])
+        app.router.add_get('/likes/resolve', self.get_liked)
+        app.router.add_post('/likes', self.post_like)
+        app.router.add_get('/cache', self.get_cache)
+        app.router.add_post('/cache', self.post_cache)
+        app.router.add_get('/gpm', self.get_gpm)
+        app.router.add_get('/gpm/search', self.search_gpm)
+        app.router.add_post('/gpm/update', self.update_gpm)
+        if self.batch:
+            app.router.add_post('/likes/resolve/batch', self.batch_of(self.liked))
+            app.router.add_post('/cache/batch', self.batch_of(self.cached))
+            app.router.add_post('/gpm/batch', self.batch_of(self.gpm_entry))
+            app.router.add_post('/likes/batch', self.post_likes)
+            app.router.add_post('/gpm/upsert', self.upsert_gpm)
+            app.router.add_post('/gpm/remove', self.remove_gpm)
+        return app
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        self.requests[request.path] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if request.path in self.failing:
+            raise web.HTTPInternalServerError()
+        return await handler(request)
+
+    # lookups; None for unknown uris
+
+    def liked(self, uri:str):
+        return {"liked": uri in self.likes}
+
+    def cached(self, uri:str):
+        entry = self.cache.get(uri)
+        return {**entry, "liked": uri in self.likes} if entry else None
+
+    def gpm_entry(self, uri:str):
+        for songs in self.gpm.values():
+            if uri in songs:
+                return {"meta": songs[uri], "liked": uri in self.likes}
+        return None
+
+    get_liked = single_of(liked)
+    get_cache = single_of(cached)
+    get_gpm = single_of(gpm_entry)
+
+    def batch_of(self, lookup):
+        async def handler(request):
+            uris = (await request.json())["uris"]
+            results = {uri: lookup(uri) for uri in uris}
+            return web.json_response({"results": {k: v for k, v in results.items() if v is not None}})
+        return handler
+
+    async def post_like(self, request):
+        uri = request.query['uri']
+        if request.query.get('like') == '1':
+            self.likes.add(uri)
+        else:
+            self.likes.discard(uri)
+        return web.json_response({})
+
+    async def post_likes(self, request):
+        for uri, like in (await request.json())["likes"].items():
+            if like:
+                self.likes.add(uri)
+            else:
+                self.likes.discard(uri)
+        return web.json_response({})
+
+    async def post_cache(self, request):
+        for entry in (await request.json())["entries"]:
+            self.cache[entry["uri"]] = entry
+        return web.json_response({})
+
+    async def search_gpm(self, request):
+        query = request.query['query'].casefold()
+        limit = int(request.query.get('limit', 100))
+        results = [e for songs in self.gpm.values() for e in songs.values()
+                   if query in f"{e['title']} {e['artist']} {e['album']}".casefold()]
+        return web.json_response({"results": results[:limit]})
+
+    async def update_gpm(self, request):
+        entries = (await request.json())["entries"]
+        self.gpm[request.query['name']] = {e["uri"]: e for e in entries}
+        return web.json_response({})
+
+    async def upsert_gpm(self, request):
+        entries = (await request.json())["entries"]
+        self.gpm.setdefault(request.query['name'], {}).update({e["uri"]: e for e in entries})
+        return web.json_response({})
+
+    async def remove_gpm(self, request):
+        songs = self.gpm.setdefault(request.query['name'], {})
+        for uri in (await request.json())["uris"]:
+            songs.pop(uri, None)
+        return web.json_response({})
+
+
+class FileStandIn():
+    """
+    Serves `data` at /file, honoring `Range: bytes=N-`.
+    The first `cuts` responses drop the connection after `cut_after` bytes of body.
+    """
+
+    def __init__(self, data:bytes, *, cuts:int=1, cut_after:int=None) -> None:
+        self.data = data
+        self.cuts = cuts
+        self.cut_after = len(data) // 2 if cut_after is None else cut_after
+        # Range header of each request, None without one
+        self.ranges = []
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/file', self.get_file)
+        return app
+
+    async def get_file(self, request):
+        header = request.headers.get('Range')
+        self.ranges.append(header)
+        start = int(header[len('bytes='):].rstrip('-')) if header else 0
+        if start >= len(self.data):
+            raise web.HTTPRequestRangeNotSatisfiable()
+
+        body = self.data[start:]
+        res = web.StreamResponse(status=206 if header else 200)
+        res.content_length = len(body)
+        if header:
+            res.headers['Content-Range'] = f'bytes {start}-{len(self.data) - 1}/{len(self.data)}'
+        await res.prepare(request)
+
+        if self.cuts:
+            self.cuts -= 1
+            await res.write(body[:self.cut_after])
+            await res.drain()
+            request.transport.close()
+            return res
+
+        await res.write(body)
+        await res.write_eof()
+        return res
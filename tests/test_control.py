@@ -0,0 +1,123 @@
+import asyncio
+from time import perf_counter
+
+from aiohttp import ClientSession, web
+
+from aria.ops import OpRegistry
+from aria.player_view import MAX_BATCH_OPS, OP_INJECTORS, PlayerView, enclose_packet
+from aria.ratelimit import RateLimiter
+
+from .standins import serve
+
+
+class Auth():
+    def __init__(self):
+        self.checks = 0
+
+    async def is_valid_token(self, token, prolong=False):
+        self.checks += 1
+        return token == 'token'
+
+
+class ControlView(PlayerView):
+    """
+    PlayerView with only what /control needs, and ops for the tests
+    """
+
+    def __init__(self, rate_limit=None):
+        self.auth = Auth()
+        self.loop = asyncio.get_event_loop()
+        self.ops = OpRegistry(self, OP_INJECTORS)
+        self.limiter = RateLimiter(rate_limit)
+        self.running = 0
+        self.most_running = 0
+
+    async def op_echo(self, data):
+        return enclose_packet('echo', data)
+
+    async def op_fail(self):
+        raise RuntimeError('boom')
+
+    async def op_wait(self, data):
+        self.running += 1
+        self.most_running = max(self.most_running, self.running)
+        await asyncio.sleep(data['ms'] / 1000)
+        self.running -= 1
+        return enclose_packet('waited', data)
+
+
+def post(payloads, rate_limit=None):
+    # the view is built in the loop that serves it
+    async def main():
+        view = ControlView(rate_limit)
+        app = web.Application()
+        app.router.add_post('/control', view.post_control)
+        async with serve(app) as url, ClientSession() as session:
+            ret = []
+            for payload in payloads:
+                async with session.post(f'{url}/control', json=payload) as res:
+                    body = await res.json() if res.content_type == 'application/json' else None
+                    ret.append((res.status, res.headers.get('Retry-After'), body))
+            return view, ret
+
+    return asyncio.run(main())
+
+
+def test_batch_replies_per_op_in_order():
+    view, [(status, _, body)] = post([{'token': 'token', 'ops': [
+        {'op': 'echo', 'postback': 'p1', 'data': {'n': 1}},
+        {'op': 'fail', 'postback': 'p2'},
+        {'op': 'missing'},
+        {'op': 'echo', 'data': {'n': 2}}
+    ]}])
+
+    assert status == 200
+    first, failed, missing, last = body['results']
+    assert first == {'postback': 'p1', 'type': 'echo', 'data': {'n': 1}}
+    assert failed == {'postback': 'p2', 'type': 'error', 'data': {'op': 'fail'}}
+    assert missing is None
+    assert last['data'] == {'n': 2}
+    # the token is checked once per request, not per op
+    assert view.auth.checks == 1
+
+
+def test_parallel_batch_keeps_order_and_concurrency():
+    ms = [40, 30, 20, 10]
+    started = perf_counter()
+    view, [(status, _, body)] = post([{'token': 'token', 'parallel': True,
+                                       'ops': [{'op': 'wait', 'data': {'ms': m}} for m in ms]}],
+                                     {'session_concurrency': 2})
+
+    assert status == 200
+    assert [r['data']['ms'] for r in body['results']] == ms
+    assert view.most_running == 2
+    assert perf_counter() - started < sum(ms) / 1000
+
+
+def test_batch_rejects():
+    view, replies = post([
+        {'token': 'wrong', 'ops': []},
+        {'token': 'token', 'ops': [{'op': 'echo'}] * (MAX_BATCH_OPS + 1)},
+        {'token': 'token', 'ops': 'echo'},
+        {'token': 'token', 'ops': ['echo']}
+    ])
+
+    assert [status for status, _, _ in replies] == [403, 413, 400, 400]
+    assert view.ops.get('echo').stats.count == 0
+
+
+def test_rate_limited_ops():
+    _, replies = post([
+        {'token': 'token', 'op': 'echo'},
+        {'token': 'token', 'ops': [{'op': 'echo', 'postback': 'a'}, {'op': 'echo', 'postback': 'b'}]},
+        {'token': 'token', 'op': 'echo', 'postback': 'c'}
+    ], {'session_rate': 0.001, 'session_burst': 2})
+
+    assert replies[0][0] == 200
+    status, _, body = replies[1]
+    assert status == 200
+    assert body['results'][0]['type'] == 'echo'
+    assert body['results'][1]['type'] == 'rate_limited' and body['results'][1]['postback'] == 'b'
+    status, retry_after, body = replies[2]
+    assert status == 429 and int(retry_after) > 0
+    assert body['type'] == 'rate_limited' and body['postback'] == 'c' and body['data']['op'] == 'echo'
@@ -0,0 +1,33 @@
+import asyncio
+
+from aria.database import Database
+from aria.storage.sqlite import SQLiteStorage
+
+
+def test_reads_overlay_pending_writes(tmp_path):
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / 'aria.db'))
+        await storage.store_cache([{'uri': 'old', 'provider': 'youtube', 'title': 'Old'},
+                                   {'uri': 'gone', 'provider': 'youtube', 'title': 'Gone'}])
+        await storage.toggle_likes({'old': True, 'gone': True})
+        await storage.create_playlist('pl')
+        await storage.add_to_playlist('pl', ['new', 'old'])
+
+        database = Database(storage, write_delay=60)
+        await database.store_cache([{'uri': 'new', 'provider': 'youtube', 'title': 'New'}])
+        await database.toggle_like('new', True)
+        await database.toggle_like('old', True)
+        await database.toggle_like('gone', False)
+
+        likes = await database.get_likes(10)
+        playlist = await database.get_playlist('pl')
+        written = database.writes['likes'].written + database.writes['cache'].written
+        await database.close()
+        return likes, playlist, written
+
+    likes, playlist, written = asyncio.run(main())
+    # nothing was flushed by the reads
+    assert written == 0
+    assert [e['uri'] for e in likes['entries']] == ['new', 'old']
+    assert likes['entries'][0]['title'] == 'New' and likes['length'] == 2
+    assert [(e['title'], e['is_liked']) for e in playlist['entries']] == [('New', True), ('Old', True)]
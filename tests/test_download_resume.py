@@ -0,0 +1,65 @@
+import asyncio
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from aiohttp import ClientError, ClientSession
+
+from aria.exceptions import DownloadError
+from aria.providers.gpm.gpm import GPMProvider
+from aria.utils import download_to_file
+from tests.standins import FileStandIn, serve
+
+DATA = os.urandom(300 * 1024)
+
+
+def test_resumes_after_cut(tmp_path):
+    server = FileStandIn(DATA, cut_after=100 * 1024)
+    part = tmp_path / 'song.mp3.part'
+
+    async def main():
+        async with serve(server.app()) as url, ClientSession() as session:
+            with pytest.raises((ClientError, DownloadError)):
+                await download_to_file(session, f'{url}/file', str(part), chunk_size=1024)
+            kept = part.stat().st_size
+            await download_to_file(session, f'{url}/file', str(part), chunk_size=1024)
+            return kept
+
+    kept = asyncio.run(main())
+    assert 0 < kept < len(DATA)
+    assert server.ranges == [None, f'bytes={kept}-']
+    assert part.read_bytes() == DATA
+
+
+def test_stale_part_is_dropped(tmp_path):
+    server = FileStandIn(DATA, cuts=0)
+    part = tmp_path / 'song.mp3.part'
+    part.write_bytes(DATA + b'stale')
+
+    async def main():
+        async with serve(server.app()) as url, ClientSession() as session:
+            with pytest.raises(DownloadError):
+                await download_to_file(session, f'{url}/file', str(part))
+            await download_to_file(session, f'{url}/file', str(part))
+
+    asyncio.run(main())
+    assert part.read_bytes() == DATA
+
+
+def test_provider_retries_into_place(tmp_path):
+    server = FileStandIn(DATA, cuts=2, cut_after=64 * 1024)
+    filename = tmp_path / 'song.mp3'
+
+    async def main():
+        async with serve(server.app()) as url, ClientSession() as session:
+            async def get_mp3(user, song_id):
+                return f'{url}/file'
+            provider = SimpleNamespace(get_mp3=get_mp3, downloads=asyncio.Semaphore(1), download_rate=None,
+                                       http=SimpleNamespace(session=lambda name: session))
+            await GPMProvider.download(provider, 'user', 'id', str(filename))
+
+    asyncio.run(main())
+    assert len(server.ranges) == 3 and all(server.ranges[1:])
+    assert filename.read_bytes() == DATA
+    assert not Path(f'{filename}.part').exists()
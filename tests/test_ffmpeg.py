@@ -0,0 +1,83 @@
+import asyncio
+import threading
+from collections import deque
+from types import SimpleNamespace
+
+from aria.ffmpeg import SILENCE, FFMpegPlayer
+from aria.player_view import PlayerView
+
+# one frame of 20 ms CELT fullband, and of 60 ms SILK narrowband
+PACKET_20MS = bytes([31 << 3, 0])
+PACKET_60MS = bytes([3 << 3, 0])
+
+
+class Reader():
+    def __init__(self, packets):
+        self.packets = deque(packets)
+
+    def read_packet(self):
+        return self.packets.popleft() if self.packets else b''
+
+
+class Process():
+    def __init__(self):
+        self.killed = False
+
+    def kill(self):
+        self.killed = True
+
+
+def test_fallback_replaces_the_source_on_the_loop():
+    fallbacks = []
+
+    async def main():
+        player = FFMpegPlayer(None, passthrough=lambda: True, on_fallback=lambda: fallbacks.append(1))
+        old, new = Process(), Process()
+        player.start_pcm = lambda entry: new
+        player.entry = SimpleNamespace(filename='song.opus', volume=0)
+        player.ffmpeg, player.passthrough, player.reader = old, True, Reader([PACKET_60MS, PACKET_60MS])
+
+        # the stream thread only flags the switch
+        reads = []
+        thread = threading.Thread(target=lambda: reads.extend(player.read() for _ in range(2)))
+        thread.start()
+        thread.join()
+        assert reads == [(SILENCE, True), (SILENCE, True)]
+        assert player.ffmpeg is old and not old.killed
+
+        await asyncio.sleep(0)
+        return player, old, new
+
+    player, old, new = asyncio.run(main())
+    assert player.ffmpeg is new and old.killed
+    assert not player.passthrough and player.reader is None and not player.switching
+    assert fallbacks == [1]
+
+
+def test_fallback_is_dropped_after_a_new_entry():
+    async def main():
+        player = FFMpegPlayer(None)
+        player.start_pcm = lambda entry: Process()
+        player.entry = SimpleNamespace(filename='song.opus', volume=0)
+        player.ffmpeg, player.passthrough, player.reader = Process(), True, Reader([PACKET_60MS])
+        player.read()
+        # create() ran for the next entry before the loop got to the switch
+        player.kill()
+        current = player.reader = Reader([PACKET_20MS])
+        await asyncio.sleep(0)
+        return player, current
+
+    player, current = asyncio.run(main())
+    assert player.reader is current and player.passthrough
+    assert player.read() == (PACKET_20MS, True)
+
+
+def test_passthrough_needs_every_client_to_apply_gain():
+    def allowed(enabled, capabilities):
+        view = SimpleNamespace(config=SimpleNamespace(opus_passthrough=enabled),
+                               connections={s: None for s in ('a', 'b')}, capabilities=capabilities)
+        return PlayerView.passthrough_allowed(view)
+
+    assert allowed(True, {'a': {'gain'}, 'b': {'gain'}})
+    assert not allowed(True, {'a': {'gain'}})
+    assert not allowed(False, {'a': {'gain'}, 'b': {'gain'}})
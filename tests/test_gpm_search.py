@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from aria.database import Database
+from aria.providers.gpm.gpm import GPMProvider
+from aria.providers.gpm.index import LibraryIndex
+from aria.providers.gpm.utils import GPMSong
+from aria.storage.http import HTTPStorage
+
+from .standins import DatabaseStandIn, serve
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+
+def song(user, song_id):
+    return GPMSong(user, song_id, f'Region {song_id}', 'Mili', 'Rightfully', '', False)
+
+
+def stored(song):
+    return {'uri': f'gpm:track:{song.user}:{song.song_id}', 'gpmUser': song.user, 'id': song.song_id,
+            'title': song.title, 'artist': song.artist, 'album': song.album, 'thumbnail': ''}
+
+
+def search(db, indexed_users):
+    async def main():
+        async with serve(db.app()) as url:
+            Database(HTTPStorage(url), cache_ttl=0, write_delay=0)
+            provider = GPMProvider()
+            provider.gpm = {'alice': None, 'bob': None}
+            provider.library = LibraryIndex()
+            for user in indexed_users:
+                provider.library.update_user(user, [song(user, f'{user}1')])
+            return await provider.search_local('region')
+
+    return {e.uri for e in asyncio.run(main())}
+
+
+def library_standin():
+    db = DatabaseStandIn()
+    for user in ('alice', 'bob'):
+        db.gpm[user] = {e['uri']: e for e in [stored(song(user, f'{user}1'))]}
+    return db
+
+
+def test_store_serves_users_not_indexed_yet():
+    db = library_standin()
+    uris = search(db, ['alice'])
+
+    assert uris == {'gpm:track:alice:alice1', 'gpm:track:bob:bob1'}
+    assert db.requests['/gpm/search'] == 1
+
+
+def test_index_serves_when_every_user_is_indexed():
+    db = library_standin()
+    uris = search(db, ['alice', 'bob'])
+
+    assert uris == {'gpm:track:alice:alice1', 'gpm:track:bob:bob1'}
+    assert db.requests['/gpm/search'] == 0
+
+
+def test_store_serves_before_any_index():
+    db = library_standin()
+    assert search(db, []) == {'gpm:track:alice:alice1', 'gpm:track:bob:bob1'}
+
+
+def test_index_matches_prefixes_and_single_characters():
+    index = LibraryIndex()
+    index.update_user('alice', [
+        GPMSong('alice', '1', 'Hey Jude', 'The Beatles', '1', '', False),
+        GPMSong('alice', '2', '世界は恋に落ちている', 'CHiCO', '', '', False),
+        GPMSong('alice', '3', 'Beat It', 'Michael Jackson', 'Thriller', '', False)
+    ])
+
+    assert {s.song_id for s in index.search('beat')} == {'1', '3'}
+    assert [s.song_id for s in index.search('the beatl')] == ['1']
+    assert [s.song_id for s in index.search('恋')] == ['2']
+    assert [s.song_id for s in index.search('世界')] == ['2']
+    assert index.search('beatx') == []
+
+    index.update_user('alice', [])
+    assert index.search('beat') == [] and not index.postings
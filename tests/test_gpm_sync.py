@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from aria.database import Database
+from aria.providers.gpm.gpm import SYNC_BATCH, GPMProvider
+from aria.providers.gpm.index import LibraryIndex
+from aria.storage.http import HTTPStorage
+
+from .standins import DatabaseStandIn, serve
+
+SONGS = SYNC_BATCH * 2 + 1
+
+
+class Client():
+    def __init__(self, songs):
+        self.songs = songs
+
+    def get_all_songs(self):
+        return self.songs
+
+
+def songs(count, title='Song'):
+    return [{'id': str(i), 'title': f'{title} {i}', 'artist': 'Artist', 'album': 'Album'}
+            for i in range(count)]
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # no credentials under config/gpm, so no clients are logged in
+    monkeypatch.chdir(tmp_path)
+
+
+def sync(db, libraries):
+    """
+    Syncs each of `libraries` in turn; returns the provider and progress events
+    """
+    progress = []
+
+    async def main():
+        async with serve(db.app()) as url:
+            Database(HTTPStorage(url), cache_ttl=0, write_delay=0)
+            provider = GPMProvider()
+            provider.library = LibraryIndex()
+            for library in libraries:
+                await provider.sync_user('user', Client(library), progress.append)
+            await Database().close()
+            return provider
+
+    return asyncio.run(main()), progress
+
+
+@pytest.mark.parametrize('batch', [True, False])
+def test_first_sync_replaces_whole_library(batch):
+    db = DatabaseStandIn(batch=batch)
+    provider, progress = sync(db, [songs(SONGS)])
+
+    assert len(db.gpm['user']) == SONGS
+    assert len(provider.library.users['user']) == SONGS
+    assert db.requests['/gpm/update'] == 1
+    assert db.requests['/gpm/upsert'] == 0
+    assert progress[-1]['stage'] == 'done'
+
+
+def test_incremental_sync():
+    db = DatabaseStandIn(batch=True)
+    library = songs(SONGS)
+    provider, _ = sync(db, [library, [*library[1:-1], {**library[-1], 'title': 'Changed'}]])
+
+    assert db.requests['/gpm/update'] == 1
+    assert db.requests['/gpm/upsert'] == 1
+    assert db.requests['/gpm/remove'] == 1
+    assert '0' not in {e['id'] for e in db.gpm['user'].values()}
+    assert provider.library.search('changed')
+
+
+def test_falls_back_to_update_without_incremental_endpoints():
+    db = DatabaseStandIn(batch=False)
+    library = songs(SONGS)
+    provider, progress = sync(db, [library, library[1:], library[2:]])
+
+    # upsert is tried once; later syncs go straight to update
+    assert db.requests['/gpm/upsert'] == 0 and db.requests['/gpm/remove'] == 1
+    assert db.requests['/gpm/update'] == 3
+    assert len(db.gpm['user']) == SONGS - 2
+    assert len(provider.library.users['user']) == SONGS - 2
+    assert progress[-1]['stage'] == 'done'
+
+
+def test_failed_remove_keeps_index():
+    db = DatabaseStandIn(batch=True)
+    library = songs(SONGS)
+    db.failing.add('/gpm/remove')
+    provider, progress = sync(db, [library, library[1:]])
+
+    assert progress[-1]['stage'] == 'failed'
+    # the index still holds what the store last accepted, so the next sync retries
+    assert len(provider.library.users['user']) == SONGS
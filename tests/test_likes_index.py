@@ -0,0 +1,37 @@
+from collections import Counter
+
+from aria.playlist import LikesIndex
+
+
+def test_add_remove_keep_positions():
+    likes = LikesIndex()
+    likes.load(['a', 'b', 'c', 'a'])
+    likes.remove('a')
+    likes.add('d')
+    likes.remove('x')
+
+    assert sorted(likes.uris) == ['b', 'c', 'd']
+    assert all(likes.uris[pos] == uri for uri, pos in likes.positions.items())
+
+
+def test_changes_during_load_are_replayed():
+    likes = LikesIndex()
+    likes.begin_load()
+    # liked and disliked while the pages were being read
+    likes.add('new')
+    likes.remove('old')
+    likes.load(['old', 'kept'])
+
+    assert likes.loaded
+    assert 'new' in likes and 'kept' in likes and 'old' not in likes
+    # later changes are applied directly
+    likes.remove('kept')
+    assert 'kept' not in likes and likes.changes is None
+
+
+def test_fresh_sampling_avoids_recent():
+    likes = LikesIndex()
+    likes.load([str(i) for i in range(10)])
+    drawn = Counter(likes.sample_fresh(['0', '1', '2']) for _ in range(5000))
+
+    assert drawn['0'] < drawn['9'] / 2
@@ -0,0 +1,21 @@
+import asyncio
+import json
+
+from aria.media_cache import MANIFEST_FILE, MediaCache
+
+
+def test_close_saves_pending_accesses(tmp_path):
+    (tmp_path/'song.m4a').write_bytes(b'audio')
+
+    async def main():
+        cache = MediaCache(str(tmp_path))
+        cache.add(tmp_path/'song.m4a')
+        assert cache.lookup(tmp_path/'song.m4a')
+        assert cache.save_handle
+        await cache.close()
+        return cache
+
+    cache = asyncio.run(main())
+    assert cache.save_handle is None
+    size, _, hits = json.loads((tmp_path/MANIFEST_FILE).read_text())['song.m4a']
+    assert (size, hits) == (5, 1)
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from aria import ops
+from aria.ops import OpContext, OpRegistry
+
+INJECTORS = {
+    'data': lambda ctx: ctx.data or {},
+    'key': lambda ctx: ctx.key or "",
+    'session': lambda ctx: ctx.session
+}
+
+
+class Target():
+    def __init__(self):
+        self.calls = []
+
+    async def op_echo(self, data, key):
+        self.calls.append((data, key))
+        return {'data': data, 'key': key}
+
+    async def op_fail(self):
+        raise RuntimeError('boom')
+
+    async def op_slow(self, session):
+        await asyncio.sleep(10)
+
+    async def op_unknown_param(self, request):
+        pass
+
+    not_an_op = None
+
+
+def registry(target):
+    return OpRegistry(target, INJECTORS, schemas={'echo': {'uri': str, 'index': (int, float)}})
+
+
+def test_registry_wires_injectors():
+    target = Target()
+    reg = registry(target)
+
+    assert set(reg.ops) == {'echo', 'fail', 'slow'}
+    assert reg.get('unknown_param') is None and reg.get('missing') is None
+
+    ret = asyncio.run(reg.get('echo')(OpContext('k', {'uri': 'a', 'index': 1}, None, 's')))
+    assert ret == {'data': {'uri': 'a', 'index': 1}, 'key': 'k'}
+
+
+@pytest.mark.parametrize('data', [None, [], {}, {'uri': 'a'}, {'uri': 1, 'index': 1}, {'uri': 'a', 'index': '1'}])
+def test_invalid_data_is_rejected(data):
+    target = Target()
+    reg = registry(target)
+
+    assert asyncio.run(reg.get('echo')(OpContext(None, data, None, None))) is None
+    assert target.calls == []
+    assert reg.stats()['echo']['invalid'] == 1 and reg.stats()['echo']['count'] == 0
+
+
+def test_stats_count_errors_cancellations_and_latency(monkeypatch):
+    clock = iter([0, 0.003, 1, 1.2])
+    monkeypatch.setattr(ops, 'perf_counter', lambda: next(clock))
+    reg = registry(Target())
+
+    async def main():
+        await reg.get('echo')(OpContext(None, {'uri': 'a', 'index': 0}, None, None))
+        with pytest.raises(RuntimeError):
+            await reg.get('fail')(OpContext(None, None, None, None))
+
+        monkeypatch.setattr(ops, 'perf_counter', lambda: 0)
+        task = asyncio.ensure_future(reg.get('slow')(OpContext(None, None, None, None)))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    stats = reg.stats()
+    assert stats['echo']['count'] == 1 and stats['echo']['histogram']['<=5'] == 1
+    assert stats['fail']['errors'] == 1 and stats['fail']['histogram']['<=250'] == 1
+    assert stats['fail']['max_ms'] == pytest.approx(200)
+    assert stats['slow']['cancelled'] == 1 and stats['slow']['errors'] == 0
@@ -0,0 +1,86 @@
+import asyncio
+from types import SimpleNamespace
+
+from aria.player import PlayerQueue
+from aria.player_view import PlayerView
+from aria.playlist import PlaylistManager
+
+
+class Queue(PlayerQueue):
+    async def prepare(self, entry):
+        self.prepared.append(entry)
+
+
+class Playlists():
+    def __init__(self, uris, limit):
+        self.uris = uris
+        self.limit = limit
+        self.pages = 0
+
+    async def get_page(self, name, *, limit, cursor=None):
+        start = cursor or 0
+        self.pages += 1
+        end = start + min(limit, self.limit)
+        return {'entries': [{'uri': u} for u in self.uris[start:end]],
+                'next': end if end < len(self.uris) else None}
+
+    iter_playlist = PlaylistManager.iter_playlist
+
+
+def view_of(uris, limit=2):
+    # called in the loop running the op, which PlayerQueue binds to
+    playlists = Playlists(uris, limit)
+    sent = []
+    resolved = []
+
+    async def resolve_playable(uris):
+        resolved.append(list(uris))
+        return [f'entry:{u}' for u in uris]
+
+    async def send_json(session, ws, packet):
+        sent.append(packet)
+
+    noop = lambda *args: None
+    player = SimpleNamespace(view=SimpleNamespace(on_queue_change=noop, on_queue_empty=noop),
+                             on_entry_added=noop)
+    view = SimpleNamespace(playlist=playlists, send_json=send_json,
+                           manager=SimpleNamespace(resolve_playable=resolve_playable),
+                           sent=sent, resolved=resolved)
+    view.stream_playlist = PlayerView.stream_playlist.__get__(view)
+    view.player = SimpleNamespace(queue=Queue(player))
+    view.player.queue.prepared = []
+    return view
+
+
+def run_op(uris, op, *args, queued=()):
+    async def main():
+        view = view_of(uris)
+        view.player.queue.queue.extend(queued)
+        await op(view, *args)
+        # let the prepare tasks run
+        await asyncio.sleep(0)
+        return view
+
+    return asyncio.run(main())
+
+
+def test_queue_resolves_page_by_page():
+    view = run_op(['a', 'b', 'c', 'd', 'e'], PlayerView.op_queue, {'playlist': 'pl'})
+
+    assert view.resolved == [['a', 'b'], ['c', 'd'], ['e']]
+    assert list(view.player.queue.queue) == [f'entry:{u}' for u in 'abcde']
+    assert view.player.queue.prepared[0] == 'entry:a'
+
+
+def test_queue_at_head_keeps_playlist_order():
+    view = run_op(['a', 'b', 'c'], PlayerView.op_queue, {'playlist': 'pl', 'head': True}, queued=['old'])
+
+    assert list(view.player.queue.queue) == ['entry:a', 'entry:b', 'entry:c', 'old']
+
+
+def test_stream_chunks_echo_postback():
+    view = run_op(['a', 'b', 'c'], PlayerView.op_playlist, {'name': 'pl', 'stream': True}, object(), 'session', 'p1')
+
+    assert [p['postback'] for p in view.sent] == ['p1', 'p1']
+    assert [p['type'] for p in view.sent] == ['playlist_chunk'] * 2
+    assert [p['data']['offset'] for p in view.sent] == [0, 2]
@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from aria import ratelimit
+from aria.ratelimit import RateLimiter, TokenBucket
+
+CONFIG = {'session_rate': 2, 'session_burst': 4, 'global_rate': 10, 'global_burst': 10,
+          'costs': {'search': 2}}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(ratelimit, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_bucket_refills_up_to_burst(clock):
+    bucket = TokenBucket(2, 4)
+    bucket.take(4)
+    assert bucket.wait(1) == pytest.approx(0.5)
+
+    clock[0] += 1
+    assert bucket.wait(2) == 0
+    clock[0] += 100
+    bucket.wait(1)
+    assert bucket.tokens == 4
+    # costs above the burst are capped so they can run at all
+    assert bucket.wait(10) == 0
+
+
+def test_throttled_op_takes_nothing(clock):
+    limiter = RateLimiter(CONFIG)
+    assert limiter.check('s', 'search') is None
+    assert limiter.check('s', 'search') is None
+    assert limiter.check('s', 'search') == pytest.approx(1)
+    assert limiter.buckets['s'].tokens == 0 and limiter.bucket.tokens == 6
+
+    clock[0] += 0.5
+    # one token is back, still short of a search, but enough for a like
+    assert limiter.check('s', 'search') == pytest.approx(0.5)
+    assert limiter.check('s', 'like') is None
+    assert limiter.stats()['throttled'] == {'search': 2}
+    assert limiter.stats()['sessions'] == {'s': {'search': 2}}
+
+
+def test_global_bucket_limits_all_sessions(clock):
+    limiter = RateLimiter(CONFIG)
+    for session in ('a', 'b'):
+        for _ in range(2):
+            assert limiter.check(session, 'search') is None
+    assert limiter.check('c', 'search') is None
+    assert limiter.check('d', 'search') == pytest.approx(0.2)
+    assert limiter.check(None, 'other') == pytest.approx(0.1)
+
+
+def test_bounded_ops_skip_the_session_bucket(clock):
+    limiter = RateLimiter(CONFIG)
+    for _ in range(4):
+        assert limiter.check('s', 'search', bounded=True) is None
+    assert 's' not in limiter.buckets
+
+    limiter.refund('search')
+    assert limiter.bucket.tokens == 4
+
+
+def test_callers_have_their_own_buckets(clock):
+    limiter = RateLimiter(CONFIG)
+    assert limiter.check_caller('token', 'search') is None
+    assert limiter.check_caller('token', 'search') is None
+    assert limiter.check_caller('token', 'search') == pytest.approx(1)
+    assert limiter.check_caller('other', 'search') is None
+    assert limiter.check('s', 'search') is None
+    assert 'token' not in str(limiter.stats())
+
+
+def test_idle_callers_are_pruned(clock, monkeypatch):
+    monkeypatch.setattr(ratelimit, 'CALLERS_PRUNE_AT', 2)
+    limiter = RateLimiter({**CONFIG, 'global_burst': 100})
+    limiter.prune_at = 2
+    limiter.check_caller('a', 'search')
+    limiter.check_caller('b', 'play')
+    clock[0] += 10
+    limiter.check_caller('a', 'search')
+    limiter.check_caller('c', 'search')
+    # b refilled and is dropped, a still owes tokens
+    assert len(limiter.callers) == 2 and limiter.stats()['callers'] == 2
+
+
+def test_close_forgets_the_session(clock):
+    limiter = RateLimiter(CONFIG)
+
+    async def main():
+        async with limiter.semaphore('s'):
+            pass
+        assert limiter.semaphore('s') is limiter.semaphore('s')
+        assert limiter.semaphore('s')._value == CONFIG.get('session_concurrency', ratelimit.SESSION_CONCURRENCY)
+
+    asyncio.run(main())
+    for _ in range(3):
+        limiter.check('s', 'search')
+    limiter.close('s')
+    assert 's' not in limiter.buckets and 's' not in limiter.semaphores
+    assert limiter.stats()['sessions'] == {} and limiter.stats()['throttled'] == {'search': 1}
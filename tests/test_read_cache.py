@@ -0,0 +1,34 @@
+import asyncio
+
+from aria import database
+from aria.database import ReadCache
+
+
+def test_reads_per_key_are_bounded_and_expire(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(database, 'monotonic', lambda: now[0])
+    cache = ReadCache(10, per_key=3)
+    loads = []
+
+    async def read(page):
+        async def loader():
+            loads.append(page)
+            return page
+        return await cache.get('likes', page, loader)
+
+    async def main():
+        for page in range(5):
+            await read(page)
+        assert list(cache.entries['likes']) == [2, 3, 4]
+
+        # a hit keeps the page, the least recently used goes
+        await read(2)
+        await read(5)
+        assert list(cache.entries['likes']) == [4, 2, 5]
+
+        now[0] = 11
+        await read(6)
+        assert list(cache.entries['likes']) == [6]
+
+    asyncio.run(main())
+    assert loads == [0, 1, 2, 3, 4, 5, 6]
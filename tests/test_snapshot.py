@@ -0,0 +1,84 @@
+import asyncio
+import json
+
+from aria.player_view import state_identity
+from aria.snapshot import StateSnapshot
+from aria.utils import CODECS
+
+JSON = CODECS['json']
+
+
+class Player():
+    def __init__(self):
+        self.queue = ['a']
+        self.position = 0
+        self.loads = 0
+
+    async def queue_packet(self):
+        self.loads += 1
+        await asyncio.sleep(0.01)
+        return {'type': 'event_queue_change', 'data': {'queue': list(self.queue)}}
+
+    async def state_packet(self):
+        return {'type': 'event_player_state_change', 'data': {
+            'state': 'playing', 'entry': {'uri': 'a', 'position': self.position}}}
+
+
+def snapshot(player, changes):
+    return StateSnapshot({
+        'queue': (player.queue_packet, None),
+        'state': (player.state_packet, 0)
+    }, on_change=lambda name, packet: changes.append(name), identity={'state': state_identity})
+
+
+def test_concurrent_bootstraps_share_one_build():
+    player, changes = Player(), []
+
+    async def main():
+        s = snapshot(player, changes)
+        return await asyncio.gather(*[s.bootstrap(JSON) for _ in range(20)])
+
+    frames = asyncio.run(main())
+    assert player.loads == 1
+    assert len(set(frames)) == 1
+    assert [e['type'] for e in json.loads(frames[0])['data']['events']] == \
+        ['event_queue_change', 'event_player_state_change']
+
+
+def test_delta_since_token():
+    player, changes = Player(), []
+
+    async def main():
+        s = snapshot(player, changes)
+        await s.bootstrap(JSON)
+        token = s.token
+        player.queue.append('b')
+        await s.refresh('queue')
+        return json.loads(await s.bootstrap(JSON, token)), json.loads(await s.bootstrap(JSON, s.token))
+
+    delta, current = asyncio.run(main())
+    assert not delta['data']['full']
+    assert delta['data']['events'] == [{'type': 'event_queue_change', 'data': {'queue': ['a', 'b']}}]
+    assert current['data']['events'] == []
+
+
+def test_position_is_served_fresh_without_new_versions():
+    player, changes = Player(), []
+
+    async def main():
+        s = snapshot(player, changes)
+        await s.bootstrap(JSON)
+        token, version = s.token, s.version
+        player.position = 42
+        full = json.loads(await s.bootstrap(JSON))
+        delta = await s.bootstrap(JSON, token)
+        delta_again = await s.bootstrap(JSON, token)
+        return s, version, full, delta, delta_again
+
+    s, version, full, delta, delta_again = asyncio.run(main())
+    assert s.version == version
+    assert sorted(changes) == ['queue', 'state']
+    assert full['data']['events'][1]['data']['entry']['position'] == 42
+    assert json.loads(delta)['data']['events'] == []
+    # frames without the state section stay cached
+    assert delta is delta_again
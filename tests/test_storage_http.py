@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from aria.database import DatabaseError, RequestBatcher
+from aria.storage.http import HTTPStorage
+
+from .standins import DatabaseStandIn, serve
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def lookups(db:DatabaseStandIn):
+    db.likes.update({'a', 'c'})
+    db.cache['a'] = {'uri': 'a', 'title': 'A', 'provider': 'youtube', 'thumbnail': '', 'meta': ''}
+    db.gpm['user'] = {'g': {'uri': 'g', 'gpmUser': 'user', 'id': 'g', 'title': 'G',
+                            'artist': '', 'album': '', 'thumbnail': ''}}
+
+    async def main():
+        async with serve(db.app()) as url:
+            storage = HTTPStorage(url)
+            liked = await storage.is_liked_many(['a', 'b', 'c'])
+            cached = await storage.get_cache_many(['a', 'b'])
+            gpm = await storage.resolve_gpm_many(['g', 'x'])
+            again = await storage.is_liked_many(['a'])
+            return liked, cached, gpm, again
+
+    return run(main())
+
+
+def test_batch_endpoints():
+    db = DatabaseStandIn(batch=True)
+    liked, cached, gpm, again = lookups(db)
+
+    assert liked == {'a': {'liked': True}, 'b': {'liked': False}, 'c': {'liked': True}}
+    assert cached['a']['title'] == 'A' and 'b' not in cached
+    assert gpm['g']['meta']['id'] == 'g' and 'x' not in gpm
+    assert db.requests['/likes/resolve/batch'] == 2
+    assert db.requests['/likes/resolve'] == 0
+
+
+def test_single_key_fallback():
+    db = DatabaseStandIn(batch=False)
+    liked, cached, gpm, again = lookups(db)
+
+    assert liked == {'a': {'liked': True}, 'b': {'liked': False}, 'c': {'liked': True}}
+    assert again == {'a': {'liked': True}}
+    # unknown uris are 404 on the single-key endpoints and omitted
+    assert cached['a']['title'] == 'A' and 'b' not in cached
+    assert gpm['g']['meta']['id'] == 'g' and 'x' not in gpm
+    # the missing batch endpoint is tried once
+    assert db.requests['/likes/resolve/batch'] == 1
+    assert db.requests['/likes/resolve'] == 4
+
+
+def test_batcher_collects_concurrent_loads():
+    db = DatabaseStandIn(batch=True)
+    db.likes.update(str(i) for i in range(0, 50, 2))
+
+    async def main():
+        async with serve(db.app()) as url:
+            batcher = RequestBatcher(HTTPStorage(url).is_liked_many)
+            return await asyncio.gather(*[batcher.load(str(i)) for i in range(50)])
+
+    results = run(main())
+    assert [r['liked'] for r in results] == [i % 2 == 0 for i in range(50)]
+    assert db.requests['/likes/resolve/batch'] == 1
+
+
+def test_single_key_failures_are_not_misses():
+    db = DatabaseStandIn(batch=False)
+    db.cache['a'] = {'uri': 'a', 'title': 'A', 'provider': 'youtube', 'thumbnail': '', 'meta': ''}
+    db.failing.add('/cache')
+
+    async def main():
+        async with serve(db.app()) as url:
+            with pytest.raises(DatabaseError) as e:
+                await HTTPStorage(url).get_cache_many(['a', 'b'])
+            return e.value.status
+
+    assert run(main()) == 500
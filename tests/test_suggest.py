@@ -0,0 +1,95 @@
+import asyncio
+
+from aria import suggest
+from aria.suggest import SuggestIndex
+
+TERMS = ['Region', 'Rightfully', 'Rubik', 'Mili', 'Ga1ahad and Scientific Witchery']
+
+
+def load(index, terms):
+    asyncio.run(index.load_library(terms))
+
+
+def test_ranked_completions():
+    index = SuggestIndex()
+    load(index, TERMS + ['Rightfully'])
+    index.add_query('Rubik')
+
+    assert index.suggest('r', 3) == ['Rubik', 'Rightfully', 'Region']
+    assert index.suggest('  RI ') == ['Rightfully']
+    assert index.suggest('') == []
+
+
+def test_memo_is_bounded_and_skips_misses(monkeypatch):
+    monkeypatch.setattr(suggest, 'MEMO_ENTRIES', 10)
+    index = SuggestIndex()
+    load(index, [f'song {i:04}' for i in range(100)])
+
+    for i in range(100):
+        index.suggest(f'song {i:04}')
+        index.suggest(f'missing {i}')
+
+    assert len(index.memo) == 10
+    assert not any(key.startswith('missing') for key in index.memo)
+    assert 'zz' not in index.prewarmed and index.suggest('zz') == [] and 'zz' not in index.prewarmed
+
+
+def test_adds_during_rebuild_are_kept():
+    index = SuggestIndex()
+    load(index, TERMS)
+    index.add_query('Gone')
+    index.suggest('ro')
+
+    async def main():
+        rebuild = asyncio.ensure_future(index.load_library(TERMS + ['Rolling Girl']))
+        # let the rebuild start its thread
+        await asyncio.sleep(0)
+        index.add_query('Romeo')
+        await rebuild
+
+    asyncio.run(main())
+    assert index.suggest('ro') == ['Romeo', 'Rolling Girl']
+    assert index.suggest('gone') == ['Gone']
+    assert index.keys == sorted(index.keys)
+
+
+def test_longer_prefixes_narrow_the_memo(monkeypatch):
+    index = SuggestIndex()
+    heavy = [f'the {i:03}' for i in range(0, 300, 7)]
+    load(index, [f'the {i:03}' for i in range(300)] + [f'thx {i}' for i in range(30)] + heavy)
+
+    scans = []
+    top_of = suggest.top_of
+    monkeypatch.setattr(suggest, 'top_of', lambda *args: scans.append(args[2]) or top_of(*args))
+
+    def expected(prefix, limit=10):
+        keys = [k for k in index.keys if k.startswith(prefix)]
+        return sorted(keys, key=lambda k: (-index.weight(k), k))[:limit]
+
+    # 'th' keeps its 100 heaviest keys, which answer 'the' and then 'the 0'
+    for prefix in ('the', 'the 0'):
+        assert index.suggest(prefix, 10) == expected(prefix)
+    assert scans == []
+    # 'the 01' has fewer keys than a memo serves, so its range is scanned, once
+    assert index.suggest('the 01', 10) == expected('the 01')
+    assert index.suggest('the 015', 10) == expected('the 015')
+
+    # 'th' holds no 'thx' key, so that one is scanned
+    assert index.suggest('thx', 3) == expected('thx', 3)
+    assert index.suggest('thx 1', 3) == expected('thx 1', 3)
+    assert scans == ['the 01', 'thx']
+
+
+def test_overlapping_rebuilds_publish_in_order():
+    index = SuggestIndex()
+
+    async def main():
+        first = asyncio.ensure_future(index.load_library(['Old']))
+        second = asyncio.ensure_future(index.load_library(['New']))
+        await asyncio.sleep(0)
+        index.add_query('Typed')
+        await asyncio.gather(first, second)
+
+    asyncio.run(main())
+    assert index.suggest('new') == ['New'] and index.suggest('old') == []
+    assert index.suggest('typed') == ['Typed']
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from aria.database import Database, WriteBuffer
+from aria.storage.http import HTTPStorage
+
+from .standins import DatabaseStandIn, serve
+
+
+@pytest.mark.parametrize('batch', [True, False])
+def test_likes_are_coalesced_and_written(batch):
+    db = DatabaseStandIn(batch=batch)
+    db.likes.add('old')
+
+    async def main():
+        async with serve(db.app()) as url:
+            database = Database(HTTPStorage(url), cache_ttl=0, write_delay=0.01)
+            for uri in ('a', 'b', 'old'):
+                await database.toggle_like(uri, True)
+            await database.toggle_like('b', False)
+            await database.toggle_like('old', False)
+            # pending writes are visible before they are flushed
+            assert (await database.is_liked('a')) == {'liked': True}
+            await database.close()
+
+    asyncio.run(main())
+    assert db.likes == {'a'}
+    if batch:
+        assert db.requests['/likes/batch'] == 1 and db.requests['/likes'] == 0
+    else:
+        assert db.requests['/likes/batch'] == 1 and db.requests['/likes'] == 3
+
+
+def test_dropped_batch_is_reported():
+    dropped = []
+
+    async def main():
+        async def write_many(batch):
+            raise RuntimeError('down')
+
+        buffer = WriteBuffer(write_many, delay=0, retries=1, backoff=0.01)
+        buffer.on_drop = dropped.append
+        buffer.put('a', True)
+        buffer.put('a', False)
+        await asyncio.sleep(0.1)
+        return buffer.stats()
+
+    stats = asyncio.run(main())
+    assert dropped == [{'a': False}]
+    assert stats['dropped'] == 1 and stats['retried'] == 1 and stats['coalesced'] == 1
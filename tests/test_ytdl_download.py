@@ -0,0 +1,74 @@
+import asyncio
+from pathlib import Path
+
+from aria.database import Database
+from aria.media_cache import MediaCache
+from aria.models import EntryOverview
+from aria.providers.ytdl import YTDLMeta, YTDLProvider
+from aria.storage.http import HTTPStorage
+
+
+def song(uri, video_id='X'):
+    meta = YTDLMeta(id=video_id, title='Title', extractor='youtube', extractor_key='Youtube')
+    return EntryOverview('ytdl', 'Title', uri, entry=meta)
+
+
+def download_all(tmp_path, songs, cancel_waiters=False):
+    calls = []
+
+    async def main():
+        Database(HTTPStorage('http://unused'))
+        cache = MediaCache(str(tmp_path))
+        provider = YTDLProvider()
+
+        async def do_download(uri, cache_dir):
+            calls.append(uri)
+            filename = Path(cache_dir)/f'youtube-{len(calls)}.m4a'
+            await asyncio.sleep(0.05)
+            filename.write_bytes(b'audio')
+            return str(filename)
+
+        provider.do_download = do_download
+        waiters = [asyncio.ensure_future(provider.download(s, str(tmp_path))) for s in songs]
+        if cancel_waiters:
+            await asyncio.sleep(0.01)
+            for waiter in waiters:
+                waiter.cancel()
+            await asyncio.sleep(0.1)
+            return [], cache
+        return await asyncio.gather(*waiters), cache
+
+    results, cache = asyncio.run(main())
+    return calls, results, cache
+
+
+def test_urls_of_one_video_share_a_download(tmp_path):
+    calls, results, cache = download_all(tmp_path, [
+        song('https://youtu.be/X'),
+        song('https://www.youtube.com/watch?v=X'),
+        song('https://www.youtube.com/watch?v=Y', 'Y')
+    ])
+
+    assert calls == ['https://youtu.be/X', 'https://www.youtube.com/watch?v=Y']
+    assert results[0] == results[1] != results[2]
+    assert all(cache.contains(r) for r in results)
+
+
+def test_download_is_cached_when_every_waiter_is_cancelled(tmp_path):
+    calls, _, cache = download_all(tmp_path, [song('https://youtu.be/X')], cancel_waiters=True)
+
+    assert len(calls) == 1
+    assert cache.contains(str(tmp_path/'youtube-1.m4a'))
+
+
+def test_meta_keeps_media_urls_of_flat_entries_only():
+    full = YTDLMeta.from_info({
+        'id': 'X', 'title': 'Title', 'webpage_url': 'https://www.youtube.com/watch?v=X',
+        'url': 'https://r1---sn.googlevideo.com/videoplayback?expire=1', 'ie_key': 'Youtube',
+        'extractor': 'youtube', 'formats': [{}] * 20
+    })
+    flat = YTDLMeta.from_info({'_type': 'url', 'id': 'Y', 'url': 'Y', 'ie_key': 'Youtube', 'title': 'Flat'})
+
+    assert full.url is None and full.ie_key is None and not full.flat
+    assert full.webpage_url == 'https://www.youtube.com/watch?v=X'
+    assert flat.flat and flat.url == 'Y' and flat.ie_key == 'Youtube'